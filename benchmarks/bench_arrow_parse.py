@@ -0,0 +1,64 @@
+"""
+Parse + render benchmark: pandas C engine + coerce_df vs the Arrow-native path.
+
+"Render" is the Arrow IPC serialization st.dataframe does for every table,
+so it is measured directly instead of through a Streamlit server.
+
+    python benchmarks/bench_arrow_parse.py --rows 500000
+"""
+import argparse
+import os
+import sys
+import time
+
+import pandas as pd
+import pyarrow as pa
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from recon_core import MONEY_COLS_PG, coerce_df, read_csv_arrow  # noqa: E402
+from synthetic import make_pg_forward, to_csv_file  # noqa: E402
+
+
+def render(df):
+    tbl = pa.Table.from_pandas(df, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, tbl.schema) as w:
+        w.write_table(tbl)
+    return sink.getvalue().size
+
+
+def run(label, parse, upload, repeat):
+    best_parse = best_render = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        df = parse(upload)
+        t1 = time.perf_counter()
+        render(df)
+        t2 = time.perf_counter()
+        best_parse, best_render = min(best_parse, t1 - t0), min(best_render, t2 - t1)
+    print(f"{label:<28} parse {best_parse:7.3f}s   render {best_render:7.3f}s   "
+          f"total {best_parse + best_render:7.3f}s")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--rows', type=int, default=200_000)
+    ap.add_argument('--repeat', type=int, default=3)
+    args = ap.parse_args()
+
+    upload = to_csv_file(make_pg_forward(args.rows), 'pg_forward.csv')
+    print(f"PG Forward: {args.rows:,} rows, {len(upload.getvalue()) / 1e6:.1f} MB CSV")
+
+    def pandas_path(f):
+        f.seek(0)
+        return coerce_df(pd.read_csv(f), MONEY_COLS_PG)
+
+    def arrow_path(f):
+        return coerce_df(read_csv_arrow(f, MONEY_COLS_PG), MONEY_COLS_PG)
+
+    run('pd.read_csv + coerce_df', pandas_path, upload, args.repeat)
+    run('pyarrow.csv (Arrow dtypes)', arrow_path, upload, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
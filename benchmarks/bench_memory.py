@@ -0,0 +1,161 @@
+"""
+Peak-memory benchmark: the tab pipelines with defensive .copy() calls vs the
+copy-on-write version (projection before filtering, no copies of views).
+
+Each variant runs in a fresh interpreter; a sampler thread polls the resident
+set size while the pipeline runs, and the peak above the post-load baseline
+is reported next to the size of the PG Forward frame.
+
+    python benchmarks/bench_memory.py --rows 1000000
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from recon_core import attach_keys, build_checker  # noqa: E402
+from synthetic import make_pg_forward, make_pg_reverse, make_sales  # noqa: E402
+
+FWD_RECON = {
+    'packet_id': 'packet_id', 'order_release_id': 'order_release_id', 'invoice_number': 'invoice_number',
+    'sku_code': 'sku', 'seller_product_amount': 'seller_amount', 'mrp': 'mrp',
+    'total_discount_amount': 'discount', 'prepaid_amount': 'prepaid_amt', 'postpaid_amount': 'postpaid_amt',
+    'total_commission': 'commission', 'total_logistics_deduction': 'logistics',
+    'total_expected_settlement': 'expected_settlement', 'total_actual_settlement': 'actual_settlement',
+    'amount_pending_settlement': 'pending_settlement', 'tcs_amount': 'tcs', 'tds_amount': 'tds',
+    'commission_percentage': 'commission_pct', 'bank_utr_no_prepaid_payment': 'utr_prepaid',
+    'bank_utr_no_postpaid_payment': 'utr_postpaid', 'article_type': 'article_type', '_pid': '_pid',
+}
+SALES_RECON = {
+    '_pid': '_pid', 'order_id': 'order_id', 'SKU': 'sku_sales', 'payment_method': 'payment_method',
+    'invoiceamount': 'invoice_amount', 'shipment_value': 'shipment_value', 'mrp': 'mrp_sales',
+    'discount': 'discount_sales', 'tax_amount': 'tax_amount', 'tcs_amount': 'tcs_sales', 'tds_amount': 'tds_sales',
+}
+CHARGE_COLS = ['order_release_id', 'packet_id', 'sku_code', 'article_type', 'seller_product_amount', 'mrp',
+               'total_discount_amount', 'commission_percentage', 'total_commission', 'shipping_fee',
+               'total_logistics_deduction', 'tcs_amount', 'tds_amount',
+               'total_expected_settlement', 'total_actual_settlement']
+CHECKER_SHOW = ['order_id', 'Order Type', 'Payment Status', 'order_status', 'payment_method', 'article_type',
+                'seller_price', 'FWD Calculated (Rs)', 'FWD Received (Rs)', 'FWD Difference (Rs)',
+                'FWD Pending (Rs)', 'REV Deducted (Rs)', 'REV Pending (Rs)', 'Net Amount (Rs)']
+
+
+def rss_bytes():
+    """Current resident set size (Linux /proc), else the high-water mark."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        scale = 1 if sys.platform == 'darwin' else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+class PeakSampler:
+    def __init__(self, interval=0.002):
+        self.interval, self.peak, self._stop = interval, rss_bytes(), threading.Event()
+
+    def __enter__(self):
+        self._t = threading.Thread(target=self._run, daemon=True)
+        self._t.start()
+        return self
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, rss_bytes())
+            time.sleep(self.interval)
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._t.join()
+        self.peak = max(self.peak, rss_bytes())
+
+
+def clean_name(c):
+    return c.replace('(', '').replace(')', '').replace(' ', '_').replace('/', '_')
+
+
+def pipeline_copies(pg_fwd, pg_rev, sales, rto, rt):
+    """Tab code as it was: copy after every projection and filter."""
+    keep = []
+    fwd_recon = pg_fwd[list(FWD_RECON)].copy()
+    fwd_recon.columns = list(FWD_RECON.values())
+    sales_recon = sales[list(SALES_RECON)].copy()
+    sales_recon.columns = list(SALES_RECON.values())
+    merged = fwd_recon.merge(sales_recon, on='_pid', how='outer', indicator=True)
+    merged['Recon_Status'] = np.where(merged['_merge'] == 'both', 'Matched', 'PG Only')
+    keep += [fwd_recon, sales_recon, merged, merged[merged['Recon_Status'].isin(['Matched'])].copy()]
+    keep.append(pg_fwd[CHARGE_COLS].copy())
+    df = build_checker(sales, pg_fwd, pg_rev, rto, rt, 'order_release_id', 'seller_price')
+    disp = df[df['Payment Status'].isin(['Received', 'Pending', 'Not Received'])].copy()
+    out = disp[CHECKER_SHOW].rename(columns={'order_id': 'Order ID'})
+    keep += [df, disp, out.loc[:, ~out.columns.duplicated()]]
+    for status in ('Not Received', 'Pending'):
+        sub = df[df['Payment Status'] == status].copy()
+        keep.append(sub[CHECKER_SHOW].rename(columns={'order_id': 'Order ID'}))
+    save = pg_fwd.copy()
+    save.columns = [clean_name(c) for c in save.columns]
+    keep.append(save)
+    return keep
+
+
+def pipeline_cow(pg_fwd, pg_rev, sales, rto, rt):
+    """Tab code now: project, then filter once; renames share buffers."""
+    keep = []
+    fwd_recon = pg_fwd[list(FWD_RECON)].rename(columns=FWD_RECON)
+    sales_recon = sales[list(SALES_RECON)].rename(columns=SALES_RECON)
+    merged = fwd_recon.merge(sales_recon, on='_pid', how='outer', indicator=True)
+    merged['Recon_Status'] = np.where(merged['_merge'] == 'both', 'Matched', 'PG Only')
+    keep += [fwd_recon, sales_recon, merged, merged[merged['Recon_Status'].isin(['Matched'])]]
+    keep.append(pg_fwd[CHARGE_COLS])
+    df = build_checker(sales, pg_fwd, pg_rev, rto, rt, 'order_release_id', 'seller_price')
+    mask = df['Payment Status'].isin(['Received', 'Pending', 'Not Received'])
+    keep += [df, df.loc[mask, CHECKER_SHOW].rename(columns={'order_id': 'Order ID'})]
+    for status in ('Not Received', 'Pending'):
+        keep.append(df.loc[df['Payment Status'] == status, CHECKER_SHOW].rename(columns={'order_id': 'Order ID'}))
+    keep.append(pg_fwd.rename(columns=clean_name))
+    return keep
+
+
+def run_variant(name, rows):
+    fwd = make_pg_forward(rows)
+    rev = make_pg_reverse(fwd)
+    sales = make_sales(fwd)
+    rto = pd.DataFrame(columns=['order_release_id', 'rto_value'])
+    rt = pd.DataFrame(columns=['order_release_id', 'rt_value'])
+    attach_keys(fwd, rev, sales, rto, rt, 'order_release_id')
+    input_mb = fwd.memory_usage(deep=True).sum() / 2**20
+    base = rss_bytes()
+    fn = pipeline_copies if name == 'copies' else pipeline_cow
+    t0 = time.perf_counter()
+    with PeakSampler() as s:
+        kept = fn(fwd, rev, sales, rto, rt)
+    secs = time.perf_counter() - t0
+    print(f"{name},{input_mb:.1f},{(s.peak - base) / 2**20:.1f},{secs:.2f},{len(kept)}")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--rows', type=int, default=1_000_000)
+    ap.add_argument('--variant', choices=['copies', 'cow'])
+    args = ap.parse_args()
+    if args.variant:
+        return run_variant(args.variant, args.rows)
+
+    print(f"Synthetic month: {args.rows:,} PG Forward rows (pandas {pd.__version__})")
+    for name, label in [('copies', 'with .copy() calls'), ('cow', 'copy-on-write')]:
+        line = subprocess.run([sys.executable, __file__, '--rows', str(args.rows), '--variant', name],
+                              capture_output=True, text=True, check=True).stdout.strip().splitlines()[-1]
+        _, input_mb, peak_mb, secs, _ = line.split(',')
+        print(f"{label:<20} PG Forward {float(input_mb):7.1f} MB   peak +{float(peak_mb):7.1f} MB "
+              f"({float(peak_mb) / float(input_mb):4.2f}x input)   {float(secs):6.2f}s")
+
+
+if __name__ == '__main__':
+    main()
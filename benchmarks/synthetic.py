@@ -0,0 +1,96 @@
+"""
+Synthetic Myntra reports for benchmarks.
+Column names follow the real PG Forward / PG Reverse / Sales exports; values
+are random but shaped like a typical month.
+"""
+import io
+import numpy as np
+import pandas as pd
+
+ARTICLE_TYPES = ['Kurtas', 'Tops', 'Dresses', 'Sarees', 'Jeans', 'Kurta Sets']
+ZONES  = ['LOCAL', 'ZONAL', 'METRO', 'NATIONAL']
+STATES = ['MAHARASHTRA', 'KARNATAKA', 'DELHI', 'TAMIL NADU', 'UTTAR PRADESH', 'WEST BENGAL']
+
+
+def make_pg_forward(n, seed=0):
+    r = np.random.default_rng(seed)
+    oid = np.arange(100_000_000, 100_000_000 + n).astype(str)
+    sp = r.uniform(200, 3000, n).round(2)
+    comm = (sp * r.choice([0.14, 0.18, 0.22], n)).round(2)
+    logi = r.choice([45.0, 65.0, 95.0], n)
+    prepaid = r.random(n) < 0.6
+    settled = (sp - comm - logi).round(2)
+    utr = pd.Series('UTR' + pd.Series(r.integers(0, 60, n)).astype(str)).where(r.random(n) < 0.85)
+    return pd.DataFrame({
+        'order_release_id': oid,
+        'packet_id': np.char.add('PKT', oid),
+        'invoice_number': np.char.add('INV', oid),
+        'sku_code': np.char.add('SKU', r.integers(0, max(n // 20, 1), n).astype(str)),
+        'article_type': r.choice(ARTICLE_TYPES, n),
+        'seller_product_amount': sp,
+        'mrp': (sp * 1.6).round(2),
+        'total_discount_amount': (sp * 0.6).round(2),
+        'prepaid_amount': np.where(prepaid, sp, 0.0),
+        'postpaid_amount': np.where(prepaid, 0.0, sp),
+        'total_commission': -comm,
+        'total_logistics_deduction': -logi,
+        'total_expected_settlement': settled,
+        'total_actual_settlement': settled,
+        'amount_pending_settlement': np.where(r.random(n) < 0.08, 50.0, 0.0),
+        'tcs_amount': (sp * 0.005).round(2),
+        'tds_amount': (sp * 0.001).round(2),
+        'commission_percentage': (comm / sp * 100).round(2),
+        'shipping_fee': 0.0,
+        'taxable_amount': (sp / 1.05).round(2),
+        'total_commission_plus_tcs_tds_deduction': -comm,
+        'forwardAdditionalCharges_prepaid': 0.0,
+        'forwardAdditionalCharges_postpaid': 0.0,
+        'bank_utr_no_prepaid_payment': utr.where(prepaid),
+        'bank_utr_no_postpaid_payment': utr.where(~prepaid),
+        'settlement_date_prepaid_payment': '2026-01-15',
+        'shipment_zone_classification': r.choice(ZONES, n),
+        'shipping_state': r.choice(STATES, n),
+    })
+
+
+def make_pg_reverse(fwd, frac=0.2, seed=1):
+    r = np.random.default_rng(seed)
+    rev = fwd.sample(frac=frac, random_state=seed).reset_index(drop=True)
+    rev['return_type'] = r.choice(['return_refund', 'exchange'], len(rev), p=[0.8, 0.2])
+    rev['return_date'] = '2026-01-20'
+    rev['total_actual_settlement'] = -rev['total_actual_settlement']
+    return rev.rename(columns={
+        'forwardAdditionalCharges_prepaid': 'reverseAdditionalCharges_prepaid',
+        'forwardAdditionalCharges_postpaid': 'reverseAdditionalCharges_postpaid',
+    })
+
+
+def make_sales(fwd, seed=2):
+    r = np.random.default_rng(seed)
+    n = len(fwd)
+    return pd.DataFrame({
+        'packet_id': fwd['packet_id'],
+        'order_id': np.char.add('O', fwd['order_release_id'].to_numpy().astype(str)),
+        'order_release_id': fwd['order_release_id'],
+        'SKU': fwd['sku_code'],
+        'payment_method': np.where(fwd['prepaid_amount'] > 0, 'on', 'cod'),
+        'invoiceamount': fwd['seller_product_amount'],
+        'shipment_value': fwd['seller_product_amount'],
+        'mrp': fwd['mrp'],
+        'discount': fwd['total_discount_amount'],
+        'tax_amount': (fwd['seller_product_amount'] * 0.05).round(2),
+        'tcs_amount': fwd['tcs_amount'],
+        'tds_amount': fwd['tds_amount'],
+        'seller_price': fwd['seller_product_amount'],
+        'order_status': r.choice(['C', 'F', 'RTO'], n, p=[0.85, 0.1, 0.05]),
+        'article_type': fwd['article_type'],
+        'order_packed_date': '2026-01-05',
+        'state': fwd['shipping_state'],
+    })
+
+
+def to_csv_file(df, name):
+    """CSV bytes wrapped like a Streamlit upload (BytesIO with a .name)."""
+    buf = io.BytesIO(df.to_csv(index=False).encode())
+    buf.name = name
+    return buf
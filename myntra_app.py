@@ -6,52 +6,171 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 from datetime import datetime
-import io, json, uuid
+from collections import OrderedDict, deque
+import hashlib, io, json, os, sys, uuid, zipfile
+from functools import partial
 import warnings
+from recon_jobs import (make_executor, start_save_job, make_parse_executor, submit_parses, collect_parses,
+                        prefetch, make_prefetch_executor)
+from recon_quality import run_rules
+from recon_watch import FolderWatcher, reconcile_month
+from recon_profile import RerunProfiler
+from recon_core import (
+    ARROW_OK,
+    UPLOAD_SLOTS, EXCEL_ENGINE_HELP, upload_parts, part_label,
+    safe_num, safe_get, resolve_columns, page_frame,
+    build_checker, checker_export, checker_summary, money_sum, content_key, memo_result, memo_ready, attach_keys,
+    SettlementIndex, settlement_rows, ReadCache, row_hashes, diff_hashes,
+    RankIndex, rank_rows, top_k, RANK_DIMS, RANK_METRICS, RANK_LABELS,
+    DUP_STRATEGIES, JoinTooLarge, guarded_outer_merge,
+    RATE_CARD_COLS, load_rate_card, validate_charges, rate_card_summary,
+    TCS_PCT, TDS_PCT, statutory_check, statutory_totals,
+    chain_ids, chain_summary,
+    diff_outputs, status_transitions,
+    overview_kpis, recon_status, utr_tracker,
+    PREVIEW_STRATA_COL, preview_scan, frame_rows, frame_sum, frame_positive, group_table,
+)
 warnings.filterwarnings('ignore')
 
 # ─────────────────────────────────────────────
 # SUPABASE SETUP
 # ─────────────────────────────────────────────
-try:
+SB_CACHE_TTL = 300   # seconds a DB read is reused; writes invalidate sooner
+
+@st.cache_resource
+def supabase_client(url, key):
+    """One client per process — its HTTP session (connection pool, keep-alive)
+    is reused across reruns and sessions instead of reconnecting each run."""
     from supabase import create_client
+    return create_client(url, key)
+
+@st.cache_resource
+def read_cache():
+    """Process-wide cache of DB reads (see recon_core.ReadCache)."""
+    return ReadCache(ttl=SB_CACHE_TTL)
+
+READ_CACHE = read_cache()   # bound here so save-job threads can invalidate it
+
+try:
     _url = st.secrets.get("SUPABASE_URL", "")
     _key = st.secrets.get("SUPABASE_KEY", "")
-    supabase = create_client(_url, _key) if (_url and _key) else None
+    supabase = supabase_client(_url, _key) if (_url and _key) else None
     SUPABASE_OK = bool(supabase)
 except Exception:
     supabase = None
     SUPABASE_OK = False
 
+@st.cache_resource
+def save_executor():
+    """Process-wide thread pool for background Supabase saves."""
+    return make_executor()
+
 if "session_id" not in st.session_state:
     st.session_state["session_id"] = str(uuid.uuid4())[:8]
 
 # ─────────────────────────────────────────────
 # SUPABASE HELPERS
 # ─────────────────────────────────────────────
-def sb_save_df(df, table, chunk=400):
+def sb_stored_hashes(table, months):
+    """(month_label, row_hash) pairs already saved for `months` — read fresh, not cached.
+    Read errors propagate: an unreadable table must not look empty."""
+    frames, start, page = [], 0, 1000
+    while True:
+        res = _sb_select(table, months, "month_label,row_hash").range(start, start + page - 1).execute()
+        if not res.data: break
+        frames.append(pd.DataFrame(res.data))
+        if len(res.data) < page: break
+        start += page
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=['month_label','row_hash'])
+
+def sb_save_df(df, table, chunk=400, on_chunk=None, on_error=None, on_unchanged=None, replace=True):
+    """Save `df` in chunks. on_chunk(n)/on_error(msg)/on_unchanged(n) let background
+    jobs report progress without touching Streamlit (default: st.warning on error).
+
+    Frames stamped with month_label + row_hash are saved idempotently: rows whose
+    hash is already stored for the month are skipped and the rest are upserted on
+    (month_label, row_hash). With `replace` (the default) rows of `table` stored for
+    the month that are not in `df` are deleted, so a corrected re-save replaces the
+    month instead of adding to it; pass replace=False when `df` is only part of
+    what the table holds for the month. Returns the rows now stored for this
+    frame (written + unchanged).
+    """
     if not SUPABASE_OK or df.empty: return 0
-    # Clean column names — remove special chars
-    df = df.copy()
-    df.columns = [c.replace('(','').replace(')','').replace(' ','_').replace('/','_') for c in df.columns]
-    records = df.where(pd.notnull(df), None).to_dict("records")
-    saved = 0
-    for i in range(0, len(records), chunk):
+    # Clean column names — remove special chars (a CoW rename, no data copied)
+    df = df.rename(columns=lambda c: c.replace('(','').replace(')','').replace(' ','_').replace('/','_'))
+    idempotent = 'row_hash' in df.columns and 'month_label' in df.columns
+    unchanged, saved = 0, 0
+    try:
+        if idempotent:
+            stored = sb_stored_hashes(table, df['month_label'].astype(str).unique().tolist())
+            df, unchanged, stale = diff_hashes(df, stored)
+            if unchanged:
+                if on_unchanged: on_unchanged(unchanged)
+                if on_chunk: on_chunk(unchanged)
+            for m, grp in (stale.groupby('month_label') if replace else ()):
+                hashes = grp['row_hash'].tolist()
+                for i in range(0, len(hashes), chunk):
+                    supabase.table(table).delete().eq("month_label", m).in_("row_hash", hashes[i:i+chunk]).execute()
+        records = df.where(pd.notnull(df), None).to_dict("records")
+        for i in range(0, len(records), chunk):
+            try:
+                if idempotent:
+                    supabase.table(table).upsert(records[i:i+chunk], on_conflict="month_label,row_hash").execute()
+                else:
+                    supabase.table(table).insert(records[i:i+chunk]).execute()
+                saved += len(records[i:i+chunk])
+                if on_chunk: on_chunk(len(records[i:i+chunk]))
+            except Exception as e:
+                (on_error or st.warning)(f"DB error ({table}): {e}")
+                break
+    except Exception as e:
+        (on_error or st.warning)(f"DB error ({table}): {e}")
+    finally:
+        READ_CACHE.invalidate(table)
+    return saved + unchanged if saved or unchanged else 0
+
+def _sb_select(table, months=None, columns="*"):
+    q = supabase.table(table).select(columns)
+    return q.in_("month_label", list(months)) if months else q
+
+def sb_load_df(table, limit=10000, months=None, columns="*"):
+    if not SUPABASE_OK: return pd.DataFrame()
+    def load():
         try:
-            supabase.table(table).insert(records[i:i+chunk]).execute()
-            saved += len(records[i:i+chunk])
+            res = _sb_select(table, months, columns).limit(limit).execute()
+            return pd.DataFrame(res.data) if res.data else pd.DataFrame()
         except Exception as e:
-            st.warning(f"DB error ({table}): {e}")
-            break
-    return saved
+            return pd.DataFrame()
+    return READ_CACHE.get(ReadCache.key(table, months, columns, f"limit={limit}"), load).copy(deep=False)
 
-def sb_load_df(table, limit=10000):
+def sb_load_all(table, page=1000, months=None, columns="*"):
+    """Every row of `table`, fetched page by page (no 10k cap)."""
     if not SUPABASE_OK: return pd.DataFrame()
-    try:
-        res = supabase.table(table).select("*").limit(limit).execute()
-        return pd.DataFrame(res.data) if res.data else pd.DataFrame()
-    except Exception as e:
-        return pd.DataFrame()
+    def load():
+        frames, start = [], 0
+        try:
+            while True:
+                res = _sb_select(table, months, columns).range(start, start + page - 1).execute()
+                if not res.data: break
+                frames.append(pd.DataFrame(res.data))
+                if len(res.data) < page: break
+                start += page
+        except Exception:
+            pass
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    return READ_CACHE.get(ReadCache.key(table, months, columns, "all"), load).copy(deep=False)
+
+@st.cache_resource
+def settlement_index():
+    """Process-wide cross-month settlement index, loaded once and updated on save."""
+    rows = sb_load_all("settlement_index")
+    return SettlementIndex(rows if not rows.empty else None)
+
+@st.cache_resource
+def rank_index():
+    """Process-wide SKU/state ranking totals over saved months, updated on save."""
+    rows = sb_load_all("rank_rollup")
+    return RankIndex(rows if not rows.empty else None)
 
 def sb_log_report(name, table_ref, rows, month_label):
     if not SUPABASE_OK: return
@@ -62,17 +181,123 @@ def sb_log_report(name, table_ref, rows, month_label):
             "saved_at": datetime.utcnow().isoformat(),
         }).execute()
     except: pass
+    finally: READ_CACHE.invalidate("saved_reports")
 
 def sb_get_reports():
     if not SUPABASE_OK: return pd.DataFrame()
-    try:
-        res = supabase.table("saved_reports").select("*").order("saved_at", desc=True).execute()
-        return pd.DataFrame(res.data) if res.data else pd.DataFrame()
-    except: return pd.DataFrame()
+    def load():
+        try:
+            res = supabase.table("saved_reports").select("*").order("saved_at", desc=True).execute()
+            return pd.DataFrame(res.data) if res.data else pd.DataFrame()
+        except: return pd.DataFrame()
+    return READ_CACHE.get(ReadCache.key("saved_reports", variant="by_saved_at"), load).copy(deep=False)
 
-def safe_get(df, col, default=0):
-    if col in df.columns: return pd.to_numeric(df[col], errors='coerce').fillna(0)
-    return pd.Series(default, index=df.index)
+# ─────────────────────────────────────────────
+# Month save — the tables written for one month
+# ─────────────────────────────────────────────
+FWD_SAVE_COLS = ['order_release_id','packet_id','sku_code','article_type',
+    'seller_product_amount','mrp','total_commission','total_logistics_deduction',
+    'total_actual_settlement','amount_pending_settlement','prepaid_amount','postpaid_amount',
+    'total_commission_plus_tcs_tds_deduction',
+    'forwardAdditionalCharges_prepaid','forwardAdditionalCharges_postpaid',
+    'tcs_amount','tds_amount','taxable_amount','commission_percentage',
+    'bank_utr_no_prepaid_payment','bank_utr_no_postpaid_payment',
+    'shipment_zone_classification','shipping_state']
+REV_SAVE_COLS = ['order_release_id','packet_id','sku_code','article_type',
+    'return_type','seller_product_amount','total_actual_settlement',
+    'amount_pending_settlement','prepaid_amount','postpaid_amount',
+    'total_commission_plus_tcs_tds_deduction',
+    'reverseAdditionalCharges_prepaid','reverseAdditionalCharges_postpaid',
+    'tcs_amount','tds_amount','return_date','shipment_zone_classification']
+SALES_SAVE_COLS = ['packet_id','order_id','order_release_id','article_type','payment_method',
+    'invoiceamount','shipment_value','mrp','discount','tax_amount','tcs_amount','tds_amount',
+    'order_status','SKU','order_packed_date','state']
+
+def month_save_tasks(month_label, pg_fwd, pg_rev, sales, rto_df, rt_df, checker=None, sidx=None, ridx=None):
+    """start_save_job tasks for one month; `checker()` returns its checker output
+    (None skips the output report). Used by the save tab and folder ingestion.
+
+    sidx / ridx are the process-wide settlement and ranking indexes the tasks
+    update. The tasks run on save threads, which have no script-run context, so
+    the indexes are resolved here (pass them in when not on the script thread).
+    """
+    sidx = settlement_index() if sidx is None else sidx
+    ridx = rank_index() if ridx is None else ridx
+
+    def stamp(d):
+        d = d.drop(columns=[c for c in d.columns if c.startswith('_')]); d['month_label'] = month_label
+        d['row_hash'] = row_hashes(d); d['saved_at'] = datetime.utcnow().isoformat()
+        return d
+
+    def build_output_report():
+        # Reuse the checker output already computed for this upload
+        if checker is None:
+            return None
+        return stamp(checker_export(checker()))
+
+    def build_settlement_index():
+        # Per-order settlement rows for this month; the in-process index is
+        # updated incrementally (only this month's rows are replaced)
+        rows = pd.concat([settlement_rows(pg_fwd, 'F', month_label),
+                          settlement_rows(pg_rev, 'R', month_label)], ignore_index=True)
+        sidx.add_month(month_label, rows)
+        return stamp(rows)
+
+    def build_rank_rollup():
+        # Per-SKU / per-state totals of this month; the ranking totals swap
+        # in this month's rollup without re-grouping the saved history
+        rows = rank_rows(pg_fwd, pg_rev, month_label)
+        ridx.add_month(month_label, rows)
+        return stamp(rows)
+
+    def cols(df, wanted):
+        return df[[c for c in wanted if c in df.columns]]
+
+    return {
+        'pg_forward': (lambda: stamp(cols(pg_fwd, FWD_SAVE_COLS)),  "pg_forward_data", f"PG Forward – {month_label}"),
+        'pg_reverse': (lambda: stamp(cols(pg_rev, REV_SAVE_COLS)),  "pg_reverse_data", f"PG Reverse – {month_label}"),
+        'sales':      (lambda: stamp(cols(sales, SALES_SAVE_COLS)), "sales_data",      f"Sales – {month_label}"),
+        'rto':        (lambda: stamp(rto_df),                       "rto_data",        f"RTO – {month_label}"),
+        'rt':         (lambda: stamp(rt_df),                        "rt_data",         f"RT – {month_label}"),
+        'output':     (build_output_report,                         "output_reconciliation",
+                       f"Output Reconciliation – {month_label}"),
+        'index':      (build_settlement_index,                      "settlement_index",
+                       f"Settlement Index – {month_label}"),
+        'ranks':      (build_rank_rollup,                           "rank_rollup",
+                       f"SKU & State Rankings – {month_label}"),
+    }
+
+# ─────────────────────────────────────────────
+# Folder ingestion — reports dropped into RECON_WATCH_DIR
+# ─────────────────────────────────────────────
+try:
+    WATCH_DIR = os.environ.get("RECON_WATCH_DIR") or st.secrets.get("RECON_WATCH_DIR", "")
+except Exception:
+    WATCH_DIR = ""
+
+def ingest_month(month_label, futures, input_key, shared):
+    """One watcher batch (runs on the watcher thread): reconcile the month, warm
+    the checker result the dashboard reads, and save it as the 💾 tab would.
+
+    The watcher thread has no script-run context, so it never calls a
+    cache_resource factory: `shared` holds the save executor and the indexes,
+    created by folder_watcher() on the script thread.
+    """
+    res = reconcile_month(futures)
+    memo_result('checker', input_key, lambda: res['checker'])
+    if shared:
+        f = res['frames']
+        start_save_job(shared['executor'], month_label, month_save_tasks(
+            month_label, f['pg_fwd'], f['pg_rev'], f['sales'], f['rto'], f['rt'], lambda: res['checker'],
+            shared['settlement_index'], shared['rank_index']), sb_save_df, sb_log_report)
+
+@st.cache_resource
+def folder_watcher(directory):
+    """Process-wide watcher on `directory`, parsing on its own pool."""
+    shared = {'executor': save_executor(), 'settlement_index': settlement_index(),
+              'rank_index': rank_index()} if SUPABASE_OK else None
+    return FolderWatcher(directory, partial(ingest_month, shared=shared),
+                         executor=make_parse_executor()).start()
 
 st.set_page_config(
     page_title="Myntra Seller Dashboard",
@@ -81,6 +306,32 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# ─────────────────────────────────────────────
+# Profiling — one rerun on demand, admins only
+# ─────────────────────────────────────────────
+# Admins open the app with ?admin=<RECON_PROFILE_TOKEN>; adding &profile=1 (or
+# the sidebar button) samples that one rerun. Without the token nothing runs.
+try:
+    PROFILE_TOKEN = os.environ.get("RECON_PROFILE_TOKEN") or st.secrets.get("RECON_PROFILE_TOKEN", "")
+except Exception:
+    PROFILE_TOKEN = ""
+PROFILE_DIR = os.environ.get("RECON_PROFILE_DIR", "profiles")
+_qp = st.query_params if hasattr(st, "query_params") else {}
+IS_ADMIN = bool(PROFILE_TOKEN) and _qp.get("admin") == PROFILE_TOKEN
+
+@st.cache_resource
+def profile_log():
+    """Profiles written by this server process, newest last."""
+    return deque(maxlen=10)
+
+PROFILER = None
+if IS_ADMIN and (_qp.get("profile") == "1" or st.session_state.pop("profile_next", False)):
+    if "profile" in _qp:
+        del _qp["profile"]        # profile this rerun only, not every rerun of the URL
+    _profiles = profile_log()
+    PROFILER = RerunProfiler(sys._getframe(),
+        on_done=lambda p: _profiles.append(p.save(PROFILE_DIR, "myntra_app"))).start()
+
 # ─────────────────────────────────────────────
 # CSS — Clean professional dark-accent theme
 # ─────────────────────────────────────────────
@@ -163,221 +414,90 @@ def fmt_num(val):
     try: return f"{int(val):,}"
     except: return "0"
 
-def safe_num(series):
-    return pd.to_numeric(series, errors='coerce').fillna(0)
-
-# ─────────────────────────────────────────────
-# Helper: coerce numeric columns
-# ─────────────────────────────────────────────
-MONEY_COLS_PG = [
-    'seller_product_amount','mrp','total_discount_amount','total_commission',
-    'total_logistics_deduction','total_expected_settlement','total_actual_settlement',
-    'amount_pending_settlement','prepaid_amount','postpaid_amount',
-    'tcs_amount','tds_amount','commission_percentage','platform_fees',
-    'shipping_fee','customer_paid_amt','taxable_amount',
-    'prepaid_payment','postpaid_payment',
-    'total_commission_plus_tcs_tds_deduction',
-    'forwardAdditionalCharges_prepaid',
-    'forwardAdditionalCharges_postpaid',
-    'reverseAdditionalCharges_prepaid',
-    'reverseAdditionalCharges_postpaid',
-    'total_commission_plus_tcs_tds_deduction'
-]
-MONEY_COLS_SALES = [
-    'invoiceamount','shipment_value','base_value','seller_price','mrp',
-    'discount','tax_amount','tcs_amount','tds_amount','net_amount'
-]
-
-def coerce_df(df, money_cols):
-    for c in money_cols:
-        if c in df.columns:
-            df[c] = safe_num(df[c])
-    if 'packet_id' in df.columns:
-        df['packet_id'] = df['packet_id'].astype(str)
-    return df
-
-# ─────────────────────────────────────────────
-# Header
-# ─────────────────────────────────────────────
-st.markdown("""
-<div class="main-header">
-  <h1>🛍️ Myntra Seller Analytics Dashboard</h1>
-  <p>Payment Gateway Reconciliation · Sales Analysis · Returns · Settlement Tracking</p>
-  <span class="badge">BRAND: SANGRIA · JAN 2026</span>
-</div>
-""", unsafe_allow_html=True)
-
-# ─────────────────────────────────────────────
-# Sidebar — file upload (always shown)
-# ─────────────────────────────────────────────
-with st.sidebar:
-    st.markdown("### 📂 Data Files")
-    st.markdown("Upload all 5 reports:")
-    up_fwd   = st.file_uploader("1️⃣ PG Forward CSV",          type=["csv"])
-    up_rev   = st.file_uploader("2️⃣ PG Reverse CSV",          type=["csv"])
-    up_sales = st.file_uploader("3️⃣ Sales Sheet (XLSX/CSV)",  type=["xlsx","csv","xls"])
-    up_rto   = st.file_uploader("4️⃣ RTO Report (XLSX/CSV)",   type=["xlsx","csv","xls"])
-    up_rt    = st.file_uploader("5️⃣ RT Report (XLSX/CSV)",    type=["xlsx","csv","xls"])
-    st.markdown("---")
-    st.markdown("**About this Dashboard**")
-    st.caption("Analyzes Myntra PG Forward/Reverse + Sales/RTO/RT reports for order-wise payment reconciliation.")
-
-# ─────────────────────────────────────────────
-# Load — only from uploads, no local fallback
-# ─────────────────────────────────────────────
-if not (up_fwd and up_rev and up_sales):
-    st.info(
-        "👈 **Please upload the required files in the sidebar:**\n\n"
-        "1. **PG Forward CSV** — payment report for forward orders\n"
-        "2. **PG Reverse CSV** — deductions for customer returns\n"
-        "3. **Sales Sheet** — main sales report (XLSX/CSV)\n"
-        "4. **RTO Report** — courier returns (optional)\n"
-        "5. **RT Report** — customer returns (optional)"
-    )
-    st.stop()
-
-def read_excel_safe(file):
-    """Try openpyxl first, then xlrd, then ask user to convert to CSV."""
-    fname = file.name.lower()
-    if not fname.endswith(('.xlsx', '.xls')):
-        return pd.read_csv(file)
-    # Try openpyxl (for .xlsx)
-    try:
-        import openpyxl  # noqa
-        file.seek(0)
-        return pd.read_excel(file, engine='openpyxl')
-    except ImportError:
-        pass
-    # Try xlrd (older .xls support)
-    try:
-        import xlrd  # noqa
-        file.seek(0)
-        return pd.read_excel(file, engine='xlrd')
-    except ImportError:
-        pass
-    # Both missing — give user a clear action
-    st.error(
-        "❌ **Cannot read the Excel file** — neither `openpyxl` nor `xlrd` is installed "
-        "in this environment.\n\n"
-        "**Quick fix:** Open your Sales sheet in Excel, go to **File → Save As → CSV (.csv)**, "
-        "then re-upload the CSV version instead."
-    )
-    st.stop()
-
-try:
-    pg_fwd = coerce_df(pd.read_csv(up_fwd), MONEY_COLS_PG)
-    pg_rev = coerce_df(pd.read_csv(up_rev), MONEY_COLS_PG)
-    sales  = coerce_df(read_excel_safe(up_sales), MONEY_COLS_SALES)
-    pg_fwd['_type'] = 'Forward'
-    pg_rev['_type'] = 'Return'
-    # RTO: order_id = Col E (index 4), rto_value = Col BM (index 64)
-    if up_rto:
-        rto_df = read_excel_safe(up_rto)
-        rto_id_col  = rto_df.columns[4]   # Col E
-        rto_val_col = rto_df.columns[64] if len(rto_df.columns) > 64 else None
-        rto_df = rto_df.rename(columns={rto_id_col: 'order_release_id'})
-        if rto_val_col:
-            rto_df = rto_df.rename(columns={rto_val_col: 'rto_value'})
-            rto_df['rto_value'] = safe_num(rto_df['rto_value'])
-        rto_df['order_release_id'] = rto_df['order_release_id'].astype(str).str.strip()
-    else:
-        rto_df = pd.DataFrame(columns=['order_release_id','rto_value'])
-    # RT: order_id = Col F (index 5) via shipment_id, rt_value = Col BC (index 54)
-    if up_rt:
-        rt_df = read_excel_safe(up_rt)
-        rt_id_col  = rt_df.columns[5]    # Col F — shipment_id = order_id
-        rt_val_col = rt_df.columns[54] if len(rt_df.columns) > 54 else None
-        rt_df = rt_df.rename(columns={rt_id_col: 'order_release_id'})
-        if rt_val_col:
-            rt_df = rt_df.rename(columns={rt_val_col: 'rt_value'})
-            rt_df['rt_value'] = safe_num(rt_df['rt_value'])
-        rt_df['order_release_id'] = rt_df['order_release_id'].astype(str).str.strip()
-    else:
-        rt_df = pd.DataFrame(columns=['order_release_id','rt_value'])
-except SystemExit:
-    raise
-except Exception as e:
-    st.error(f"❌ Error reading uploaded files: {e}")
-    st.stop()
-
-# ─────────────────────────────────────────────
-# Settlement date columns
-# ─────────────────────────────────────────────
-SETTLE_COLS = [c for c in pg_fwd.columns if 'Settlement_on_2026' in c]
-for c in SETTLE_COLS:
-    pg_fwd[c] = safe_num(pg_fwd[c])
-    pg_rev[c] = safe_num(pg_rev[c])
-
-# ─────────────────────────────────────────────
-# TABS
-# ─────────────────────────────────────────────
-tabs = st.tabs([
-    "📊 Overview",
-    "🔄 Payment Reconciliation",
-    "🛒 Sales Analysis",
-    "↩️ Returns Analysis",
-    "💳 Settlement Tracker",
-    "📦 SKU & Product",
-    "🌍 Geography",
-    "💸 Charges Breakup",
-    "✅ Order Settlement Checker",
-    "💾 Save & Reports",
-    "📂 Historical & Real-time Analysis",
-])
-(t_overview, t_recon, t_sales, t_returns,
- t_settle, t_sku, t_geo, t_charges, t_checker,
- t_save, t_history) = tabs
-
-# ══════════════════════════════════════════════
-# TAB 1 — OVERVIEW
-# ══════════════════════════════════════════════
-with t_overview:
-    st.markdown('<div class="section-title">📊 January 2026 — Business Summary</div>', unsafe_allow_html=True)
-
-    # KPI Row 1
+def paged_table(df, key, page_size=100, total_cols=None):
+    """Server-side paginated table — filter + sort + slice here, send only the visible page."""
+    if df.empty:
+        st.dataframe(df, use_container_width=True, hide_index=True)
+        return
+    f1, f2 = st.columns([1, 3])
+    filter_col  = f1.selectbox("Filter in", ['All columns'] + list(df.columns), key=f"{key}_fcol")
+    filter_text = f2.text_input("Contains", key=f"{key}_ftext", placeholder="order id, SKU, state…")
+    p1, p2, p3, p4 = st.columns([3, 1, 1, 1])
+    sort_by = p1.selectbox("Sort by", ['—'] + list(df.columns), key=f"{key}_sort")
+    desc    = p2.selectbox("Order", ['Asc', 'Desc'], key=f"{key}_dir") == 'Desc'
+    size    = p3.selectbox("Rows / page", [50, 100, 250, 500],
+                           index=[50, 100, 250, 500].index(page_size), key=f"{key}_size")
+
+    def fetch(page):
+        return page_frame(df, page, size, sort_by=None if sort_by == '—' else sort_by, ascending=not desc,
+                          filter_col=None if filter_col == 'All columns' else filter_col,
+                          filter_text=filter_text, total_cols=total_cols)
+    page = int(st.session_state.get(f"{key}_page", 1))
+    page_df, totals = fetch(page)
+    n_pages = max(1, -(-totals['rows'] // size))
+    if page > n_pages:        # the filter shrank the result below the current page
+        page = st.session_state[f"{key}_page"] = n_pages
+        page_df, totals = fetch(page)
+    p4.number_input(f"Page (of {n_pages:,})", min_value=1, max_value=n_pages,
+                    value=1, step=1, key=f"{key}_page")
+    st.dataframe(page_df, use_container_width=True, hide_index=True)
+    sums = '  '.join(f"{k}: {v:,.2f}" for k, v in totals.items() if k != 'rows')
+    start = (page - 1) * size
+    st.caption(f"Rows {min(start + 1, totals['rows']):,}–{start + len(page_df):,} of {totals['rows']:,}"
+               + (f" (filtered from {len(df):,})" if totals['rows'] != len(df) else "")
+               + (f"  |  Totals → {sums}" if sums else ""))
+
+def kpi_row(k):
+    """Overview headline cards (from overview_kpis) — also the first paint."""
     k1,k2,k3,k4,k5 = st.columns(5)
-    total_orders   = len(pg_fwd)
-    total_returns  = len(pg_rev)
-    return_rate    = total_returns / total_orders * 100
-    gmv            = pg_fwd['mrp'].sum()
-    net_revenue    = pg_fwd['seller_product_amount'].sum()
-
     with k1:
         st.markdown(f"""<div class="kpi-card blue">
         <div class="kpi-label">Forward Orders</div>
-        <div class="kpi-value">{fmt_num(total_orders)}</div>
+        <div class="kpi-value">{fmt_num(k['orders'])}</div>
         <div class="kpi-sub">Dispatched & Delivered</div></div>""", unsafe_allow_html=True)
     with k2:
         st.markdown(f"""<div class="kpi-card red">
         <div class="kpi-label">Total Returns</div>
-        <div class="kpi-value">{fmt_num(total_returns)}</div>
-        <div class="kpi-sub">Return rate: {return_rate:.1f}%</div></div>""", unsafe_allow_html=True)
+        <div class="kpi-value">{fmt_num(k['returns'])}</div>
+        <div class="kpi-sub">Return rate: {k['return_rate']:.1f}%</div></div>""", unsafe_allow_html=True)
     with k3:
         st.markdown(f"""<div class="kpi-card orange">
         <div class="kpi-label">Gross MRP Value</div>
-        <div class="kpi-value">₹{gmv/100000:.2f}L</div>
+        <div class="kpi-value">₹{k['gmv']/100000:.2f}L</div>
         <div class="kpi-sub">Total MRP dispatched</div></div>""", unsafe_allow_html=True)
     with k4:
         st.markdown(f"""<div class="kpi-card">
         <div class="kpi-label">Seller Revenue</div>
-        <div class="kpi-value">₹{net_revenue/100000:.2f}L</div>
+        <div class="kpi-value">₹{k['net_revenue']/100000:.2f}L</div>
         <div class="kpi-sub">After Myntra discount</div></div>""", unsafe_allow_html=True)
     with k5:
-        net_settle = pg_fwd['total_actual_settlement'].sum() + pg_rev['total_actual_settlement'].sum()
         st.markdown(f"""<div class="kpi-card green">
         <div class="kpi-label">Net Settlement</div>
-        <div class="kpi-value">₹{net_settle/100000:.2f}L</div>
+        <div class="kpi-value">₹{k['net_settle']/100000:.2f}L</div>
         <div class="kpi-sub">Forward - Returns</div></div>""", unsafe_allow_html=True)
 
+# ─────────────────────────────────────────────
+# Tab renderers shared by the full run and the preview (see preview_scan):
+# they read pg_fwd/pg_rev only through frame_* / group_table, so preview
+# frames render the same tables with "±" bounds
+# ─────────────────────────────────────────────
+def render_overview(pg_fwd, pg_rev):
+    st.markdown('<div class="section-title">📊 January 2026 — Business Summary</div>', unsafe_allow_html=True)
+
+    # KPI Row 1
+    kpis = overview_kpis(pg_fwd, pg_rev)
+    kpi_row(kpis)
+    total_orders = kpis['orders']
+
     st.markdown("<br>", unsafe_allow_html=True)
 
     # KPI Row 2
     k6,k7,k8,k9,k10 = st.columns(5)
-    fwd_settle    = pg_fwd['total_actual_settlement'].sum()
-    rev_settle    = pg_rev['total_actual_settlement'].sum()
-    total_comm    = pg_fwd['total_commission'].abs().sum()
-    total_logist  = pg_fwd['total_logistics_deduction'].abs().sum()
-    avg_order_val = pg_fwd['seller_product_amount'].mean()
+    fwd_settle    = kpis['fwd_settle']
+    rev_settle    = kpis['rev_settle']
+    total_comm    = kpis['commission']
+    total_logist  = kpis['logistics']
+    avg_order_val = kpis['avg_order']
 
     with k6:
         st.markdown(f"""<div class="kpi-card green">
@@ -393,7 +513,7 @@ with t_overview:
         st.markdown(f"""<div class="kpi-card purple">
         <div class="kpi-label">Commission Charged</div>
         <div class="kpi-value">₹{total_comm/100000:.2f}L</div>
-        <div class="kpi-sub">Avg {pg_fwd['commission_percentage'].mean():.1f}%</div></div>""", unsafe_allow_html=True)
+        <div class="kpi-sub">Avg {kpis['avg_comm_pct']:.1f}%</div></div>""", unsafe_allow_html=True)
     with k9:
         st.markdown(f"""<div class="kpi-card orange">
         <div class="kpi-label">Logistics Charged</div>
@@ -410,18 +530,18 @@ with t_overview:
 
     with col_a:
         st.markdown('<div class="section-title">📦 Article Type Mix (Forward)</div>', unsafe_allow_html=True)
-        art = pg_fwd['article_type'].value_counts().reset_index()
-        art.columns = ['Article Type','Orders']
-        art['Revenue (₹)'] = art['Article Type'].map(
-            pg_fwd.groupby('article_type')['seller_product_amount'].sum().round(2))
+        art = group_table(pg_fwd, 'article_type', {'Orders': ('order_release_id','count'),
+                                                   'Revenue (₹)': ('seller_product_amount','sum')})
+        art = art.sort_values('Orders', ascending=False).rename(columns={'article_type': 'Article Type'})
+        art['Revenue (₹)'] = art['Revenue (₹)'].round(2)
         st.dataframe(art, use_container_width=True, hide_index=True)
 
     with col_b:
         st.markdown('<div class="section-title">📬 Payment Mode Split</div>', unsafe_allow_html=True)
-        prepaid_orders  = (pg_fwd['prepaid_amount']  > 0).sum()
-        postpaid_orders = (pg_fwd['postpaid_amount'] > 0).sum()
-        prepaid_val     = pg_fwd['prepaid_amount'].sum()
-        postpaid_val    = pg_fwd['postpaid_amount'].sum()
+        prepaid_orders  = frame_positive(pg_fwd, 'prepaid_amount')
+        postpaid_orders = frame_positive(pg_fwd, 'postpaid_amount')
+        prepaid_val     = frame_sum(pg_fwd, 'prepaid_amount')
+        postpaid_val    = frame_sum(pg_fwd, 'postpaid_amount')
         pay_df = pd.DataFrame({
             'Mode':    ['Prepaid (Online)', 'Postpaid (COD)'],
             'Orders':  [prepaid_orders, postpaid_orders],
@@ -432,10 +552,10 @@ with t_overview:
 
     st.markdown('<div class="section-title">🗓️ Settlement by Date</div>', unsafe_allow_html=True)
     settle_summary = []
-    for c in SETTLE_COLS:
+    for c in [c for c in pg_fwd.columns if 'Settlement_on_2026' in c]:
         dt = c.replace('Settlement_on_','').replace('_','-')
-        fwd_amt = pg_fwd[c].sum()
-        rev_amt = pg_rev[c].sum() if c in pg_rev.columns else 0
+        fwd_amt = frame_sum(pg_fwd, c)
+        rev_amt = frame_sum(pg_rev, c)
         if fwd_amt != 0 or rev_amt != 0:
             settle_summary.append({'Date': dt, 'Forward (₹)': round(fwd_amt,2),
                                    'Return Deduction (₹)': round(rev_amt,2),
@@ -446,6 +566,425 @@ with t_overview:
         # Bar chart
         st.bar_chart(sdf.set_index('Date')[['Forward (₹)','Return Deduction (₹)']])
 
+
+def render_sku(pg_fwd, pg_rev):
+    st.markdown('<div class="section-title">📦 SKU-wise Performance</div>', unsafe_allow_html=True)
+
+    sku_fwd = group_table(pg_fwd, 'sku_code', dict(
+        Orders=('order_release_id','count'),
+        Total_MRP=('mrp','sum'),
+        Seller_Revenue=('seller_product_amount','sum'),
+        Total_Settlement=('total_actual_settlement','sum'),
+        Avg_Commission_Pct=('commission_percentage','mean'),
+        Article_Type=('article_type','first')
+    )).sort_values('Orders', ascending=False)
+
+    sku_rev = group_table(pg_rev, 'sku_code', dict(
+        Returns=('order_release_id','count'),
+        Return_Deduction=('total_actual_settlement','sum')
+    ))
+
+    sku_all = sku_fwd.merge(sku_rev, on='sku_code', how='left').fillna(0)
+    sku_all['Return_Rate_%'] = (sku_all['Returns'] / sku_all['Orders'] * 100).round(1)
+    sku_all['Net_Settlement'] = (sku_all['Total_Settlement'] + sku_all['Return_Deduction']).round(2)
+    sku_all['Seller_Revenue'] = sku_all['Seller_Revenue'].round(2)
+    sku_all['Total_Settlement']= sku_all['Total_Settlement'].round(2)
+    sku_all['Avg_Commission_Pct']= sku_all['Avg_Commission_Pct'].round(2)
+
+    # SKU search
+    sku_search = st.text_input("🔍 Search SKU")
+    sku_disp = sku_all[sku_all['sku_code'].str.contains(sku_search, case=False, na=False)] if sku_search else sku_all
+
+    st.dataframe(sku_disp, use_container_width=True, hide_index=True)
+
+    st.markdown('<div class="section-title">🔝 Top 10 SKUs by Revenue</div>', unsafe_allow_html=True)
+    top10 = top_k(sku_all, 'Seller_Revenue', 10)[['sku_code','Article_Type','Orders','Seller_Revenue','Returns','Return_Rate_%']]
+    st.dataframe(top10, use_container_width=True, hide_index=True)
+
+    st.markdown('<div class="section-title">⚠️ High Return Rate SKUs (>50%)</div>', unsafe_allow_html=True)
+    high_ret = sku_all[(sku_all['Return_Rate_%']>50) & (sku_all['Orders']>=3)].sort_values('Return_Rate_%', ascending=False)
+    if not high_ret.empty:
+        st.dataframe(high_ret, use_container_width=True, hide_index=True)
+    else:
+        st.success("No SKU has return rate >50% with at least 3 orders.")
+
+    st.download_button("📥 Download SKU Report",
+        data=to_excel(sku_all), file_name="sku_report_Jan26.xlsx",
+        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+
+
+def render_geo(pg_fwd, pg_rev, sales):
+    st.markdown('<div class="section-title">🌍 Geography Analysis</div>', unsafe_allow_html=True)
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.markdown('<div class="section-title">State-wise Sales (Forward)</div>', unsafe_allow_html=True)
+        if 'shipping_state' in pg_fwd.columns:
+            state_fwd = group_table(pg_fwd, 'shipping_state', dict(
+                Orders=('order_release_id','count'),
+                Revenue=('seller_product_amount','sum'),
+                Settlement=('total_actual_settlement','sum')
+            )).sort_values('Orders', ascending=False)
+            state_fwd['Revenue'] = state_fwd['Revenue'].round(2)
+            state_fwd['Settlement'] = state_fwd['Settlement'].round(2)
+            st.dataframe(state_fwd, use_container_width=True, hide_index=True)
+
+    with col2:
+        st.markdown('<div class="section-title">State-wise Returns</div>', unsafe_allow_html=True)
+        if 'shipping_state' in pg_rev.columns:
+            state_rev = group_table(pg_rev, 'shipping_state', dict(
+                Returns=('order_release_id','count'),
+                Total_Debited=('total_actual_settlement','sum')
+            )).sort_values('Returns', ascending=False)
+            state_rev['Total_Debited'] = state_rev['Total_Debited'].round(2)
+            st.dataframe(state_rev, use_container_width=True, hide_index=True)
+
+    st.markdown('<div class="section-title">Shipment Zone Distribution</div>', unsafe_allow_html=True)
+    z1,z2 = st.columns(2)
+    with z1:
+        zone_fwd = group_table(pg_fwd, 'shipment_zone_classification', {
+            'Forward Orders': ('order_release_id','count'), 'Settlement': ('total_actual_settlement','sum')})
+        zone_fwd = zone_fwd.sort_values('Forward Orders', ascending=False) \
+            .rename(columns={'shipment_zone_classification': 'Zone'})
+        zone_fwd['Settlement'] = zone_fwd['Settlement'].round(2)
+        st.markdown("**Forward (Delivered)**")
+        st.dataframe(zone_fwd, use_container_width=True, hide_index=True)
+    with z2:
+        zone_rev = group_table(pg_rev, 'shipment_zone_classification', {
+            'Return Orders': ('order_release_id','count')})
+        zone_rev = zone_rev.sort_values('Return Orders', ascending=False) \
+            .rename(columns={'shipment_zone_classification': 'Zone'})
+        st.markdown("**Reverse (Returns)**")
+        st.dataframe(zone_rev, use_container_width=True, hide_index=True)
+
+    # Sales state analysis
+    if 'state' in sales.columns:
+        st.markdown('<div class="section-title">Sales Sheet — State Orders</div>', unsafe_allow_html=True)
+        sales_state = sales.groupby('state').agg(
+            Orders=('packet_id','count'),
+            Revenue=('invoiceamount','sum')
+        ).reset_index().sort_values('Orders', ascending=False)
+        sales_state['Revenue'] = sales_state['Revenue'].round(2)
+        st.dataframe(sales_state, use_container_width=True, hide_index=True)
+
+
+# ─────────────────────────────────────────────
+# Header
+# ─────────────────────────────────────────────
+st.markdown("""
+<div class="main-header">
+  <h1>🛍️ Myntra Seller Analytics Dashboard</h1>
+  <p>Payment Gateway Reconciliation · Sales Analysis · Returns · Settlement Tracking</p>
+  <span class="badge">BRAND: SANGRIA · JAN 2026</span>
+</div>
+""", unsafe_allow_html=True)
+
+# ─────────────────────────────────────────────
+# Sidebar — file upload (always shown)
+# ─────────────────────────────────────────────
+with st.sidebar:
+    st.markdown("### 📂 Data Files")
+    st.markdown("Upload all 5 reports:")
+    st.caption("Each report takes several files (e.g. weekly PG exports) or a ZIP of them.")
+    up_fwd   = st.file_uploader("1️⃣ PG Forward CSV",          type=["csv","zip"], accept_multiple_files=True)
+    up_rev   = st.file_uploader("2️⃣ PG Reverse CSV",          type=["csv","zip"], accept_multiple_files=True)
+    up_sales = st.file_uploader("3️⃣ Sales Sheet (XLSX/CSV)",  type=["xlsx","csv","xls","zip"], accept_multiple_files=True)
+    up_rto   = st.file_uploader("4️⃣ RTO Report (XLSX/CSV)",   type=["xlsx","csv","xls","zip"], accept_multiple_files=True)
+    up_rt    = st.file_uploader("5️⃣ RT Report (XLSX/CSV)",    type=["xlsx","csv","xls","zip"], accept_multiple_files=True)
+    WATCHER = folder_watcher(WATCH_DIR) if WATCH_DIR else None
+    WATCH_MONTH = None
+    if WATCHER is not None:
+        WATCH_MONTH = st.selectbox("📁 Or open a month from the watched folder", [None] + WATCHER.months,
+            format_func=lambda m: m or "—", key="watch_month",
+            help="Reports dropped into the watched folder are recognised by their headers, parsed and "
+                 "reconciled in the background (and saved, when Supabase is connected). Uploads above "
+                 "take precedence.")
+        _last = WATCHER.batches[-1] if WATCHER.batches else None
+        st.caption(f"👀 Watching `{WATCH_DIR}`" + (
+            f" — last batch {_last['at']:%H:%M:%S}: {', '.join(_last['months']) or 'no reports'}" if _last else ""))
+        for _m, _err in (_last['errors'] if _last else {}).items():
+            st.caption(f"⚠️ {_m}: {_err}")
+        if WATCHER.unrecognised:
+            st.caption(f"❔ {len(WATCHER.unrecognised)} file(s) not recognised: "
+                       + ", ".join(os.path.basename(p) for p in WATCHER.unrecognised))
+    USE_ARROW = st.checkbox("⚡ Arrow engine (faster parsing)", value=False, disabled=not ARROW_OK,
+        help="Parse with PyArrow (multithreaded) and keep Arrow-backed columns end to end. Needs pyarrow.")
+    EXACT_PAISE = st.checkbox("₹ Exact paise arithmetic", value=False,
+        help="Run the Order Settlement Checker on int64 paise — exact sums and ₹2 tolerance, "
+             "converted to rupees only for display.")
+    STAGED = st.checkbox("🚀 Staged loading", value=True,
+        help="Show the headline KPIs as soon as PG Forward/Reverse are parsed, and build the "
+             "checker, UTR tracker and data-quality results in the background while the tabs draw.")
+    PREVIEW = st.checkbox("🔎 Quick preview (sampled)", value=False,
+        help="For very large PG exports: one streaming pass gives exact totals plus a sample for "
+             "the Overview, SKU and Geography tables (with ± bounds); the exact dashboard "
+             "replaces it when the full run, started in the background, finishes.")
+    PREVIEW_STRATIFIED = st.checkbox("Sample per shipping state (stratified)", value=False,
+        disabled=not PREVIEW, help="Exact order counts per state; tighter bounds on state tables.")
+    st.markdown("---")
+    st.markdown("**About this Dashboard**")
+    st.caption("Analyzes Myntra PG Forward/Reverse + Sales/RTO/RT reports for order-wise payment reconciliation.")
+    if IS_ADMIN:
+        st.markdown("---")
+        st.markdown("**🔬 Profiling**")
+        if st.button("Profile the next rerun", key="profile_next_btn",
+                     help="Samples one full rerun of the script and writes a speedscope file + folded "
+                          f"stacks to `{PROFILE_DIR}/`, tagged with the upload hashes and row counts."):
+            st.session_state["profile_next"] = True
+            st.rerun()
+        if PROFILER is not None:
+            st.caption("⏺️ Profiling this rerun — it is listed here from the next rerun on.")
+        for _p in reversed(profile_log()):
+            if not os.path.exists(_p['speedscope']):
+                continue
+            _rows = ", ".join(f"{UPLOAD_SLOTS[k]} {v:,}" for k, v in _p['tags'].get('rows', {}).items())
+            st.caption(f"{_p['title']} — {_p['seconds']:.2f}s, {_p['samples']:,} samples"
+                       + (f" · {_rows} rows" if _rows else ""))
+            with open(_p['speedscope'], 'rb') as _f:
+                st.download_button("⬇️ speedscope", data=_f.read(), file_name=os.path.basename(_p['speedscope']),
+                                   mime="application/json", key=f"prof_{_p['speedscope']}")
+
+# ─────────────────────────────────────────────
+# Load — only from uploads, no local fallback
+# ─────────────────────────────────────────────
+USE_WATCHED = WATCH_MONTH is not None and not (up_fwd or up_rev or up_sales or up_rto or up_rt)
+if not (up_fwd and up_rev and up_sales) and not USE_WATCHED:
+    st.info(
+        "👈 **Please upload the required files in the sidebar:**\n\n"
+        "1. **PG Forward CSV** — payment report for forward orders\n"
+        "2. **PG Reverse CSV** — deductions for customer returns\n"
+        "3. **Sales Sheet** — main sales report (XLSX/CSV)\n"
+        "4. **RTO Report** — courier returns (optional)\n"
+        "5. **RT Report** — customer returns (optional)"
+    )
+    st.stop()
+
+@st.cache_resource
+def parse_executor(processes):
+    return make_parse_executor(processes)
+
+# Parse + coerce the five reports concurrently (every file / ZIP member is its
+# own task); errors are reported per file
+if USE_WATCHED:
+    # Parsed (and reconciled) by the folder watcher already — reuse its results
+    UPLOADS = WATCHER.uploads(WATCH_MONTH)
+    _missing = [UPLOAD_SLOTS[s] for s in ('pg_fwd', 'pg_rev', 'sales') if s not in UPLOADS]
+    if _missing:
+        st.info(f"📁 {WATCH_MONTH}: waiting for {', '.join(_missing)} in the watched folder.")
+        st.stop()
+    INPUT_KEY = WATCHER.input_key(WATCH_MONTH)
+else:
+    try:
+        UPLOADS = {slot: upload_parts(files) for slot, files in
+                   [('pg_fwd', up_fwd), ('pg_rev', up_rev), ('sales', up_sales), ('rto', up_rto), ('rt', up_rt)]
+                   if files}
+    except (ValueError, zipfile.BadZipFile) as e:
+        st.error(f"❌ Error reading uploaded files: {e}")
+        st.stop()
+    INPUT_KEY = content_key(up_fwd, up_rev, up_sales, up_rto, up_rt) + (':arrow' if USE_ARROW else '')
+_any_excel = any((member or name).lower().endswith(('.xlsx', '.xls'))
+                 for parts in UPLOADS.values() for name, _, member in parts)
+
+@st.cache_resource
+def refine_jobs():
+    """Full parses started behind a preview, kept across reruns per upload."""
+    return OrderedDict()
+
+def show_refine_progress(futs):
+    done = sum(f.done() for parts in futs.values() for _, f in parts)
+    total = sum(len(parts) for parts in futs.values())
+    if done == total:
+        st.rerun()   # exact results are in — redraw the full dashboard
+    st.progress(done / max(total, 1), text=f"⏳ Exact run in the background: {done}/{total} files parsed")
+
+_t0 = datetime.now()
+_preview = None
+if USE_WATCHED:
+    _parse_futs = WATCHER.futures(WATCH_MONTH)
+elif PREVIEW:
+    _strat = PREVIEW_STRATA_COL if PREVIEW_STRATIFIED else None
+    try:
+        _preview = memo_result('preview', f"{INPUT_KEY}:{_strat}", lambda: {
+            slot: preview_scan(UPLOADS[slot], stratify=_strat) for slot in ('pg_fwd', 'pg_rev')})
+    except Exception as e:
+        st.warning(f"⚠️ Preview unavailable ({e}) — running the full reconciliation.")
+    _jobs = refine_jobs()
+    if INPUT_KEY not in _jobs:
+        _jobs[INPUT_KEY] = submit_parses(parse_executor(_any_excel), UPLOADS, USE_ARROW)
+        while len(_jobs) > 2:
+            _jobs.popitem(last=False)
+    _parse_futs = _jobs[INPUT_KEY]
+else:
+    _parse_futs = submit_parses(parse_executor(_any_excel), UPLOADS, USE_ARROW)
+
+if _preview is not None and not all(f.done() for parts in _parse_futs.values() for _, f in parts):
+    pv_fwd, pv_rev = _preview['pg_fwd'], _preview['pg_rev']
+    st.info(f"🔎 **Preview** — totals and counts are exact; grouped tables are estimated from a "
+            f"{len(pv_fwd):,}-row sample of {frame_rows(pv_fwd):,} orders"
+            + (" (stratified by shipping state)" if PREVIEW_STRATIFIED else "")
+            + ". **±** is a 95% bound. The exact dashboard replaces this view when the full run finishes.")
+    if hasattr(st, "fragment"):
+        st.fragment(run_every=1.0)(show_refine_progress)(_parse_futs)
+    else:
+        show_refine_progress(_parse_futs)
+        st.button("🔄 Check for exact results", key="preview_refresh")
+    p_overview, p_sku, p_geo = st.tabs(["📊 Overview", "📦 SKU & Product", "🌍 Geography"])
+    with p_overview:
+        render_overview(pv_fwd, pv_rev)
+    with p_sku:
+        render_sku(pv_fwd, pv_rev)
+    with p_geo:
+        render_geo(pv_fwd, pv_rev, pd.DataFrame())
+    st.stop()
+
+first_paint = st.empty()
+if STAGED:
+    # First paint: headline KPIs need only PG Forward/Reverse, so draw them
+    # while Sales/RTO/RT (often slow XLSX) are still parsing
+    PARSED, PARSE_ERRORS = collect_parses(_parse_futs, ('pg_fwd', 'pg_rev'))
+    if not PARSE_ERRORS:
+        with first_paint.container():
+            st.caption("⏳ Headline numbers from PG Forward/Reverse — the full dashboard follows.")
+            kpi_row(overview_kpis(PARSED['pg_fwd']['df'], PARSED['pg_rev']['df']))
+    _rest, _rest_errors = collect_parses(_parse_futs, [s for s in _parse_futs if s not in PARSED])
+    PARSED.update(_rest)
+    PARSE_ERRORS.update(_rest_errors)
+else:
+    PARSED, PARSE_ERRORS = collect_parses(_parse_futs)
+# Shallow copies (copy-on-write): a preview's parses are reused across reruns,
+# and the columns added below must not leak back into them
+PARSED = {slot: dict(res, df=res['df'].copy(deep=False)) for slot, res in PARSED.items()}
+if PARSE_ERRORS:
+    first_paint.empty()
+    for slot, msg in PARSE_ERRORS.items():
+        if EXCEL_ENGINE_HELP in msg:
+            st.error(EXCEL_ENGINE_HELP)
+        else:
+            st.error(f"❌ Error reading {msg}")
+    st.stop()
+for res in PARSED.values():
+    for n in res['notes']:
+        st.warning(f"⚠️ {n}")
+PARSE_SECONDS = (datetime.now() - _t0).total_seconds()
+
+NAN_ROWS = {slot: PARSED[slot]['nan_rows'] for slot in ('pg_fwd', 'pg_rev', 'sales')}   # for the quality rules
+pg_fwd = PARSED['pg_fwd']['df']
+pg_rev = PARSED['pg_rev']['df']
+sales, SALES_COLS = PARSED['sales']['df'], PARSED['sales']['mapping']
+pg_fwd['_type'] = 'Forward'
+pg_rev['_type'] = 'Return'
+rto_df = PARSED['rto']['df'] if 'rto' in PARSED else pd.DataFrame(columns=['order_release_id','rto_value'])
+rt_df  = PARSED['rt']['df']  if 'rt'  in PARSED else pd.DataFrame(columns=['order_release_id','rt_value'])
+with st.sidebar:
+    _slowest = max(PARSED, key=lambda k: PARSED[k]['seconds'])
+    st.caption(f"⏱️ Parsed {sum(r['files'] for r in PARSED.values())} files in {PARSE_SECONDS:.2f}s "
+               f"(slowest: {UPLOAD_SLOTS[_slowest]} {PARSED[_slowest]['seconds']:.2f}s)")
+    for slot, res in PARSED.items():
+        if res['dropped']:
+            st.caption(f"🧹 {UPLOAD_SLOTS[slot]}: {res['dropped']:,} duplicate settlement lines "
+                       f"across {res['files']} files removed")
+
+# One int64 key dictionary for order/packet ids across all five reports
+KEYS = attach_keys(pg_fwd, pg_rev, sales, rto_df, rt_df, SALES_COLS.get('order_id', sales.columns[0]))
+
+if PROFILER is not None:
+    PROFILER.tag(input_key=INPUT_KEY,
+                 uploads={slot: {part_label(name, member): hashlib.sha1(data).hexdigest()[:12]
+                                 for name, data, member in parts} for slot, parts in UPLOADS.items()},
+                 rows={slot: len(res['df']) for slot, res in PARSED.items()})
+
+def checker_result():
+    """Order Settlement Checker output for this upload — built once, shared by
+    the checker tab and the save job."""
+    return memo_result('checker', INPUT_KEY + (':paise' if EXACT_PAISE else ''), lambda: build_checker(
+        sales, pg_fwd, pg_rev, rto_df, rt_df,
+        SALES_COLS.get('order_id', sales.columns[0]), SALES_COLS.get('seller_price'),
+        exact=EXACT_PAISE))
+
+# ─────────────────────────────────────────────
+# Settlement date columns
+# ─────────────────────────────────────────────
+SETTLE_COLS = [c for c in pg_fwd.columns if 'Settlement_on_2026' in c]
+for c in SETTLE_COLS:
+    pg_fwd[c] = safe_num(pg_fwd[c])
+    pg_rev[c] = safe_num(pg_rev[c])
+
+# ─────────────────────────────────────────────
+# Data-quality rules — one vectorized pass, cached with the parsed upload
+# ─────────────────────────────────────────────
+QUALITY_FRAMES = {'pg_fwd': pg_fwd, 'pg_rev': pg_rev, 'sales': sales, 'rto': rto_df, 'rt': rt_df}
+
+def quality_result():
+    return memo_result('quality', INPUT_KEY, lambda: run_rules(
+        QUALITY_FRAMES, {'sales_price_col': SALES_COLS.get('seller_price'),
+                       'sales_id_col': SALES_COLS.get('order_id', sales.columns[0]), 'nan_rows': NAN_ROWS}))
+
+def utr_result():
+    return memo_result('utr', INPUT_KEY, lambda: utr_tracker(pg_fwd))
+
+@st.cache_resource
+def prefetch_executor():
+    return make_prefetch_executor()
+
+# Staged loading: the heavy results build on background threads (frames are
+# no longer mutated past this point) while the tabs below draw; each tab then
+# picks its result up from memo_result, waiting only if it is still running
+if STAGED:
+    prefetch(prefetch_executor(), {'quality': quality_result, 'checker': checker_result, 'utr': utr_result})
+
+def show_quality():
+    if STAGED and not memo_ready('quality', INPUT_KEY):
+        st.caption("🩺 Data-quality rules running in the background…")
+        return
+    quality = quality_result()
+    q_summary = quality.summary()
+    if q_summary.empty:
+        return
+    n_err = quality.count('error')
+    with st.expander(f"🩺 Data quality — {len(q_summary)} rule(s) flagged"
+                     + (f", {n_err} error(s)" if n_err else ""), expanded=bool(n_err)):
+        st.dataframe(q_summary.drop(columns='rule_id'), use_container_width=True, hide_index=True)
+        q_pick = st.selectbox("Show rows for", q_summary['rule_id'].tolist(), key="dq_rule",
+            format_func=lambda r: q_summary.set_index('rule_id').loc[r, 'Report'] + " — "
+                                  + q_summary.set_index('rule_id').loc[r, 'Rule'])
+        q_rows = quality.rows(QUALITY_FRAMES, q_pick)
+        paged_table(q_rows, key="dq_tbl", page_size=50)
+        st.download_button("📥 Download flagged rows (CSV)", data=q_rows.to_csv(index=False).encode(),
+                           file_name=f"dq_{q_pick}.csv", mime="text/csv", key="dq_dl")
+
+# Poll until the background rules finish (fragment reruns only this block)
+if STAGED and hasattr(st, "fragment") and not memo_ready('quality', INPUT_KEY):
+    st.fragment(run_every=1.0)(show_quality)()
+else:
+    show_quality()
+
+# ─────────────────────────────────────────────
+# TABS
+# ─────────────────────────────────────────────
+tabs = st.tabs([
+    "📊 Overview",
+    "🔄 Payment Reconciliation",
+    "🛒 Sales Analysis",
+    "↩️ Returns Analysis",
+    "💳 Settlement Tracker",
+    "📦 SKU & Product",
+    "🌍 Geography",
+    "💸 Charges Breakup",
+    "✅ Order Settlement Checker",
+    "💾 Save & Reports",
+    "📂 Historical & Real-time Analysis",
+])
+(t_overview, t_recon, t_sales, t_returns,
+ t_settle, t_sku, t_geo, t_charges, t_checker,
+ t_save, t_history) = tabs
+
+# ══════════════════════════════════════════════
+# TAB 1 — OVERVIEW
+# ══════════════════════════════════════════════
+with t_overview:
+    render_overview(pg_fwd, pg_rev)
+    first_paint.empty()
+
 # ══════════════════════════════════════════════
 # TAB 2 — PAYMENT RECONCILIATION
 # ══════════════════════════════════════════════
@@ -458,6 +997,7 @@ with t_recon:
     )
 
     # Build reconciliation: match PG Forward ↔ Sales by packet_id
+    # Projection + rename only — with copy-on-write these share pg_fwd's buffers
     fwd_recon = pg_fwd[[
         'packet_id','order_release_id','invoice_number','sku_code',
         'seller_product_amount','mrp','total_discount_amount',
@@ -466,123 +1006,152 @@ with t_recon:
         'total_expected_settlement','total_actual_settlement',
         'amount_pending_settlement','tcs_amount','tds_amount',
         'commission_percentage','bank_utr_no_prepaid_payment',
-        'bank_utr_no_postpaid_payment','article_type'
-    ]].copy()
-    fwd_recon.columns = ['packet_id','order_release_id','invoice_number','sku',
-        'seller_amount','mrp','discount',
-        'prepaid_amt','postpaid_amt',
-        'commission','logistics',
-        'expected_settlement','actual_settlement',
-        'pending_settlement','tcs','tds',
-        'commission_pct','utr_prepaid','utr_postpaid','article_type']
+        'bank_utr_no_postpaid_payment','article_type','_pid'
+    ]].rename(columns={
+        'sku_code': 'sku', 'seller_product_amount': 'seller_amount', 'total_discount_amount': 'discount',
+        'prepaid_amount': 'prepaid_amt', 'postpaid_amount': 'postpaid_amt',
+        'total_commission': 'commission', 'total_logistics_deduction': 'logistics',
+        'total_expected_settlement': 'expected_settlement', 'total_actual_settlement': 'actual_settlement',
+        'amount_pending_settlement': 'pending_settlement', 'tcs_amount': 'tcs', 'tds_amount': 'tds',
+        'commission_percentage': 'commission_pct',
+        'bank_utr_no_prepaid_payment': 'utr_prepaid', 'bank_utr_no_postpaid_payment': 'utr_postpaid'})
 
     sales_recon = sales[[
-        'packet_id','order_id','SKU','payment_method',
+        '_pid','order_id','SKU','payment_method',
         'invoiceamount','shipment_value','mrp','discount',
         'tax_amount','tcs_amount','tds_amount'
-    ]].copy() if all(c in sales.columns for c in ['packet_id','order_id','SKU','payment_method','invoiceamount']) else pd.DataFrame()
+    ]] if all(c in sales.columns for c in ['packet_id','order_id','SKU','payment_method','invoiceamount']) else pd.DataFrame()
 
+    with st.expander("⚙️ Join settings — duplicate packet_ids & memory budget"):
+        jc1, jc2 = st.columns(2)
+        dup_strategy = jc1.selectbox("Duplicate packet_id handling", list(DUP_STRATEGIES),
+                                     format_func=DUP_STRATEGIES.get, key="recon_dup")
+        join_budget  = jc2.number_input("Join memory budget (MB)", min_value=64, value=512,
+                                        step=64, key="recon_budget")
+
+    merged, dup_report = None, pd.DataFrame()
     if not sales_recon.empty:
-        sales_recon.columns = ['packet_id','order_id','sku_sales','payment_method',
+        sales_recon = sales_recon.set_axis(['_pid','order_id','sku_sales','payment_method',
             'invoice_amount','shipment_value','mrp_sales','discount_sales',
-            'tax_amount','tcs_sales','tds_sales']
-        merged = fwd_recon.merge(sales_recon, on='packet_id', how='outer', indicator=True)
+            'tax_amount','tcs_sales','tds_sales'], axis=1)
+        # Join on int64 packet codes after the duplicate-key guard; restore the
+        # packet_id string for display
+        try:
+            merged, dup_report = guarded_outer_merge(
+                fwd_recon, sales_recon, '_pid', dup_strategy, join_budget, labels=('PG Forward', 'Sales'))
+            merged['packet_id'] = KEYS.decode(merged['_pid'])
+        except JoinTooLarge as e:
+            dup_report = e.dup_report
+            st.error(f"❌ Reconciliation join stopped: {e}")
     else:
-        merged = fwd_recon.copy()
-        merged['_merge'] = 'left_only'
-
-    # Classify
-    def classify(row):
-        if row.get('_merge','left_only') == 'both':
-            if 'invoice_amount' in row and abs(safe_num(pd.Series([row['seller_amount']])).values[0] -
-               safe_num(pd.Series([row.get('invoice_amount',0)])).values[0]) < 2:
-                return '✅ Matched'
-            else:
-                return '⚠️ Amount Mismatch'
-        elif row.get('_merge','left_only') == 'left_only':
-            if safe_num(pd.Series([row.get('pending_settlement',0)])).values[0] > 0:
-                return '🕐 PG Only – Settlement Pending'
-            return '✅ PG Only – Settled'
-        else:
-            return '❓ Sales Only – Not in PG'
-
-    merged['Recon_Status'] = merged.apply(classify, axis=1)
-
-    # Summary
-    status_counts = merged['Recon_Status'].value_counts()
-    rc1,rc2,rc3,rc4 = st.columns(4)
-    matched   = status_counts.get('✅ Matched',0) + status_counts.get('✅ PG Only – Settled',0)
-    mismatch  = status_counts.get('⚠️ Amount Mismatch',0)
-    pending   = status_counts.get('🕐 PG Only – Settlement Pending',0)
-    sales_only= status_counts.get('❓ Sales Only – Not in PG',0)
-
-    rc1.markdown(f"""<div class="kpi-card green">
-        <div class="kpi-label">Matched / Settled</div>
-        <div class="kpi-value">{matched}</div></div>""", unsafe_allow_html=True)
-    rc2.markdown(f"""<div class="kpi-card orange">
-        <div class="kpi-label">Amount Mismatch</div>
-        <div class="kpi-value">{mismatch}</div></div>""", unsafe_allow_html=True)
-    rc3.markdown(f"""<div class="kpi-card">
-        <div class="kpi-label">Settlement Pending</div>
-        <div class="kpi-value">{pending}</div></div>""", unsafe_allow_html=True)
-    rc4.markdown(f"""<div class="kpi-card red">
-        <div class="kpi-label">Sales Not in PG</div>
-        <div class="kpi-value">{sales_only}</div></div>""", unsafe_allow_html=True)
+        merged = fwd_recon.assign(_merge='left_only')
+
+    if not dup_report.empty:
+        with st.expander(f"🔁 Duplicate packet_ids — {dup_report['_pid'].nunique():,} keys, {len(dup_report):,} rows"):
+            dup_out = dup_report.assign(packet_id=KEYS.decode(dup_report['_pid'])) \
+                .drop(columns=['_pid']).rename(columns={'_side': 'Source'})
+            paged_table(dup_out, key="recon_dups")
+            st.download_button("📥 Download Duplicate Keys (CSV)", data=dup_out.to_csv(index=False).encode(),
+                file_name="recon_duplicate_packet_ids.csv", mime="text/csv")
+
+
+    if merged is not None:
+        # Classify
+        merged['Recon_Status'] = recon_status(merged)
+
+        # Summary
+        status_counts = merged['Recon_Status'].value_counts()
+        rc1,rc2,rc3,rc4 = st.columns(4)
+        matched   = status_counts.get('✅ Matched',0) + status_counts.get('✅ PG Only – Settled',0)
+        mismatch  = status_counts.get('⚠️ Amount Mismatch',0)
+        pending   = status_counts.get('🕐 PG Only – Settlement Pending',0)
+        sales_only= status_counts.get('❓ Sales Only – Not in PG',0)
+
+        rc1.markdown(f"""<div class="kpi-card green">
+            <div class="kpi-label">Matched / Settled</div>
+            <div class="kpi-value">{matched}</div></div>""", unsafe_allow_html=True)
+        rc2.markdown(f"""<div class="kpi-card orange">
+            <div class="kpi-label">Amount Mismatch</div>
+            <div class="kpi-value">{mismatch}</div></div>""", unsafe_allow_html=True)
+        rc3.markdown(f"""<div class="kpi-card">
+            <div class="kpi-label">Settlement Pending</div>
+            <div class="kpi-value">{pending}</div></div>""", unsafe_allow_html=True)
+        rc4.markdown(f"""<div class="kpi-card red">
+            <div class="kpi-label">Sales Not in PG</div>
+            <div class="kpi-value">{sales_only}</div></div>""", unsafe_allow_html=True)
 
-    st.markdown("<br>", unsafe_allow_html=True)
+        st.markdown("<br>", unsafe_allow_html=True)
 
-    # Filter
-    filt_status = st.multiselect("Filter by Reconciliation Status",
-        merged['Recon_Status'].unique().tolist(),
-        default=merged['Recon_Status'].unique().tolist())
-    filtered_recon = merged[merged['Recon_Status'].isin(filt_status)].copy()
-
-    # Search by order_release_id or packet_id
-    search = st.text_input("🔍 Search by Order Release ID / Packet ID / Invoice No")
-    if search:
-        mask = (
-            filtered_recon['packet_id'].astype(str).str.contains(search, case=False, na=False) |
-            filtered_recon['order_release_id'].astype(str).str.contains(search, case=False, na=False) |
-            filtered_recon['invoice_number'].astype(str).str.contains(search, case=False, na=False)
-        )
-        filtered_recon = filtered_recon[mask]
-
-    show_cols = ['packet_id','order_release_id','invoice_number','sku','seller_amount',
-                 'expected_settlement','actual_settlement','pending_settlement',
-                 'commission','logistics','tcs','tds','utr_prepaid','utr_postpaid','Recon_Status']
-    show_cols = [c for c in show_cols if c in filtered_recon.columns]
-    st.dataframe(filtered_recon[show_cols], use_container_width=True, hide_index=True)
-
-    st.markdown(f"**Showing {len(filtered_recon)} records**")
-
-    ex1,ex2 = st.columns(2)
-    with ex1:
-        st.download_button("📥 Download Reconciliation (Excel)",
-            data=to_excel(filtered_recon), file_name="recon_Jan26.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
-    with ex2:
-        st.download_button("📥 Download Reconciliation (CSV)",
-            data=filtered_recon.to_csv(index=False).encode(),
-            file_name="recon_Jan26.csv", mime="text/csv")
+        # Filter
+        filt_status = st.multiselect("Filter by Reconciliation Status",
+            merged['Recon_Status'].unique().tolist(),
+            default=merged['Recon_Status'].unique().tolist())
+        filtered_recon = merged[merged['Recon_Status'].isin(filt_status)]
+
+        # Search by order_release_id or packet_id
+        search = st.text_input("🔍 Search by Order Release ID / Packet ID / Invoice No")
+        if search:
+            mask = (
+                filtered_recon['packet_id'].astype(str).str.contains(search, case=False, na=False) |
+                filtered_recon['order_release_id'].astype(str).str.contains(search, case=False, na=False) |
+                filtered_recon['invoice_number'].astype(str).str.contains(search, case=False, na=False)
+            )
+            filtered_recon = filtered_recon[mask]
+
+        show_cols = ['packet_id','order_release_id','invoice_number','sku','seller_amount',
+                     'expected_settlement','actual_settlement','pending_settlement',
+                     'commission','logistics','tcs','tds','utr_prepaid','utr_postpaid','Recon_Status']
+        show_cols = [c for c in show_cols if c in filtered_recon.columns]
+        paged_table(filtered_recon[show_cols], key="recon_tbl")
+
+        st.markdown(f"**Showing {len(filtered_recon)} records**")
+
+        ex1,ex2 = st.columns(2)
+        with ex1:
+            st.download_button("📥 Download Reconciliation (Excel)",
+                data=to_excel(filtered_recon), file_name="recon_Jan26.xlsx",
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+        with ex2:
+            st.download_button("📥 Download Reconciliation (CSV)",
+                data=filtered_recon.to_csv(index=False).encode(),
+                file_name="recon_Jan26.csv", mime="text/csv")
 
     st.markdown("---")
     st.markdown('<div class="section-title">↔️ Forward ↔ Reverse Reconciliation</div>', unsafe_allow_html=True)
     st.markdown("Orders that appear in both Forward (delivered) and Reverse (returned) — potential double-deduction check.")
-    common_order_ids = set(pg_fwd['order_release_id'].astype(str)) & set(pg_rev['order_release_id'].astype(str))
-    if common_order_ids:
-        fwd_common = pg_fwd[pg_fwd['order_release_id'].astype(str).isin(common_order_ids)][
-            ['order_release_id','packet_id','seller_product_amount','total_actual_settlement','article_type','sku_code']
+    common_order_ids = np.intersect1d(pg_fwd['_oid'].to_numpy(), pg_rev['_oid'].to_numpy())
+    if len(common_order_ids):
+        fwd_common = pg_fwd.loc[pg_fwd['_oid'].isin(common_order_ids),
+            ['order_release_id','packet_id','seller_product_amount','total_actual_settlement','article_type','sku_code','_oid']
         ].rename(columns={'seller_product_amount':'fwd_amount','total_actual_settlement':'fwd_settlement'})
-        rev_common = pg_rev[pg_rev['order_release_id'].astype(str).isin(common_order_ids)][
-            ['order_release_id','return_type','total_actual_settlement','return_date']
+        rev_common = pg_rev.loc[pg_rev['_oid'].isin(common_order_ids),
+            ['_oid','return_type','total_actual_settlement','return_date']
         ].rename(columns={'total_actual_settlement':'rev_settlement'})
-        cross = fwd_common.merge(rev_common, on='order_release_id', how='inner')
+        cross = fwd_common.merge(rev_common, on='_oid', how='inner').drop(columns='_oid')
         cross['net_effect'] = safe_num(cross['fwd_settlement']) + safe_num(cross['rev_settlement'])
         st.dataframe(cross, use_container_width=True, hide_index=True)
         st.info(f"⚠️ {len(cross)} orders appear in both Forward and Reverse. Net effect: {fmt_inr(cross['net_effect'].sum())}")
     else:
         st.success("✅ No order appears in both Forward and Reverse — no double entries detected.")
 
+    # Exchanges spread one purchase over several order ids — reconcile the chain as a unit
+    st.markdown('<div class="section-title">🔗 Exchange & Re-shipment Chains</div>', unsafe_allow_html=True)
+    st.markdown("Orders linked through a shared packet or an exchange link, reconciled together.")
+    chains_df = memo_result('chains', INPUT_KEY, lambda: chain_summary(
+        chain_ids(KEYS, pg_fwd, pg_rev, sales), KEYS, pg_fwd, pg_rev))
+    if chains_df.empty:
+        st.success("✅ No multi-order exchange chains found.")
+    else:
+        cc1,cc2,cc3,cc4 = st.columns(4)
+        cc1.metric("Exchange Chains",          fmt_num(len(chains_df)))
+        cc2.metric("Orders in Chains",         fmt_num(chains_df['Orders'].sum()))
+        cc3.metric("Orders Pending Alone",     fmt_num(chains_df['Orders_Pending'].sum()))
+        cc4.metric("Chains Still Pending",     fmt_num((chains_df['Chain_Status'] == 'Pending').sum()))
+        paged_table(chains_df, key="chain_tbl")
+        st.download_button("📥 Download Exchange Chains (CSV)",
+            data=chains_df.to_csv(index=False).encode(),
+            file_name="exchange_chains.csv", mime="text/csv")
+
 # ══════════════════════════════════════════════
 # TAB 3 — SALES ANALYSIS
 # ══════════════════════════════════════════════
@@ -638,8 +1207,9 @@ with t_sales:
 
     st.markdown('<div class="section-title">Daily Order Trend</div>', unsafe_allow_html=True)
     if 'order_packed_date' in sales.columns:
-        sales['packed_date_dt'] = pd.to_datetime(sales['order_packed_date'], errors='coerce')
-        daily = sales.groupby(sales['packed_date_dt'].dt.date).agg(
+        # local Series, not a new column — background builders may be reading `sales`
+        packed_dt = pd.to_datetime(sales['order_packed_date'], errors='coerce')
+        daily = sales.groupby(packed_dt.dt.date).agg(
             Orders=('packet_id','count'),
             Revenue=('invoiceamount','sum')
         ).reset_index()
@@ -719,40 +1289,9 @@ with t_settle:
         unsafe_allow_html=True
     )
 
-    # Build UTR-level tracker for Forward
-    utr_rows = []
-    for _, row in pg_fwd.iterrows():
-        for pay_type, utr_col, date_col, amt_col in [
-            ('Prepaid – Commission', 'bank_utr_no_prepaid_comm_deduction',
-             'settlement_date_prepaid_comm_deduction', 'prepaid_commission_deduction'),
-            ('Prepaid – Logistics',  'bank_utr_no_prepaid_logistics_deduction',
-             'settlement_date_prepaid_logistics_deduction', 'prepaid_logistics_deduction'),
-            ('Prepaid – Payment',    'bank_utr_no_prepaid_payment',
-             'settlement_date_prepaid_payment', 'prepaid_payment'),
-            ('Postpaid – Commission','bank_utr_no_postpaid_comm_deduction',
-             'settlement_date_postpaid_comm_deduction', 'postpaid_commission_deduction'),
-            ('Postpaid – Logistics', 'bank_utr_no_postpaid_logistics_deduction',
-             'settlement_date_postpaid_logistics_deduction', 'postpaid_logistics_deduction'),
-            ('Postpaid – Payment',   'bank_utr_no_postpaid_payment',
-             'settlement_date_postpaid_payment', 'postpaid_payment'),
-        ]:
-            utr = row.get(utr_col, None)
-            dt  = row.get(date_col, None)
-            amt = row.get(amt_col, 0)
-            if pd.notna(utr) and str(utr).strip() not in ('','nan'):
-                utr_rows.append({
-                    'Order_ID':    row['order_release_id'],
-                    'Packet_ID':   row['packet_id'],
-                    'SKU':         row.get('sku_code',''),
-                    'Type':        pay_type,
-                    'UTR':         str(utr).strip(),
-                    'Settle_Date': str(dt)[:10] if pd.notna(dt) else '',
-                    'Amount':      round(float(amt) if pd.notna(amt) else 0, 2),
-                    'Status':      '✅ Settled' if pd.notna(utr) and str(utr).strip() else '🕐 Pending'
-                })
-
-    if utr_rows:
-        utr_df = pd.DataFrame(utr_rows)
+    # UTR-level tracker for Forward (prefetched in the background when staged)
+    utr_df = utr_result()
+    if not utr_df.empty:
         settled_amt   = utr_df[utr_df['Status']=='✅ Settled']['Amount'].sum()
         total_utrs    = utr_df['UTR'].nunique()
         settle_dates  = utr_df['Settle_Date'].nunique()
@@ -773,7 +1312,7 @@ with t_settle:
         if date_sel != 'All':
             utr_display = utr_display[utr_display['Settle_Date']==date_sel]
 
-        st.dataframe(utr_display, use_container_width=True, hide_index=True)
+        paged_table(utr_display, key="utr_tbl")
 
         # UTR summary
         st.markdown('<div class="section-title">UTR Summary (Total per UTR)</div>', unsafe_allow_html=True)
@@ -795,103 +1334,13 @@ with t_settle:
 # TAB 6 — SKU & PRODUCT
 # ══════════════════════════════════════════════
 with t_sku:
-    st.markdown('<div class="section-title">📦 SKU-wise Performance</div>', unsafe_allow_html=True)
-
-    sku_fwd = pg_fwd.groupby('sku_code').agg(
-        Orders=('order_release_id','count'),
-        Total_MRP=('mrp','sum'),
-        Seller_Revenue=('seller_product_amount','sum'),
-        Total_Settlement=('total_actual_settlement','sum'),
-        Avg_Commission_Pct=('commission_percentage','mean'),
-        Article_Type=('article_type','first')
-    ).reset_index().sort_values('Orders', ascending=False)
-
-    sku_rev = pg_rev.groupby('sku_code').agg(
-        Returns=('order_release_id','count'),
-        Return_Deduction=('total_actual_settlement','sum')
-    ).reset_index()
-
-    sku_all = sku_fwd.merge(sku_rev, on='sku_code', how='left').fillna(0)
-    sku_all['Return_Rate_%'] = (sku_all['Returns'] / sku_all['Orders'] * 100).round(1)
-    sku_all['Net_Settlement'] = (sku_all['Total_Settlement'] + sku_all['Return_Deduction']).round(2)
-    sku_all['Seller_Revenue'] = sku_all['Seller_Revenue'].round(2)
-    sku_all['Total_Settlement']= sku_all['Total_Settlement'].round(2)
-    sku_all['Avg_Commission_Pct']= sku_all['Avg_Commission_Pct'].round(2)
-
-    # SKU search
-    sku_search = st.text_input("🔍 Search SKU")
-    sku_disp = sku_all[sku_all['sku_code'].str.contains(sku_search, case=False, na=False)] if sku_search else sku_all
-
-    st.dataframe(sku_disp, use_container_width=True, hide_index=True)
-
-    st.markdown('<div class="section-title">🔝 Top 10 SKUs by Revenue</div>', unsafe_allow_html=True)
-    top10 = sku_all.nlargest(10,'Seller_Revenue')[['sku_code','Article_Type','Orders','Seller_Revenue','Returns','Return_Rate_%']]
-    st.dataframe(top10, use_container_width=True, hide_index=True)
-
-    st.markdown('<div class="section-title">⚠️ High Return Rate SKUs (>50%)</div>', unsafe_allow_html=True)
-    high_ret = sku_all[(sku_all['Return_Rate_%']>50) & (sku_all['Orders']>=3)].sort_values('Return_Rate_%', ascending=False)
-    if not high_ret.empty:
-        st.dataframe(high_ret, use_container_width=True, hide_index=True)
-    else:
-        st.success("No SKU has return rate >50% with at least 3 orders.")
-
-    st.download_button("📥 Download SKU Report",
-        data=to_excel(sku_all), file_name="sku_report_Jan26.xlsx",
-        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+    render_sku(pg_fwd, pg_rev)
 
 # ══════════════════════════════════════════════
 # TAB 7 — GEOGRAPHY
 # ══════════════════════════════════════════════
 with t_geo:
-    st.markdown('<div class="section-title">🌍 Geography Analysis</div>', unsafe_allow_html=True)
-
-    col1, col2 = st.columns(2)
-    with col1:
-        st.markdown('<div class="section-title">State-wise Sales (Forward)</div>', unsafe_allow_html=True)
-        if 'shipping_state' in pg_fwd.columns:
-            state_fwd = pg_fwd.groupby('shipping_state').agg(
-                Orders=('order_release_id','count'),
-                Revenue=('seller_product_amount','sum'),
-                Settlement=('total_actual_settlement','sum')
-            ).reset_index().sort_values('Orders', ascending=False)
-            state_fwd['Revenue'] = state_fwd['Revenue'].round(2)
-            state_fwd['Settlement'] = state_fwd['Settlement'].round(2)
-            st.dataframe(state_fwd, use_container_width=True, hide_index=True)
-
-    with col2:
-        st.markdown('<div class="section-title">State-wise Returns</div>', unsafe_allow_html=True)
-        if 'shipping_state' in pg_rev.columns:
-            state_rev = pg_rev.groupby('shipping_state').agg(
-                Returns=('order_release_id','count'),
-                Total_Debited=('total_actual_settlement','sum')
-            ).reset_index().sort_values('Returns', ascending=False)
-            state_rev['Total_Debited'] = state_rev['Total_Debited'].round(2)
-            st.dataframe(state_rev, use_container_width=True, hide_index=True)
-
-    st.markdown('<div class="section-title">Shipment Zone Distribution</div>', unsafe_allow_html=True)
-    z1,z2 = st.columns(2)
-    with z1:
-        zone_fwd = pg_fwd['shipment_zone_classification'].value_counts().reset_index()
-        zone_fwd.columns = ['Zone','Forward Orders']
-        zone_fwd['Settlement'] = zone_fwd['Zone'].map(
-            pg_fwd.groupby('shipment_zone_classification')['total_actual_settlement'].sum().round(2))
-        st.markdown("**Forward (Delivered)**")
-        st.dataframe(zone_fwd, use_container_width=True, hide_index=True)
-    with z2:
-        zone_rev = pg_rev['shipment_zone_classification'].value_counts().reset_index()
-        zone_rev.columns = ['Zone','Return Orders']
-        st.markdown("**Reverse (Returns)**")
-        st.dataframe(zone_rev, use_container_width=True, hide_index=True)
-
-    # Sales state analysis
-    if 'state' in sales.columns:
-        st.markdown('<div class="section-title">Sales Sheet — State Orders</div>', unsafe_allow_html=True)
-        sales_state = sales.groupby('state').agg(
-            Orders=('packet_id','count'),
-            Revenue=('invoiceamount','sum')
-        ).reset_index().sort_values('Orders', ascending=False)
-        sales_state['Revenue'] = sales_state['Revenue'].round(2)
-        st.dataframe(sales_state, use_container_width=True, hide_index=True)
+    render_geo(pg_fwd, pg_rev, sales)
 
 # ══════════════════════════════════════════════
 # TAB 8 — CHARGES BREAKUP
@@ -939,19 +1388,93 @@ with t_charges:
                    'total_expected_settlement','total_actual_settlement']
     charge_cols = [c for c in charge_cols if c in pg_fwd.columns]
     charge_search = st.text_input("🔍 Search Order ID / Packet ID", key="charge_search")
-    charge_df = pg_fwd[charge_cols].copy()
+    charge_df = pg_fwd[charge_cols]
     if charge_search:
-        charge_df = charge_df[
+        charge_df = charge_df.loc[
             charge_df['order_release_id'].astype(str).str.contains(charge_search, na=False) |
             charge_df['packet_id'].astype(str).str.contains(charge_search, na=False)
         ]
-    st.dataframe(charge_df.head(500), use_container_width=True, hide_index=True)
+    paged_table(charge_df, key="charge_tbl")
 
     st.download_button("📥 Download Charges Report",
         data=to_excel(pg_fwd[charge_cols]),
         file_name="charges_Jan26.xlsx",
         mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
 
+    # Rate-card validation
+    st.markdown('<div class="section-title">🧾 Rate-Card Validation</div>', unsafe_allow_html=True)
+    st.caption("Upload a rate card (CSV) with columns: " + ", ".join(RATE_CARD_COLS) +
+               " — optional `side` (F/R). Each row is one price slab for an article type + zone.")
+    rc1, rc2 = st.columns([3,1])
+    up_card  = rc1.file_uploader("Rate card CSV", type=['csv'], key="rate_card")
+    rc_tol   = rc2.number_input("Tolerance (₹)", min_value=0.0, value=1.0, step=0.5, key="rate_tol")
+
+    # Starter template from this month's data: one open slab per article type + zone
+    tmpl = pg_fwd.assign(
+        _comm=safe_get(pg_fwd,'commission_percentage'),
+        _logi=safe_get(pg_fwd,'total_logistics_deduction').abs(),
+    ).groupby(['article_type','shipment_zone_classification']).agg(
+        commission_pct=('_comm','median'), logistics_fee=('_logi','median')).reset_index()
+    tmpl.insert(2, 'price_min', 0); tmpl.insert(3, 'price_max', 1e9)
+    rc1.download_button("📄 Download rate-card template", data=tmpl[RATE_CARD_COLS].round(2).to_csv(index=False),
+                        file_name="rate_card_template.csv", mime="text/csv")
+
+    if up_card is not None:
+        try:
+            card = load_rate_card(pd.read_csv(up_card))
+        except ValueError as e:
+            st.error(f"❌ {e}")
+            card = None
+        if card is not None:
+            rc_key = f"{INPUT_KEY}:{content_key(up_card)}:{rc_tol}"
+            checked = memo_result('rate_card', rc_key, lambda: pd.concat([
+                validate_charges(pg_fwd, card, 'F', rc_tol),
+                validate_charges(pg_rev, card, 'R', rc_tol),
+            ], ignore_index=True))
+            over_df = checked[checked['overcharge'] > 0]
+
+            v1,v2,v3,v4 = st.columns(4)
+            v1.metric("Rows Checked",        fmt_num(len(checked)))
+            v2.metric("No Matching Slab",    fmt_num(int((~checked['slab_found']).sum())))
+            v3.metric("Overcharged Rows",    fmt_num(len(over_df)))
+            v4.metric("Total Overcharge",    fmt_inr(over_df['overcharge'].sum()))
+
+            st.dataframe(rate_card_summary(checked), use_container_width=True, hide_index=True)
+            st.markdown('<div class="section-title">Overcharged Rows</div>', unsafe_allow_html=True)
+            paged_table(over_df.sort_values('overcharge', ascending=False), key="rate_over_tbl")
+            st.download_button("📥 Download Rate-Card Check",
+                data=to_excel(checked),
+                file_name="rate_card_check.xlsx",
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+
+    # Statutory deductions (TCS / TDS)
+    st.markdown('<div class="section-title">🧮 TCS / TDS Check</div>', unsafe_allow_html=True)
+    st.caption("Expected TCS/TDS recomputed on taxable_amount (seller_product_amount when missing) "
+               "and compared with PG deductions and the Sales sheet; Sales tax_amount is checked against "
+               "the GST implied by PG (seller_product_amount − taxable_amount).")
+    tx1, tx2, tx3 = st.columns(3)
+    tcs_pct = tx1.number_input("TCS rate (%)", min_value=0.0, value=TCS_PCT, step=0.05, key="tcs_pct")
+    tds_pct = tx2.number_input("TDS rate (%)", min_value=0.0, value=TDS_PCT, step=0.05, key="tds_pct")
+    tax_tol = tx3.number_input("Tolerance (₹)", min_value=0.0, value=1.0, step=0.5, key="tax_tol")
+    stat_df = memo_result('statutory', f"{INPUT_KEY}:{tcs_pct}:{tds_pct}:{tax_tol}",
+        lambda: statutory_check(pg_fwd, sales, SALES_COLS.get('order_id', sales.columns[0]),
+                                tcs_pct, tds_pct, tax_tol))
+    stat_tot = statutory_totals(stat_df).iloc[0]
+
+    sx1,sx2,sx3,sx4,sx5 = st.columns(5)
+    sx1.metric("Expected TCS",    fmt_inr(stat_tot['exp_tcs']))
+    sx2.metric("PG TCS",          fmt_inr(stat_tot['pg_tcs']), delta=f"{stat_tot['tcs_var']:+,.2f}", delta_color="inverse")
+    sx3.metric("Expected TDS",    fmt_inr(stat_tot['exp_tds']))
+    sx4.metric("PG TDS",          fmt_inr(stat_tot['pg_tds']), delta=f"{stat_tot['tds_var']:+,.2f}", delta_color="inverse")
+    sx5.metric("Orders Mismatched", fmt_num(stat_tot['Mismatches']))
+
+    only_mm = st.checkbox("Show mismatches only", value=True, key="tax_mm_only")
+    paged_table(stat_df[stat_df['Status'] == 'Mismatch'] if only_mm else stat_df, key="tax_tbl")
+    st.download_button("📥 Download TCS/TDS Check",
+        data=to_excel(stat_df),
+        file_name="tcs_tds_check.xlsx",
+        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+
 # Footer
 st.markdown("---")
 st.markdown(
@@ -976,183 +1499,14 @@ with t_checker:
     """, unsafe_allow_html=True)
 
     # ═══════════════════════════════════════════
-    # STEP 1 — Build Sales base (master table)
+    # STEPS 1–9 — Sales base + RTO/RT tags + PG joins, formulas and
+    # Payment Status (recon_core.build_checker, memoized per upload)
     # ═══════════════════════════════════════════
-    # Detect order ID col (Col F = index 5)
-    sales_id_col = next(
-        (c for c in ['order_release_id','Order_Release_Id','orderreleaseid','order_id'] if c in sales.columns),
-        sales.columns[5]
-    )
-    # Detect seller_price col (Col AU = index 46)
-    sales_price_col = next(
-        (c for c in ['seller_price','Seller_Price'] if c in sales.columns),
-        (sales.columns[46] if len(sales.columns) > 46 else None)
-    )
-    if not sales_price_col:
+    # seller_price col resolved from headers at load time (legacy: Col AU = index 46)
+    if not SALES_COLS.get('seller_price'):
         st.error("Cannot find seller_price (Col AU) in Sales sheet."); st.stop()
 
-    # Detect optional enrichment cols
-    sales_status_col = next((c for c in ['order_status','Order_Status'] if c in sales.columns), None)
-    extra_sales_cols = [c for c in ['payment_method','article_type','SKU','sku_code','invoiceamount'] if c in sales.columns]
-
-    # Build unique order base
-    base_cols = list(dict.fromkeys(
-        [sales_id_col, sales_price_col]
-        + ([sales_status_col] if sales_status_col else [])
-        + extra_sales_cols
-    ))
-    base = sales[base_cols].copy()
-    base[sales_id_col]    = base[sales_id_col].astype(str).str.strip()
-    base[sales_price_col] = safe_num(base[sales_price_col])
-    base = base.drop_duplicates(subset=[sales_id_col])
-    base = base.rename(columns={
-        sales_id_col:    'order_id',
-        sales_price_col: 'seller_price'
-    })
-    if sales_status_col and sales_status_col in base.columns:
-        base = base.rename(columns={sales_status_col: 'order_status'})
-
-    # ═══════════════════════════════════════════
-    # STEP 2 — Tag Type: Sale / Sale+RTO / Sale+RT
-    # ═══════════════════════════════════════════
-    # RTO ids (Col E = index 4, value Col BM = index 64)
-    rto_ids = set()
-    rto_val_map = {}
-    if not rto_df.empty and 'order_release_id' in rto_df.columns:
-        rto_ids = set(rto_df['order_release_id'].astype(str).str.strip())
-        if 'rto_value' in rto_df.columns:
-            rto_val_map = dict(zip(
-                rto_df['order_release_id'].astype(str).str.strip(),
-                safe_num(rto_df['rto_value'])
-            ))
-
-    # RT ids (Col F = index 5 via shipment_id, value Col BC = index 54)
-    rt_ids = set()
-    rt_val_map = {}
-    if not rt_df.empty and 'order_release_id' in rt_df.columns:
-        rt_ids = set(rt_df['order_release_id'].astype(str).str.strip())
-        if 'rt_value' in rt_df.columns:
-            rt_val_map = dict(zip(
-                rt_df['order_release_id'].astype(str).str.strip(),
-                safe_num(rt_df['rt_value'])
-            ))
-
-    def get_order_type(oid):
-        tags = ['Sale']
-        if oid in rto_ids: tags.append('RTO')
-        if oid in rt_ids:  tags.append('RT')
-        return ' + '.join(tags)
-
-    base['Order Type']  = base['order_id'].apply(get_order_type)
-    base['RTO Value (Rs)'] = base['order_id'].map(rto_val_map).fillna(0.0)
-    base['RT Value (Rs)']  = base['order_id'].map(rt_val_map).fillna(0.0)
-
-    # ═══════════════════════════════════════════
-    # STEP 3 — PG Forward lookup
-    # ═══════════════════════════════════════════
-    pgf_need = ['order_release_id',
-                'total_commission_plus_tcs_tds_deduction',
-                'total_logistics_deduction',
-                'forwardAdditionalCharges_prepaid',
-                'forwardAdditionalCharges_postpaid',
-                'total_actual_settlement',
-                'total_expected_settlement',
-                'amount_pending_settlement']
-    pgf_avail = [c for c in pgf_need if c in pg_fwd.columns]
-    pgf = pg_fwd[pgf_avail].copy()
-    pgf['order_release_id'] = pgf['order_release_id'].astype(str).str.strip()
-    for c in pgf_avail[1:]:
-        pgf[c] = safe_num(pgf[c])
-    # Keep one row per order (aggregate if duplicates)
-    pgf = pgf.groupby('order_release_id', as_index=False).sum(numeric_only=True)
-    pgf = pgf.rename(columns={'order_release_id': 'order_id'})
-
-    # ═══════════════════════════════════════════
-    # STEP 4 — PG Reverse lookup
-    # ═══════════════════════════════════════════
-    pgr_need = ['order_release_id',
-                'total_commission_plus_tcs_tds_deduction',
-                'total_logistics_deduction',
-                'reverseAdditionalCharges_prepaid',
-                'reverseAdditionalCharges_postpaid',
-                'total_actual_settlement',
-                'amount_pending_settlement']
-    pgr_avail = [c for c in pgr_need if c in pg_rev.columns]
-    pgr = pg_rev[pgr_avail].copy()
-    pgr['order_release_id'] = pgr['order_release_id'].astype(str).str.strip()
-    for c in pgr_avail[1:]:
-        pgr[c] = safe_num(pgr[c])
-    pgr = pgr.groupby('order_release_id', as_index=False).sum(numeric_only=True)
-    pgr = pgr.rename(columns={'order_release_id': 'order_id'})
-
-    # Add prefix to avoid col name collisions
-    pgf = pgf.add_prefix('pgf_').rename(columns={'pgf_order_id': 'order_id'})
-    pgr = pgr.add_prefix('pgr_').rename(columns={'pgr_order_id': 'order_id'})
-
-    # ═══════════════════════════════════════════
-    # STEP 5 — LEFT JOIN everything onto Sales base
-    # ═══════════════════════════════════════════
-    df = base.merge(pgf, on='order_id', how='left')
-    df = df.merge(pgr, on='order_id', how='left')
-
-    # Fill all numeric NaN → 0
-    num_cols = df.select_dtypes(include='number').columns
-    df[num_cols] = df[num_cols].fillna(0.0)
-
-    # ═══════════════════════════════════════════
-    # STEP 6 — PG Forward formula
-    # ═══════════════════════════════════════════
-    pgf_comm     = safe_num(df.get('pgf_total_commission_plus_tcs_tds_deduction', 0)).abs()
-    pgf_logi     = safe_num(df.get('pgf_total_logistics_deduction', 0)).abs()
-    pgf_add_pre  = safe_num(df.get('pgf_forwardAdditionalCharges_prepaid', 0)).abs()
-    pgf_add_post = safe_num(df.get('pgf_forwardAdditionalCharges_postpaid', 0)).abs()
-
-    df['FWD Calculated (Rs)'] = (
-        df['seller_price'] - pgf_comm - pgf_logi - pgf_add_pre - pgf_add_post
-    ).round(2)
-    df['FWD Received (Rs)']   = safe_num(df.get('pgf_total_actual_settlement', 0)).round(2)
-    df['FWD Pending (Rs)']    = safe_num(df.get('pgf_amount_pending_settlement', 0)).round(2)
-    df['FWD Difference (Rs)'] = (df['FWD Calculated (Rs)'] - df['FWD Received (Rs)']).round(2)
-
-    # ═══════════════════════════════════════════
-    # STEP 7 — PG Reverse formula
-    # ═══════════════════════════════════════════
-    pgr_comm     = safe_num(df.get('pgr_total_commission_plus_tcs_tds_deduction', 0)).abs()
-    pgr_logi     = safe_num(df.get('pgr_total_logistics_deduction', 0)).abs()
-    pgr_add_pre  = safe_num(df.get('pgr_reverseAdditionalCharges_prepaid', 0)).abs()
-    pgr_add_post = safe_num(df.get('pgr_reverseAdditionalCharges_postpaid', 0)).abs()
-
-    df['REV Deducted (Rs)']  = (pgr_comm - pgr_logi + pgr_add_pre + pgr_add_post).round(2)
-    df['REV Pending (Rs)']   = safe_num(df.get('pgr_amount_pending_settlement', 0)).round(2)
-
-    # ═══════════════════════════════════════════
-    # STEP 8 — Net Amount
-    # ═══════════════════════════════════════════
-    df['Net Amount (Rs)'] = (df['FWD Received (Rs)'] - df['REV Deducted (Rs)']).round(2)
-
-    # ═══════════════════════════════════════════
-    # STEP 9 — Payment Status
-    # Received / Pending / Not Received
-    # ═══════════════════════════════════════════
-    def payment_status(row):
-        fwd_received = row['FWD Received (Rs)']
-        fwd_pending  = row['FWD Pending (Rs)']
-        rev_pending  = row['REV Pending (Rs)']
-
-        # No entry at all in PG Forward
-        if fwd_received == 0 and fwd_pending == 0:
-            return 'Not Received'
-        # Any pending amount
-        if fwd_pending > 0 or rev_pending > 0:
-            return 'Pending'
-        # Payment came but doesn't match formula (tolerance Rs 2)
-        if abs(row['FWD Difference (Rs)']) <= 2:
-            return 'Received'
-        if row['FWD Difference (Rs)'] > 2:
-            return 'Pending'   # shortfall — partial payment
-        return 'Received'
-
-    df['Payment Status'] = df.apply(payment_status, axis=1)
+    df = checker_result()
 
     # ═══════════════════════════════════════════
     # STEP 10 — KPI cards
@@ -1164,9 +1518,9 @@ with t_checker:
     received_n   = (df['Payment Status'] == 'Received').sum()
     pending_n    = (df['Payment Status'] == 'Pending').sum()
     not_recv_n   = (df['Payment Status'] == 'Not Received').sum()
-    not_recv_val = df.loc[df['Payment Status'] == 'Not Received', 'seller_price'].sum()
-    pending_val  = df.loc[df['Payment Status'] == 'Pending', 'FWD Pending (Rs)'].sum()
-    total_net    = df['Net Amount (Rs)'].sum()
+    not_recv_val = money_sum(df.loc[df['Payment Status'] == 'Not Received', 'seller_price'], EXACT_PAISE)
+    pending_val  = money_sum(df.loc[df['Payment Status'] == 'Pending', 'FWD Pending (Rs)'], EXACT_PAISE)
+    total_net    = money_sum(df['Net Amount (Rs)'], EXACT_PAISE)
 
     k1,k2,k3,k4,k5,k6,k7 = st.columns(7)
     k1.markdown(
@@ -1240,20 +1594,18 @@ with t_checker:
         diff_thresh = st.number_input("Show FWD Diff > Rs", min_value=0.0,
                                       value=0.0, step=1.0, key="chk_thresh")
 
-    disp = df[
-        df['Order Type'].isin(type_filter) &
-        df['Payment Status'].isin(pay_filter)
-    ].copy()
+    # One combined mask, applied once to the projected columns below
+    keep = df['Order Type'].isin(type_filter) & df['Payment Status'].isin(pay_filter)
     if search_id:
-        disp = disp[disp['order_id'].astype(str).str.contains(search_id, case=False, na=False)]
+        keep &= df['order_id'].astype(str).str.contains(search_id, case=False, na=False)
     if diff_thresh > 0:
-        disp = disp[disp['FWD Difference (Rs)'].abs() > diff_thresh]
+        keep &= df['FWD Difference (Rs)'].abs() > diff_thresh
 
     # ═══════════════════════════════════════════
     # STEP 12 — Main table (one row per order)
     # ═══════════════════════════════════════════
     fixed_cols = ['order_id', 'Order Type', 'Payment Status']
-    opt_cols   = [c for c in ['order_status','payment_method','article_type'] if c in disp.columns]
+    opt_cols   = [c for c in ['order_status','payment_method','article_type'] if c in df.columns]
     amount_cols = [
         'seller_price',
         'RTO Value (Rs)', 'RT Value (Rs)',
@@ -1261,7 +1613,7 @@ with t_checker:
         'REV Deducted (Rs)', 'REV Pending (Rs)',
         'Net Amount (Rs)'
     ]
-    show_cols = fixed_cols + opt_cols + [c for c in amount_cols if c in disp.columns]
+    show_cols = fixed_cols + opt_cols + [c for c in amount_cols if c in df.columns]
     # Deduplicate
     seen = set(); show_cols = [c for c in show_cols if not (c in seen or seen.add(c))]
 
@@ -1272,11 +1624,10 @@ with t_checker:
         'article_type':       'Article Type',
         'seller_price':       'Seller Price (Rs)',
     }
-    out = disp[show_cols].rename(columns=rename_final)
-    out = out.loc[:, ~out.columns.duplicated()]
-    st.dataframe(out, use_container_width=True, hide_index=True)
+    out = df.loc[keep, show_cols].rename(columns=rename_final)
+    paged_table(out, key="chk_tbl")
     st.caption(
-        f"Showing {len(disp):,} of {total:,} orders  |  "
+        f"Showing {len(out):,} of {total:,} orders  |  "
         f"Received:{received_n}  Pending:{pending_n}  Not Received:{not_recv_n}  |  "
         f"Tolerance Rs 2 for Received"
     )
@@ -1286,38 +1637,48 @@ with t_checker:
     # ═══════════════════════════════════════════
 
     # Not Received
-    nr_df = df[df['Payment Status'] == 'Not Received'].copy()
-    if not nr_df.empty:
+    nr_mask = df['Payment Status'] == 'Not Received'
+    if nr_mask.any():
         st.markdown('<div class="section-title">Not Received — Orders with Zero PG Forward Entry</div>',
                     unsafe_allow_html=True)
         st.markdown("These Order IDs are in your Sales Report but **Myntra has no payment record** in PG Forward.")
         nr_show = ['order_id','Order Type','seller_price','RTO Value (Rs)','RT Value (Rs)']
-        if 'order_status'   in nr_df.columns: nr_show.insert(2,'order_status')
-        if 'payment_method' in nr_df.columns: nr_show.insert(3,'payment_method')
-        nr_show = [c for c in dict.fromkeys(nr_show) if c in nr_df.columns]
-        nr_out  = nr_df[nr_show].rename(columns=rename_final)
-        nr_out  = nr_out.loc[:, ~nr_out.columns.duplicated()]
+        if 'order_status'   in df.columns: nr_show.insert(2,'order_status')
+        if 'payment_method' in df.columns: nr_show.insert(3,'payment_method')
+        nr_show = [c for c in dict.fromkeys(nr_show) if c in df.columns]
+        nr_df   = df.loc[nr_mask, nr_show]
+        nr_out  = nr_df.rename(columns=rename_final)
         st.dataframe(nr_out, use_container_width=True, hide_index=True)
         c1, c2 = st.columns(2)
         c1.metric("Orders Not Received", f"{len(nr_df):,}")
         c2.metric("Seller Price at Risk", f"Rs {nr_df['seller_price'].sum():,.2f}")
+        # Cross-month: settled in a PG Forward file of another saved month?
+        sidx = settlement_index() if SUPABASE_OK else None
+        if sidx is not None and len(sidx):
+            xm = sidx.aggregates(nr_df['order_id'], 'F', 'pgf_')
+            if not xm.empty:
+                xm = xm.rename(columns={'pgf_months': 'Settled In', 'pgf_total_actual_settlement': 'Settled (Rs)',
+                                        'pgf_amount_pending_settlement': 'Pending (Rs)'})
+                st.info(f"🔗 {len(xm):,} of these orders were settled in other saved months' PG Forward files.")
+                st.dataframe(xm[[c for c in ['order_id','Settled In','Settled (Rs)','Pending (Rs)'] if c in xm.columns]],
+                             use_container_width=True, hide_index=True)
         st.download_button(
             "Export – Not Received (Excel)", data=to_excel(nr_out),
             file_name="not_received_orders.xlsx",
             mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
 
     # Pending
-    pnd_df = df[df['Payment Status'] == 'Pending'].copy()
-    if not pnd_df.empty:
+    pnd_mask = df['Payment Status'] == 'Pending'
+    if pnd_mask.any():
         st.markdown('<div class="section-title">Pending — Orders with Partial or Pending Settlement</div>',
                     unsafe_allow_html=True)
         pnd_show = ['order_id','Order Type','seller_price',
                     'FWD Calculated (Rs)','FWD Received (Rs)','FWD Difference (Rs)','FWD Pending (Rs)',
                     'REV Deducted (Rs)','REV Pending (Rs)','Net Amount (Rs)']
-        if 'order_status' in pnd_df.columns: pnd_show.insert(2,'order_status')
-        pnd_show = [c for c in dict.fromkeys(pnd_show) if c in pnd_df.columns]
-        pnd_out  = pnd_df[pnd_show].rename(columns=rename_final)
-        pnd_out  = pnd_out.loc[:, ~pnd_out.columns.duplicated()]
+        if 'order_status' in df.columns: pnd_show.insert(2,'order_status')
+        pnd_show = [c for c in dict.fromkeys(pnd_show) if c in df.columns]
+        pnd_df   = df.loc[pnd_mask, pnd_show]
+        pnd_out  = pnd_df.rename(columns=rename_final)
         st.dataframe(pnd_out, use_container_width=True, hide_index=True)
         c1, c2, c3 = st.columns(3)
         c1.metric("Orders Pending",        f"{len(pnd_df):,}")
@@ -1333,21 +1694,7 @@ with t_checker:
     # ═══════════════════════════════════════════
     st.markdown('<div class="section-title">Summary by Order Type and Payment Status</div>',
                 unsafe_allow_html=True)
-    summary = df.groupby(['Order Type','Payment Status']).agg(
-        Orders             =('order_id',             'count'),
-        Seller_Price       =('seller_price',          'sum'),
-        FWD_Received       =('FWD Received (Rs)',      'sum'),
-        FWD_Pending        =('FWD Pending (Rs)',       'sum'),
-        REV_Deducted       =('REV Deducted (Rs)',      'sum'),
-        Net_Amount         =('Net Amount (Rs)',        'sum'),
-        RTO_Value          =('RTO Value (Rs)',         'sum'),
-        RT_Value           =('RT Value (Rs)',          'sum'),
-    ).reset_index().round(2)
-    summary.columns = [
-        'Order Type','Payment Status','Orders',
-        'Seller Price (Rs)','FWD Received (Rs)','FWD Pending (Rs)',
-        'REV Deducted (Rs)','Net Amount (Rs)','RTO Value (Rs)','RT Value (Rs)'
-    ]
+    summary = checker_summary(df, EXACT_PAISE)
     st.dataframe(summary, use_container_width=True, hide_index=True)
 
     # ═══════════════════════════════════════════
@@ -1365,6 +1712,49 @@ with t_checker:
             data=out.to_csv(index=False).encode(),
             file_name="full_order_settlement.csv", mime="text/csv")
 
+    # ═══════════════════════════════════════════
+    # STEP 16 — Compare with a saved month
+    # ═══════════════════════════════════════════
+    st.markdown('<div class="section-title">🔀 Compare with a Saved Month</div>',
+                unsafe_allow_html=True)
+    saved_rpts = sb_get_reports() if SUPABASE_OK else pd.DataFrame()
+    saved_months = (saved_rpts.loc[saved_rpts['table_ref'] == 'output_reconciliation', 'month_label']
+                    .dropna().unique().tolist()
+                    if {'table_ref', 'month_label'} <= set(saved_rpts.columns) else [])
+    if not saved_months:
+        st.info("No saved Output Reconciliation yet — save a month in the 💾 Save & Reports tab to compare against it.")
+    else:
+        cmp_month = st.selectbox("Saved month", saved_months, key="chk_diff_month")
+        saved_out = sb_load_all("output_reconciliation", months=[cmp_month])
+        if saved_out.empty:
+            st.info(f"No rows stored for {cmp_month}.")
+        else:
+            # kept beside the saved rows it was computed from, so a save or refresh drops it too
+            changes, dcounts = READ_CACHE.get(
+                ReadCache.key("output_reconciliation", (cmp_month,),
+                              variant=f"diff:{INPUT_KEY}:{EXACT_PAISE}"),
+                lambda: diff_outputs(saved_out, checker_export(df)))
+            d1, d2, d3, d4 = st.columns(4)
+            d1.metric("Added Orders", f"{dcounts['added']:,}")
+            d2.metric("Removed Orders", f"{dcounts['removed']:,}")
+            d3.metric("Changed Orders", f"{dcounts['changed']:,}")
+            d4.metric("Unchanged Orders", f"{dcounts['unchanged']:,}")
+            if dcounts['duplicate_keys']:
+                st.caption(f"{dcounts['duplicate_keys']:,} repeated order_id row(s) — the last one was compared.")
+            if changes.empty:
+                st.success(f"✅ Current run matches the saved {cmp_month} output.")
+            else:
+                trans = status_transitions(changes)
+                if not trans.empty:
+                    st.markdown("**Payment Status moves** (— = order not on that side)")
+                    st.dataframe(trans, use_container_width=True, hide_index=True)
+                kinds = st.multiselect("Show", ['changed', 'added', 'removed'],
+                                       default=['changed', 'added', 'removed'], key="chk_diff_kinds")
+                paged_table(changes[changes['Change'].isin(kinds)], "chk_diff")
+                st.download_button(
+                    "Export Diff (CSV)", data=changes.to_csv(index=False).encode(),
+                    file_name=f"order_diff_{cmp_month}.csv", mime="text/csv")
+
 # ══════════════════════════════════════════════
 # TAB 10 — SAVE & REPORTS
 # ══════════════════════════════════════════════
@@ -1383,7 +1773,7 @@ with t_save:
 
     month_label = st.text_input(
         "📅 Month Label for this data (used to identify later)",
-        value=datetime.now().strftime("%B %Y"),
+        value=WATCH_MONTH if USE_WATCHED else datetime.now().strftime("%B %Y"),
         help="e.g. January 2026, February 2026"
     )
 
@@ -1410,150 +1800,36 @@ with t_save:
 
     st.markdown("<br>", unsafe_allow_html=True)
 
-    if st.button("🚀 Save ALL 5 Files + Output Report", use_container_width=True, type="primary", key="save_all_5"):
-        results = {}
-        prog = st.progress(0)
-        status_box = st.empty()
-
-        with st.spinner("Saving all data to Supabase..."):
-
-            # 1. PG Forward
-            status_box.info("Saving PG Forward...")
-            sc = [c for c in ['order_release_id','packet_id','sku_code','article_type',
-                'seller_product_amount','mrp','total_commission','total_logistics_deduction',
-                'total_actual_settlement','amount_pending_settlement','prepaid_amount','postpaid_amount',
-                'total_commission_plus_tcs_tds_deduction',
-                'forwardAdditionalCharges_prepaid','forwardAdditionalCharges_postpaid',
-                'tcs_amount','tds_amount','commission_percentage',
-                'bank_utr_no_prepaid_payment','bank_utr_no_postpaid_payment',
-                'shipment_zone_classification','shipping_state'] if c in pg_fwd.columns]
-            d = pg_fwd[sc].copy(); d['month_label'] = month_label; d['saved_at'] = datetime.utcnow().isoformat()
-            results['pg_forward'] = sb_save_df(d, "pg_forward_data")
-            if results['pg_forward']: sb_log_report(f"PG Forward – {month_label}", "pg_forward_data", results['pg_forward'], month_label)
-            prog.progress(14)
-
-            # 2. PG Reverse
-            status_box.info("Saving PG Reverse...")
-            sc = [c for c in ['order_release_id','packet_id','sku_code','article_type',
-                'return_type','seller_product_amount','total_actual_settlement',
-                'amount_pending_settlement','prepaid_amount','postpaid_amount',
-                'total_commission_plus_tcs_tds_deduction',
-                'reverseAdditionalCharges_prepaid','reverseAdditionalCharges_postpaid',
-                'tcs_amount','tds_amount','return_date','shipment_zone_classification'] if c in pg_rev.columns]
-            d = pg_rev[sc].copy(); d['month_label'] = month_label; d['saved_at'] = datetime.utcnow().isoformat()
-            results['pg_reverse'] = sb_save_df(d, "pg_reverse_data")
-            if results['pg_reverse']: sb_log_report(f"PG Reverse – {month_label}", "pg_reverse_data", results['pg_reverse'], month_label)
-            prog.progress(28)
-
-            # 3. Sales
-            status_box.info("Saving Sales Sheet...")
-            sc = [c for c in ['packet_id','order_id','article_type','payment_method',
-                'invoiceamount','shipment_value','mrp','discount','tax_amount',
-                'order_status','SKU','order_packed_date','state'] if c in sales.columns]
-            d = sales[sc].copy(); d['month_label'] = month_label; d['saved_at'] = datetime.utcnow().isoformat()
-            results['sales'] = sb_save_df(d, "sales_data")
-            if results['sales']: sb_log_report(f"Sales – {month_label}", "sales_data", results['sales'], month_label)
-            prog.progress(42)
-
-            # 4. RTO
-            status_box.info("Saving RTO Report...")
-            if not rto_df.empty:
-                d = rto_df.copy(); d['month_label'] = month_label; d['saved_at'] = datetime.utcnow().isoformat()
-                results['rto'] = sb_save_df(d, "rto_data")
-                if results['rto']: sb_log_report(f"RTO – {month_label}", "rto_data", results['rto'], month_label)
-            else:
-                results['rto'] = 0
-            prog.progress(56)
-
-            # 5. RT
-            status_box.info("Saving RT Report...")
-            if not rt_df.empty:
-                d = rt_df.copy(); d['month_label'] = month_label; d['saved_at'] = datetime.utcnow().isoformat()
-                results['rt'] = sb_save_df(d, "rt_data")
-                if results['rt']: sb_log_report(f"RT – {month_label}", "rt_data", results['rt'], month_label)
-            else:
-                results['rt'] = 0
-            prog.progress(70)
-
-            # 6. Output reconciliation report (Order Settlement Checker output)
-            status_box.info("Building & Saving Output Reconciliation Report...")
-            try:
-                # Rebuild the checker output to save it
-                sales_id_col = next((c for c in ['order_release_id','order_id'] if c in sales.columns), sales.columns[5])
-                sales_price_col = next((c for c in ['seller_price','Seller_Price'] if c in sales.columns),
-                    sales.columns[46] if len(sales.columns) > 46 else sales.columns[-1])
-                base_s = sales[[sales_id_col, sales_price_col] + [c for c in ['order_status','payment_method','article_type'] if c in sales.columns]].copy()
-                base_s[sales_id_col] = base_s[sales_id_col].astype(str).str.strip()
-                base_s[sales_price_col] = pd.to_numeric(base_s[sales_price_col], errors='coerce').fillna(0)
-                base_s = base_s.drop_duplicates(subset=[sales_id_col]).rename(columns={sales_id_col:'order_id', sales_price_col:'seller_price'})
-
-                # RTO/RT tags
-                rto_ids_s = set(rto_df['order_release_id'].astype(str)) if not rto_df.empty and 'order_release_id' in rto_df.columns else set()
-                rt_ids_s  = set(rt_df['order_release_id'].astype(str)) if not rt_df.empty and 'order_release_id' in rt_df.columns else set()
-                base_s['Order_Type'] = base_s['order_id'].apply(lambda x: 'Sale' + ('+RTO' if x in rto_ids_s else '') + ('+RT' if x in rt_ids_s else ''))
-                base_s['RTO_Value'] = base_s['order_id'].map(dict(zip(rto_df['order_release_id'].astype(str), safe_num(rto_df['rto_value']))) if not rto_df.empty and 'rto_value' in rto_df.columns else {}).fillna(0)
-                base_s['RT_Value']  = base_s['order_id'].map(dict(zip(rt_df['order_release_id'].astype(str), safe_num(rt_df['rt_value']))) if not rt_df.empty and 'rt_value' in rt_df.columns else {}).fillna(0)
-
-                # PGF
-                pgf_cols = [c for c in ['order_release_id','total_commission_plus_tcs_tds_deduction',
-                    'total_logistics_deduction','forwardAdditionalCharges_prepaid','forwardAdditionalCharges_postpaid',
-                    'total_actual_settlement','amount_pending_settlement'] if c in pg_fwd.columns]
-                pgf_s = pg_fwd[pgf_cols].copy()
-                pgf_s['order_release_id'] = pgf_s['order_release_id'].astype(str).str.strip()
-                pgf_s = pgf_s.groupby('order_release_id', as_index=False).sum(numeric_only=True)
-                pgf_s = pgf_s.add_prefix('pgf_').rename(columns={'pgf_order_release_id':'order_id'})
-
-                # PGR
-                pgr_cols = [c for c in ['order_release_id','total_commission_plus_tcs_tds_deduction',
-                    'total_logistics_deduction','reverseAdditionalCharges_prepaid','reverseAdditionalCharges_postpaid',
-                    'total_actual_settlement','amount_pending_settlement'] if c in pg_rev.columns]
-                pgr_s = pg_rev[pgr_cols].copy()
-                pgr_s['order_release_id'] = pgr_s['order_release_id'].astype(str).str.strip()
-                pgr_s = pgr_s.groupby('order_release_id', as_index=False).sum(numeric_only=True)
-                pgr_s = pgr_s.add_prefix('pgr_').rename(columns={'pgr_order_release_id':'order_id'})
-
-                out_df = base_s.merge(pgf_s, on='order_id', how='left').merge(pgr_s, on='order_id', how='left')
-                out_df[out_df.select_dtypes('number').columns] = out_df.select_dtypes('number').fillna(0)
-
-                out_df['FWD_Calculated'] = (out_df['seller_price']
-                    - safe_get(out_df,'pgf_total_commission_plus_tcs_tds_deduction').abs()
-                    - safe_get(out_df,'pgf_total_logistics_deduction').abs()
-                    - safe_get(out_df,'pgf_forwardAdditionalCharges_prepaid').abs()
-                    - safe_get(out_df,'pgf_forwardAdditionalCharges_postpaid').abs()).round(2)
-                out_df['FWD_Received']   = safe_get(out_df,'pgf_total_actual_settlement').round(2)
-                out_df['FWD_Pending']    = safe_get(out_df,'pgf_amount_pending_settlement').round(2)
-                out_df['FWD_Difference'] = (out_df['FWD_Calculated'] - out_df['FWD_Received']).round(2)
-                out_df['REV_Deducted']   = (safe_get(out_df,'pgr_total_commission_plus_tcs_tds_deduction').abs()
-                    - safe_get(out_df,'pgr_total_logistics_deduction').abs()
-                    + safe_get(out_df,'pgr_reverseAdditionalCharges_prepaid').abs()
-                    + safe_get(out_df,'pgr_reverseAdditionalCharges_postpaid').abs()).round(2)
-                out_df['REV_Pending']    = safe_get(out_df,'pgr_amount_pending_settlement').round(2)
-                out_df['Net_Amount']     = (out_df['FWD_Received'] - out_df['REV_Deducted']).round(2)
-
-                def pay_stat(row):
-                    if row['FWD_Received'] == 0 and row['FWD_Pending'] == 0: return 'Not Received'
-                    if row['FWD_Pending'] > 0 or row['REV_Pending'] > 0: return 'Pending'
-                    if abs(row['FWD_Difference']) <= 2: return 'Received'
-                    if row['FWD_Difference'] > 2: return 'Pending'
-                    return 'Received'
-                out_df['Payment_Status'] = out_df.apply(pay_stat, axis=1)
-                out_df['month_label'] = month_label
-                out_df['saved_at'] = datetime.utcnow().isoformat()
-
-                # Keep only useful output cols
-                keep = [c for c in ['order_id','Order_Type','Payment_Status','seller_price',
-                    'RTO_Value','RT_Value','FWD_Calculated','FWD_Received','FWD_Difference',
-                    'FWD_Pending','REV_Deducted','REV_Pending','Net_Amount',
-                    'order_status','payment_method','article_type','month_label','saved_at'] if c in out_df.columns]
-                save_out = out_df[keep]
-                results['output'] = sb_save_df(save_out, "output_reconciliation")
-                if results['output']: sb_log_report(f"Output Reconciliation – {month_label}", "output_reconciliation", results['output'], month_label)
-            except Exception as e:
-                st.warning(f"Output report save warning: {e}")
-                results['output'] = 0
-            prog.progress(100)
-
-        status_box.empty()
+    # Background save: all 6 tables are written concurrently on a thread pool,
+    # progress is polled below, and the other tabs stay usable meanwhile.
+    save_job = st.session_state.get("save_job")
+    job_running = save_job is not None and not save_job.done
+    replace_month = st.checkbox("♻️ Replace this month's stored rows", value=True, key="save_replace",
+        help="Delete rows saved earlier for this month that are not in the current files, so a "
+             "corrected re-save is not double-counted. Off: rows are only added or updated.")
+    if st.button("🚀 Save ALL 5 Files + Output Report", use_container_width=True, type="primary",
+                 key="save_all_5", disabled=job_running):
+        save_job = start_save_job(save_executor(), month_label, month_save_tasks(
+            month_label, pg_fwd, pg_rev, sales, rto_df, rt_df,
+            checker_result if SALES_COLS.get('seller_price') else None),
+            partial(sb_save_df, replace=replace_month), sb_log_report)
+        st.session_state["save_job"] = save_job
+
+    def show_save_job():
+        job = st.session_state.get("save_job")
+        if job is None:
+            return
+        snap = job.snapshot()
+        st.progress(job.progress())
+        st.caption(f"Save job `{job.id}` — {job.month_label} — started {job.started_at:%H:%M:%S} UTC")
+        st.dataframe(pd.DataFrame([
+            {'Table': n, 'State': t['state'], 'Rows': t['rows'], 'Saved': t['saved'],
+             'Unchanged': t['unchanged'], 'Error': t['error'] or ''}
+            for n, t in snap.items()]), use_container_width=True, hide_index=True)
+        if not job.done:
+            st.info("⏳ Saving in the background — you can keep using the other tabs.")
+            return
+        results = job.results()
         total = sum(results.values())
         if total > 0:
             st.success(f"""🎉 **All data saved successfully!**
@@ -1562,22 +1838,44 @@ with t_save:
             - Sales: {results['sales']:,} rows
             - RTO: {results['rto']:,} rows
             - RT: {results['rt']:,} rows
-            - Output Report: {results['output']:,} rows""")
+            - Output Report: {results['output']:,} rows
+            - Settlement Index: {results['index']:,} rows
+            - SKU & State Rankings: {results['ranks']:,} rows""")
         else:
             st.error("❌ Nothing saved. Make sure all tables exist in Supabase.")
             st.markdown("""
             Run this SQL in Supabase SQL Editor:
             ```sql
-            create table if not exists pg_forward_data (id bigserial primary key, order_release_id text, packet_id text, sku_code text, article_type text, seller_product_amount float, mrp float, total_commission float, total_logistics_deduction float, total_actual_settlement float, amount_pending_settlement float, prepaid_amount float, postpaid_amount float, total_commission_plus_tcs_tds_deduction float, tcs_amount float, tds_amount float, commission_percentage float, month_label text, saved_at text);
-            create table if not exists pg_reverse_data (id bigserial primary key, order_release_id text, packet_id text, sku_code text, article_type text, return_type text, return_date text, seller_product_amount float, total_actual_settlement float, amount_pending_settlement float, prepaid_amount float, postpaid_amount float, total_commission_plus_tcs_tds_deduction float, month_label text, saved_at text);
-            create table if not exists sales_data (id bigserial primary key, packet_id text, order_id text, article_type text, payment_method text, invoiceamount float, shipment_value float, mrp float, discount float, tax_amount float, order_status text, month_label text, saved_at text);
-            create table if not exists rto_data (id bigserial primary key, order_release_id text, rto_value float, month_label text, saved_at text);
-            create table if not exists rt_data (id bigserial primary key, order_release_id text, rt_value float, month_label text, saved_at text);
-            create table if not exists output_reconciliation (id bigserial primary key, order_id text, Order_Type text, Payment_Status text, seller_price float, RTO_Value float, RT_Value float, FWD_Calculated float, FWD_Received float, FWD_Difference float, FWD_Pending float, REV_Deducted float, REV_Pending float, Net_Amount float, order_status text, payment_method text, article_type text, month_label text, saved_at text);
+            create table if not exists pg_forward_data (id bigserial primary key, order_release_id text, packet_id text, sku_code text, article_type text, seller_product_amount float, mrp float, total_commission float, total_logistics_deduction float, total_actual_settlement float, amount_pending_settlement float, prepaid_amount float, postpaid_amount float, total_commission_plus_tcs_tds_deduction float, tcs_amount float, tds_amount float, taxable_amount float, commission_percentage float, month_label text, row_hash text, saved_at text, unique (month_label, row_hash));
+            create table if not exists pg_reverse_data (id bigserial primary key, order_release_id text, packet_id text, sku_code text, article_type text, return_type text, return_date text, seller_product_amount float, total_actual_settlement float, amount_pending_settlement float, prepaid_amount float, postpaid_amount float, total_commission_plus_tcs_tds_deduction float, month_label text, row_hash text, saved_at text, unique (month_label, row_hash));
+            create table if not exists sales_data (id bigserial primary key, packet_id text, order_id text, order_release_id text, article_type text, payment_method text, invoiceamount float, shipment_value float, mrp float, discount float, tax_amount float, tcs_amount float, tds_amount float, order_status text, month_label text, row_hash text, saved_at text, unique (month_label, row_hash));
+            create table if not exists rto_data (id bigserial primary key, order_release_id text, rto_value float, month_label text, row_hash text, saved_at text, unique (month_label, row_hash));
+            create table if not exists rt_data (id bigserial primary key, order_release_id text, rt_value float, month_label text, row_hash text, saved_at text, unique (month_label, row_hash));
+            create table if not exists output_reconciliation (id bigserial primary key, order_id text, Order_Type text, Payment_Status text, seller_price float, RTO_Value float, RT_Value float, FWD_Calculated float, FWD_Received float, FWD_Difference float, FWD_Pending float, REV_Deducted float, REV_Pending float, Net_Amount float, order_status text, payment_method text, article_type text, month_label text, row_hash text, saved_at text, unique (month_label, row_hash));
+            create table if not exists settlement_index (id bigserial primary key, order_id text, side text, month_label text, pg_rows int, total_commission_plus_tcs_tds_deduction float, total_logistics_deduction float, "forwardAdditionalCharges_prepaid" float, "forwardAdditionalCharges_postpaid" float, "reverseAdditionalCharges_prepaid" float, "reverseAdditionalCharges_postpaid" float, total_actual_settlement float, total_expected_settlement float, amount_pending_settlement float, row_hash text, saved_at text, unique (month_label, row_hash));
+            create index if not exists settlement_index_order_id on settlement_index (order_id);
+            create table if not exists rank_rollup (id bigserial primary key, dim text, key text, month_label text, orders float, revenue float, settlement float, returns float, return_deduction float, row_hash text, saved_at text, unique (month_label, row_hash));
             create table if not exists saved_reports (id bigserial primary key, report_name text, table_ref text, rows int, month_label text, saved_at text);
+            -- tables created before row hashes: add the column + key used by idempotent saves
+            alter table pg_forward_data add column if not exists row_hash text; create unique index if not exists pg_forward_data_month_hash on pg_forward_data (month_label, row_hash);
+            alter table pg_reverse_data add column if not exists row_hash text; create unique index if not exists pg_reverse_data_month_hash on pg_reverse_data (month_label, row_hash);
+            alter table sales_data add column if not exists row_hash text; create unique index if not exists sales_data_month_hash on sales_data (month_label, row_hash);
+            alter table rto_data add column if not exists row_hash text; create unique index if not exists rto_data_month_hash on rto_data (month_label, row_hash);
+            alter table rt_data add column if not exists row_hash text; create unique index if not exists rt_data_month_hash on rt_data (month_label, row_hash);
+            alter table output_reconciliation add column if not exists row_hash text; create unique index if not exists output_reconciliation_month_hash on output_reconciliation (month_label, row_hash);
+            alter table settlement_index add column if not exists row_hash text; create unique index if not exists settlement_index_month_hash on settlement_index (month_label, row_hash);
             ```
             """)
 
+
+    # Poll once a second while the job runs (fragment reruns only this block)
+    if hasattr(st, "fragment"):
+        st.fragment(run_every=1.0 if job_running or (save_job and not save_job.done) else None)(show_save_job)()
+    else:
+        if save_job is not None and not save_job.done:
+            st.button("🔄 Refresh save status", key="save_refresh")
+        show_save_job()
+
     st.markdown("---")
     st.markdown('<div class="section-title">📋 All Saved Reports</div>', unsafe_allow_html=True)
     rpts = sb_get_reports()
@@ -1602,7 +1900,9 @@ with t_history:
         st.error("⚠️ Supabase not connected.")
         st.stop()
 
-    # Load all historical data
+    # Load all historical data (cached for SB_CACHE_TTL s, refreshed on every save)
+    if st.button("🔄 Refresh from database", key="hist_refresh"):
+        READ_CACHE.invalidate()
     with st.spinner("Loading historical data from database..."):
         h_fwd    = sb_load_df("pg_forward_data")
         h_rev    = sb_load_df("pg_reverse_data")
@@ -1651,7 +1951,7 @@ with t_history:
             sel = st.selectbox(f"Filter {label} by month", months, key=f"{key_prefix}_month")
             view = df[df['month_label']==sel] if sel != 'All' else df
             st.caption(f"{len(view):,} rows | {len(view.columns)} columns")
-            st.dataframe(view, use_container_width=True, hide_index=True)
+            paged_table(view, key=f"{key_prefix}_tbl")
             c1, c2 = st.columns(2)
             with c1:
                 st.download_button(f"⬇️ Download Excel", data=to_excel(view),
@@ -1715,12 +2015,46 @@ with t_history:
                 if len(month_summary) > 1:
                     st.bar_chart(month_summary.set_index('month_label')['Net_Amount'])
 
+            # SKU / state rankings from the per-month rollups (no re-grouping of the history)
+            st.markdown('<div class="section-title">🏆 Top SKUs & States Across Months</div>', unsafe_allow_html=True)
+            ridx = rank_index()
+            rank_missing = [m for m in all_months if m not in ridx.months]
+            if rank_missing and st.button(f"Build rankings for {len(rank_missing)} month(s) saved earlier",
+                                          key="hist_rank_backfill"):
+                with st.spinner("Rolling up saved PG Forward + Reverse..."):
+                    for m in rank_missing:
+                        rows = rank_rows(sb_load_all("pg_forward_data", months=[m]),
+                                         sb_load_all("pg_reverse_data", months=[m]), m)
+                        ridx.add_month(m, rows)
+                        rows['row_hash'] = row_hashes(rows); rows['saved_at'] = datetime.utcnow().isoformat()
+                        saved = sb_save_df(rows, "rank_rollup")
+                        if saved:
+                            sb_log_report(f"SKU & State Rankings – {m}", "rank_rollup", saved, m)
+                rank_missing = [m for m in all_months if m not in ridx.months]
+            if rank_missing:
+                st.caption(f"Rankings cover {len(ridx.months)} month(s); not yet rolled up: {', '.join(rank_missing)}")
+            if len(ridx):
+                rk1, rk2, rk3, rk4 = st.columns(4)
+                rk_dim = rk1.selectbox("Rank", list(RANK_DIMS), format_func=RANK_DIMS.get, key="hist_rank_dim")
+                rk_by = rk2.selectbox("By", list(RANK_METRICS), key="hist_rank_by")
+                rk_k = rk3.slider("Top", 5, 50, 10, key="hist_rank_k")
+                rk_share = rk4.slider("Heavy hitter share %", 0.5, 10.0, 1.0, 0.5, key="hist_rank_share")
+                rk_labels = {'key': RANK_DIMS[rk_dim], **RANK_LABELS}
+                rk_metric = RANK_METRICS[rk_by]
+                st.dataframe(ridx.top(rk_dim, rk_metric, rk_k, sel_months or None).rename(columns=rk_labels),
+                             use_container_width=True, hide_index=True)
+                if rk_metric != 'return_rate':
+                    hh = ridx.heavy_hitters(rk_dim, rk_metric, rk_share / 100, sel_months or None)
+                    st.caption(f"Heavy hitters — {len(hh):,} {RANK_DIMS[rk_dim]}s each hold ≥ {rk_share:g}% "
+                               f"of {rk_by.lower()}, together {hh['share_pct'].sum():.1f}%")
+                    st.dataframe(hh.rename(columns=rk_labels), use_container_width=True, hide_index=True)
+
             # Full table with filters
             st.markdown('<div class="section-title">Full Historical Order Data</div>', unsafe_allow_html=True)
             pay_filter_h = st.multiselect("Filter by Payment Status",
                 ['Received','Pending','Not Received'], default=['Received','Pending','Not Received'], key="hist_pay_f")
             hist_disp = hist_view[hist_view['Payment_Status'].isin(pay_filter_h)] if 'Payment_Status' in hist_view.columns else hist_view
-            st.dataframe(hist_disp, use_container_width=True, hide_index=True)
+            paged_table(hist_disp, key="hist_tbl")
             st.caption(f"{len(hist_disp):,} rows")
 
             c1,c2 = st.columns(2)
@@ -1735,6 +2069,32 @@ with t_history:
                     file_name="historical_full_report.csv", mime="text/csv",
                     use_container_width=True, key="hist_dl_csv")
 
+            # TCS / TDS across the selected saved months — one batched pass
+            st.markdown('<div class="section-title">🧮 TCS / TDS Across Months</div>', unsafe_allow_html=True)
+            if st.button("Run TCS / TDS check on saved months", key="hist_tax_run"):
+                with st.spinner("Loading saved PG Forward + Sales..."):
+                    all_fwd   = sb_load_all("pg_forward_data", months=sel_months)
+                    all_sales = sb_load_all("sales_data", months=sel_months)
+                if all_fwd.empty or 'month_label' not in all_fwd.columns:
+                    st.info("No saved PG Forward data.")
+                else:
+                    if sel_months:
+                        all_fwd = all_fwd[all_fwd['month_label'].isin(sel_months)]
+                        if 'month_label' in all_sales.columns:
+                            all_sales = all_sales[all_sales['month_label'].isin(sel_months)]
+                    h_sid = 'order_release_id' if 'order_release_id' in all_sales.columns else 'order_id'
+                    st.session_state['hist_tax'] = statutory_check(
+                        all_fwd, all_sales, h_sid,
+                        st.session_state.get('tcs_pct', TCS_PCT), st.session_state.get('tds_pct', TDS_PCT),
+                        st.session_state.get('tax_tol', 1.0))
+            if 'hist_tax' in st.session_state:
+                hist_tax = st.session_state['hist_tax']
+                st.dataframe(statutory_totals(hist_tax), use_container_width=True, hide_index=True)
+                paged_table(hist_tax[hist_tax['Status'] == 'Mismatch'], key="hist_tax_tbl")
+                st.download_button("⬇️ Download TCS/TDS History (CSV)",
+                    data=hist_tax.to_csv(index=False).encode(),
+                    file_name="tcs_tds_history.csv", mime="text/csv", key="hist_tax_dl")
+
     # ─── New Month Reconciliation ───
     with h3:
         st.markdown('<div class="section-title">⚡ New Month — Upload Sales Sheet Only</div>', unsafe_allow_html=True)
@@ -1757,6 +2117,13 @@ with t_history:
                 rev_months_h = sorted(h_rev['month_label'].unique().tolist()) if 'month_label' in h_rev.columns else []
                 sel_rev_h = st.selectbox("Use PG Reverse from month:", ['All'] + rev_months_h, key="h_rev_sel")
 
+            sidx = settlement_index()
+            use_index_h = st.checkbox(
+                f"🔗 Match settlements across all saved months (index: {len(sidx.months)} months, {len(sidx):,} rows)",
+                value=len(sidx) > 0, disabled=len(sidx) == 0, key="h_xmonth",
+                help="Orders packed in one month are often settled in a later month's PG file. "
+                     "Overrides the PG month pickers above.")
+
             new_month_label = st.text_input("📅 Label for this new reconciliation", value=datetime.now().strftime("%B %Y"), key="new_month_lbl")
             new_sales_up = st.file_uploader("📤 Upload New Sales Sheet", type=["xlsx","csv","xls"], key="new_sales_up")
 
@@ -1773,10 +2140,13 @@ with t_history:
                     st.caption(f"Using → PG Fwd: {len(use_fwd_h):,} | PG Rev: {len(use_rev_h):,} | RTO: {len(use_rto_h):,} | RT: {len(use_rt_h):,} rows")
 
                     # Detect columns
-                    s_id = next((c for c in ['order_release_id','order_id'] if c in new_s.columns), new_s.columns[5] if len(new_s.columns)>5 else new_s.columns[0])
-                    s_price = next((c for c in ['seller_price','Seller_Price','invoiceamount'] if c in new_s.columns), new_s.columns[46] if len(new_s.columns)>46 else new_s.columns[-1])
+                    new_map, new_notes = resolve_columns('sales', new_s.columns)
+                    for n in new_notes: st.warning(f"⚠️ {n}")
+                    s_id = new_map.get('order_id', new_s.columns[0])
+                    s_price = next((c for c in ['seller_price','Seller_Price','invoiceamount'] if c in new_s.columns),
+                        new_map.get('seller_price', new_s.columns[-1]))
 
-                    base_n = new_s[[s_id, s_price] + [c for c in ['order_status','payment_method','article_type'] if c in new_s.columns]].copy()
+                    base_n = new_s[[s_id, s_price] + [c for c in ['order_status','payment_method','article_type'] if c in new_s.columns]]
                     base_n[s_id]    = base_n[s_id].astype(str).str.strip()
                     base_n[s_price] = pd.to_numeric(base_n[s_price], errors='coerce').fillna(0)
                     base_n = base_n.drop_duplicates(subset=[s_id]).rename(columns={s_id:'order_id', s_price:'seller_price'})
@@ -1791,30 +2161,37 @@ with t_history:
                     base_n['RTO_Value']  = base_n['order_id'].map(rto_val_n).fillna(0)
                     base_n['RT_Value']   = base_n['order_id'].map(rt_val_n).fillna(0)
 
-                    # PGF aggregate
-                    pgf_c = [c for c in ['order_release_id','total_commission_plus_tcs_tds_deduction',
-                        'total_logistics_deduction','forwardAdditionalCharges_prepaid','forwardAdditionalCharges_postpaid',
-                        'total_actual_settlement','amount_pending_settlement'] if c in use_fwd_h.columns]
-                    pgf_n = use_fwd_h[pgf_c].copy() if pgf_c else pd.DataFrame()
-                    if not pgf_n.empty:
-                        pgf_n['order_release_id'] = pgf_n['order_release_id'].astype(str).str.strip()
-                        pgf_n = pgf_n.groupby('order_release_id', as_index=False).sum(numeric_only=True)
-                        pgf_n = pgf_n.add_prefix('pgf_').rename(columns={'pgf_order_release_id':'order_id'})
-
-                    # PGR aggregate
-                    pgr_c = [c for c in ['order_release_id','total_commission_plus_tcs_tds_deduction',
-                        'total_logistics_deduction','reverseAdditionalCharges_prepaid','reverseAdditionalCharges_postpaid',
-                        'total_actual_settlement','amount_pending_settlement'] if c in use_rev_h.columns]
-                    pgr_n = use_rev_h[pgr_c].copy() if pgr_c else pd.DataFrame()
-                    if not pgr_n.empty:
-                        pgr_n['order_release_id'] = pgr_n['order_release_id'].astype(str).str.strip()
-                        pgr_n = pgr_n.groupby('order_release_id', as_index=False).sum(numeric_only=True)
-                        pgr_n = pgr_n.add_prefix('pgr_').rename(columns={'pgr_order_release_id':'order_id'})
-
-                    res_n = base_n.copy()
+                    if use_index_h:
+                        # One indexed lookup over every saved PG month (both sides)
+                        pgf_n = sidx.aggregates(base_n['order_id'], 'F', 'pgf_')
+                        pgr_n = sidx.aggregates(base_n['order_id'], 'R', 'pgr_')
+                    else:
+                        # PGF aggregate
+                        pgf_c = [c for c in ['order_release_id','total_commission_plus_tcs_tds_deduction',
+                            'total_logistics_deduction','forwardAdditionalCharges_prepaid','forwardAdditionalCharges_postpaid',
+                            'total_actual_settlement','amount_pending_settlement'] if c in use_fwd_h.columns]
+                        pgf_n = use_fwd_h[pgf_c] if pgf_c else pd.DataFrame()
+                        if not pgf_n.empty:
+                            pgf_n['order_release_id'] = pgf_n['order_release_id'].astype(str).str.strip()
+                            pgf_n = pgf_n.groupby('order_release_id', as_index=False).sum(numeric_only=True)
+                            pgf_n = pgf_n.add_prefix('pgf_').rename(columns={'pgf_order_release_id':'order_id'})
+
+                        # PGR aggregate
+                        pgr_c = [c for c in ['order_release_id','total_commission_plus_tcs_tds_deduction',
+                            'total_logistics_deduction','reverseAdditionalCharges_prepaid','reverseAdditionalCharges_postpaid',
+                            'total_actual_settlement','amount_pending_settlement'] if c in use_rev_h.columns]
+                        pgr_n = use_rev_h[pgr_c] if pgr_c else pd.DataFrame()
+                        if not pgr_n.empty:
+                            pgr_n['order_release_id'] = pgr_n['order_release_id'].astype(str).str.strip()
+                            pgr_n = pgr_n.groupby('order_release_id', as_index=False).sum(numeric_only=True)
+                            pgr_n = pgr_n.add_prefix('pgr_').rename(columns={'pgr_order_release_id':'order_id'})
+
+                    res_n = base_n.copy(deep=False)
                     if not pgf_n.empty: res_n = res_n.merge(pgf_n, on='order_id', how='left')
                     if not pgr_n.empty: res_n = res_n.merge(pgr_n, on='order_id', how='left')
                     res_n[res_n.select_dtypes('number').columns] = res_n.select_dtypes('number').fillna(0)
+                    if 'pgf_months' in res_n.columns:
+                        res_n['Settled_In'] = res_n['pgf_months'].fillna('')
 
                     res_n['FWD_Calculated'] = (res_n['seller_price']
                         - safe_get(res_n,'pgf_total_commission_plus_tcs_tds_deduction').abs()
@@ -1857,7 +2234,7 @@ with t_history:
                     if pnd_n > 0: st.markdown(f'<div style="background:#fffbeb;border-left:6px solid #f59e0b;padding:12px 16px;border-radius:6px;margin:10px 0"><b>🕐 {pnd_n} orders pending settlement.</b></div>', unsafe_allow_html=True)
 
                     # Table
-                    show_n = [c for c in ['order_id','Order_Type','Payment_Status','seller_price',
+                    show_n = [c for c in ['order_id','Order_Type','Payment_Status','Settled_In','seller_price',
                         'RTO_Value','RT_Value','FWD_Calculated','FWD_Received','FWD_Difference',
                         'FWD_Pending','REV_Deducted','REV_Pending','Net_Amount',
                         'order_status','payment_method','article_type'] if c in res_n.columns]
@@ -1882,10 +2259,12 @@ with t_history:
                             mime="text/csv", use_container_width=True, key="new_dl_csv")
                     with sa3:
                         if st.button("💾 Save This Result to DB", use_container_width=True, key="save_new_result"):
-                            save_new = res_n[show_n].copy()
+                            save_new = res_n[[c for c in show_n if c != 'Settled_In']]
                             save_new['month_label'] = new_month_label
+                            save_new['row_hash'] = row_hashes(save_new)
                             save_new['saved_at'] = datetime.utcnow().isoformat()
-                            nn = sb_save_df(save_new, "output_reconciliation")
+                            # Only part of the month's output columns — never replace the main save
+                            nn = sb_save_df(save_new, "output_reconciliation", replace=False)
                             if nn: 
                                 sb_log_report(f"Output Reconciliation – {new_month_label}", "output_reconciliation", nn, new_month_label)
                                 st.success(f"✅ Saved {nn:,} rows! Available in Historical Analysis tab.")
@@ -0,0 +1,1761 @@
+"""
+Core helpers for the Myntra reconciliation dashboard.
+Pure pandas/numpy — no Streamlit calls, so the same logic can be reused
+outside the dashboard script.
+"""
+import hashlib
+import io
+import threading
+import time
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import Future
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    ARROW_OK = True
+except ImportError:
+    pa = pa_csv = None
+    ARROW_OK = False
+
+# Copy-on-Write: selections and renames share buffers until one side is
+# written to, so tab code can project/filter without defensive .copy()
+# calls. Always on from pandas 3; opt in on pandas 2.
+if int(pd.__version__.split('.')[0]) < 3:
+    pd.set_option('mode.copy_on_write', True)
+
+# ─────────────────────────────────────────────
+# Numeric helpers + money columns
+# ─────────────────────────────────────────────
+MONEY_COLS_PG = [
+    'seller_product_amount','mrp','total_discount_amount','total_commission',
+    'total_logistics_deduction','total_expected_settlement','total_actual_settlement',
+    'amount_pending_settlement','prepaid_amount','postpaid_amount',
+    'tcs_amount','tds_amount','commission_percentage','platform_fees',
+    'shipping_fee','customer_paid_amt','taxable_amount',
+    'prepaid_payment','postpaid_payment',
+    'total_commission_plus_tcs_tds_deduction',
+    'forwardAdditionalCharges_prepaid',
+    'forwardAdditionalCharges_postpaid',
+    'reverseAdditionalCharges_prepaid',
+    'reverseAdditionalCharges_postpaid',
+    'total_commission_plus_tcs_tds_deduction'
+]
+MONEY_COLS_SALES = [
+    'invoiceamount','shipment_value','base_value','seller_price','mrp',
+    'discount','tax_amount','tcs_amount','tds_amount','net_amount'
+]
+# Identifier columns — always parsed as text on the Arrow path
+ID_COLS = [
+    'order_release_id','packet_id','order_id','invoice_number','sku_code','SKU',
+    'shipment_id','bank_utr_no_prepaid_payment','bank_utr_no_postpaid_payment',
+]
+
+def safe_num(series):
+    return pd.to_numeric(series, errors='coerce').fillna(0)
+
+def safe_get(df, col, default=0):
+    if col in df.columns: return pd.to_numeric(df[col], errors='coerce').fillna(0)
+    return pd.Series(default, index=df.index)
+
+# Fixed-point money: int64 paise. Rupee floats are rounded to paise once, on
+# the way in; sums and formulas are then exact and tolerances compare integers.
+PAISE = 100
+
+def to_paise(values):
+    """Rupee amounts (any numeric-ish input, NaN → 0) → int64 paise."""
+    num = pd.to_numeric(pd.Series(values), errors='coerce').fillna(0).to_numpy(dtype=float)
+    return np.rint(num * PAISE).astype(np.int64)
+
+def from_paise(paise):
+    """int64 paise → float rupees, for display and export only."""
+    return np.asarray(paise, dtype=np.int64) / PAISE
+
+def coerce_df(df, money_cols, nan_log=None):
+    """Money columns → numeric, blanks/garbage → 0 (as safe_num).
+
+    Pass a dict as `nan_log` to record, per column, the row positions that
+    were zeroed — the data-quality rules report them.
+    """
+    for c in money_cols:
+        if c in df.columns:
+            num = pd.to_numeric(df[c], errors='coerce')
+            if nan_log is not None:
+                bad = np.flatnonzero(num.isna().to_numpy())
+                if len(bad):
+                    nan_log[c] = bad
+            df[c] = num.fillna(0)
+    if 'packet_id' in df.columns and not pd.api.types.is_string_dtype(df['packet_id'].dtype):
+        df['packet_id'] = df['packet_id'].astype(str)
+    return df
+
+# ─────────────────────────────────────────────
+# Arrow-native CSV parsing (optional, needs pyarrow)
+# ─────────────────────────────────────────────
+def arrow_types_mapper(t):
+    """Arrow → pandas dtype: text as string[pyarrow], everything else ArrowDtype."""
+    if pa.types.is_string(t) or pa.types.is_large_string(t):
+        return pd.StringDtype('pyarrow')
+    return pd.ArrowDtype(t)
+
+def read_csv_arrow(file, money_cols=(), usecols=None):
+    """Multithreaded PyArrow CSV parse straight into Arrow-backed pandas dtypes.
+
+    Money columns are typed float64 and id columns text up front, so no
+    inference pass or object-dtype round trip is needed. `usecols` takes
+    column names or positions, like pandas.
+    """
+    file.seek(0)
+    data = file.read()
+    header = pd.read_csv(io.BytesIO(data), nrows=0).columns.tolist()
+    if usecols is not None:
+        usecols = [header[c] if isinstance(c, int) else c for c in usecols]
+    wanted = set(usecols) if usecols is not None else set(header)
+    id_types = {c: pa.string() for c in ID_COLS if c in wanted}
+    money_types = {c: pa.float64() for c in money_cols if c in wanted}
+
+    def parse(col_types):
+        return pa_csv.read_csv(
+            pa.BufferReader(data),
+            read_options=pa_csv.ReadOptions(use_threads=True),
+            convert_options=pa_csv.ConvertOptions(
+                column_types=col_types, include_columns=usecols,
+                strings_can_be_null=True),
+        )
+    try:
+        tbl = parse({**money_types, **id_types})
+    except pa.ArrowInvalid:
+        # Non-numeric junk in a money column — let coerce_df clean it up
+        tbl = parse(id_types)
+    return tbl.to_pandas(types_mapper=arrow_types_mapper)
+
+# ─────────────────────────────────────────────
+# Surrogate keys — one int64 code per normalized id
+# ─────────────────────────────────────────────
+# A blank id never gets a code: NaN, '' and the text pandas 2's astype(str)
+# leaves for a missing value all map to MISSING_KEY, on every pandas version,
+# so blank ids never match each other in joins, isin or groupbys.
+MISSING_KEY = -1
+_BLANK_IDS = ['', 'nan', 'NaN', 'None', '<NA>']
+
+def norm_ids(series):
+    """Stripped id strings, NaN where the id is blank or missing."""
+    s = series.astype(str).str.strip()
+    return s.mask(series.isna().to_numpy() | s.isin(_BLANK_IDS).to_numpy())
+
+class KeyDict:
+    """Dense int64 codes for order_release_id / packet_id strings.
+
+    Built once at load over all five reports, so joins, isin and groupbys
+    can run on integers; strings are restored with decode() for display.
+    Blank ids are coded MISSING_KEY and decode to None.
+    """
+    def __init__(self, uniques):
+        self.uniques = pd.Index(uniques)
+
+    @classmethod
+    def from_columns(cls, *series):
+        """Factorize all `series` together → (KeyDict, [codes per series])."""
+        vals = [norm_ids(s).to_numpy(dtype=object) for s in series]
+        codes, uniques = pd.factorize(np.concatenate(vals) if vals else np.array([], dtype=object))
+        splits = np.split(codes.astype(np.int64), np.cumsum([len(v) for v in vals])[:-1])
+        return cls(uniques), splits
+
+    def __len__(self):
+        return len(self.uniques)
+
+    def encode(self, series):
+        """Codes for `series` (MISSING_KEY where blank or never seen at load)."""
+        return self.uniques.get_indexer(norm_ids(series)).astype(np.int64)
+
+    def decode(self, codes):
+        codes = np.asarray(codes)
+        out = np.full(len(codes), None, dtype=object)
+        ok = codes != MISSING_KEY
+        out[ok] = self.uniques.to_numpy()[codes[ok].astype(np.int64)]
+        return out
+
+def attach_keys(pg_fwd, pg_rev, sales, rto_df, rt_df, sales_id_col):
+    """Add `_oid` (order) and `_pid` (packet) int64 codes to every report in place."""
+    oid_src = [(pg_fwd, 'order_release_id'), (pg_rev, 'order_release_id'),
+               (sales, sales_id_col), (rto_df, 'order_release_id'), (rt_df, 'order_release_id')]
+    pid_src = [(pg_fwd, 'packet_id'), (pg_rev, 'packet_id'), (sales, 'packet_id')]
+    oid_src = [(f, c) for f, c in oid_src if c in f.columns]
+    pid_src = [(f, c) for f, c in pid_src if c in f.columns]
+    keys, codes = KeyDict.from_columns(*[f[c] for f, c in oid_src + pid_src])
+    for (f, _), cd in zip(oid_src, codes[:len(oid_src)]):
+        f['_oid'] = cd
+    for (f, _), cd in zip(pid_src, codes[len(oid_src):]):
+        f['_pid'] = cd
+    return keys
+
+# ─────────────────────────────────────────────
+# Order Settlement Checker — one row per Sales order
+# ─────────────────────────────────────────────
+PAYMENT_TOLERANCE = 2   # Rs — FWD Difference within this counts as Received
+
+def payment_status(fwd_received, fwd_pending, rev_pending, fwd_diff, tolerance=PAYMENT_TOLERANCE):
+    """Received / Pending / Not Received, vectorized over aligned Series.
+
+    `tolerance` is in the same unit as the inputs (PAYMENT_TOLERANCE * PAISE
+    when they are paise).
+    """
+    return pd.Series(np.select(
+        [
+            (fwd_received == 0) & (fwd_pending == 0),           # no entry at all in PG Forward
+            (fwd_pending > 0) | (rev_pending > 0),              # any pending amount
+            fwd_diff.abs() <= tolerance,                        # matches formula
+            fwd_diff > tolerance,                               # shortfall — partial payment
+        ],
+        ['Not Received', 'Pending', 'Received', 'Pending'],
+        default='Received'), index=fwd_received.index)
+
+CHECKER_MONEY_COLS = ['seller_price', 'RTO Value (Rs)', 'RT Value (Rs)',
+                      'FWD Calculated (Rs)', 'FWD Received (Rs)', 'FWD Pending (Rs)',
+                      'FWD Difference (Rs)', 'REV Deducted (Rs)', 'REV Pending (Rs)',
+                      'Net Amount (Rs)']
+
+def build_checker(sales, pg_fwd, pg_rev, rto_df, rt_df, sales_id_col, sales_price_col, exact=False):
+    """Sales base left-joined with RTO/RT tags and PG Forward/Reverse aggregates.
+
+    Every frame must carry the `_oid` key codes from attach_keys(); all
+    joins, tags and groupbys run on those int64 codes. Returns the
+    order-level frame shown in the Order Settlement Checker tab
+    (FWD/REV formulas, Net Amount, Payment Status).
+
+    With `exact=True` every amount is taken to int64 paise once on the way
+    in; sums, formulas and the ₹2 tolerance are integer math, and the money
+    columns are converted back to rupees only at the end.
+    """
+    if exact:
+        num = lambda s: pd.Series(to_paise(s), index=s.index)
+        r2 = lambda s: s
+    else:
+        num = safe_num
+        r2 = lambda s: s.round(2)
+    # ═══════════════════════════════════════════
+    # STEP 1 — Build Sales base (master table)
+    # ═══════════════════════════════════════════
+    # Detect optional enrichment cols
+    sales_status_col = next((c for c in ['order_status','Order_Status'] if c in sales.columns), None)
+    extra_sales_cols = [c for c in ['payment_method','article_type','SKU','sku_code','invoiceamount'] if c in sales.columns]
+
+    # Build unique order base
+    base_cols = list(dict.fromkeys(
+        ['_oid', sales_id_col, sales_price_col]
+        + ([sales_status_col] if sales_status_col else [])
+        + extra_sales_cols
+    ))
+    base = sales[base_cols].drop_duplicates(subset=['_oid'])
+    base = base.rename(columns={
+        sales_id_col:    'order_id',
+        sales_price_col: 'seller_price'
+    })
+    base['order_id']     = base['order_id'].astype(str).str.strip()
+    base['seller_price'] = num(base['seller_price'])
+    if sales_status_col and sales_status_col in base.columns:
+        base = base.rename(columns={sales_status_col: 'order_status'})
+
+    # ═══════════════════════════════════════════
+    # STEP 2 — Tag Type: Sale / Sale+RTO / Sale+RT
+    # ═══════════════════════════════════════════
+    in_rto = base['_oid'].isin(rto_df['_oid']).to_numpy()
+    in_rt  = base['_oid'].isin(rt_df['_oid']).to_numpy()
+    base['Order Type'] = (np.char.add(np.char.add('Sale', np.where(in_rto, ' + RTO', '')),
+                                      np.where(in_rt, ' + RT', '')))
+
+    def value_map(src, col):
+        # last value wins for repeated ids, like dict(zip(ids, values))
+        if col not in src.columns:
+            return pd.Series(dtype=float)
+        return num(src.drop_duplicates('_oid', keep='last').set_index('_oid')[col])
+
+    money_dtype = np.int64 if exact else float
+    base['RTO Value (Rs)'] = base['_oid'].map(value_map(rto_df, 'rto_value')).fillna(0).astype(money_dtype)
+    base['RT Value (Rs)']  = base['_oid'].map(value_map(rt_df, 'rt_value')).fillna(0).astype(money_dtype)
+
+    # ═══════════════════════════════════════════
+    # STEP 3 — PG Forward lookup
+    # ═══════════════════════════════════════════
+    pgf_need = ['total_commission_plus_tcs_tds_deduction',
+                'total_logistics_deduction',
+                'forwardAdditionalCharges_prepaid',
+                'forwardAdditionalCharges_postpaid',
+                'total_actual_settlement',
+                'total_expected_settlement',
+                'amount_pending_settlement']
+    pgf_avail = [c for c in pgf_need if c in pg_fwd.columns]
+    pgf = pg_fwd[['_oid']].assign(**{c: num(pg_fwd[c]) for c in pgf_avail})
+    # Keep one row per order (aggregate if duplicates)
+    pgf = pgf.groupby('_oid', as_index=False).sum(numeric_only=True)
+
+    # ═══════════════════════════════════════════
+    # STEP 4 — PG Reverse lookup
+    # ═══════════════════════════════════════════
+    pgr_need = ['total_commission_plus_tcs_tds_deduction',
+                'total_logistics_deduction',
+                'reverseAdditionalCharges_prepaid',
+                'reverseAdditionalCharges_postpaid',
+                'total_actual_settlement',
+                'amount_pending_settlement']
+    pgr_avail = [c for c in pgr_need if c in pg_rev.columns]
+    pgr = pg_rev[['_oid']].assign(**{c: num(pg_rev[c]) for c in pgr_avail})
+    pgr = pgr.groupby('_oid', as_index=False).sum(numeric_only=True)
+
+    # Add prefix to avoid col name collisions
+    pgf = pgf.add_prefix('pgf_').rename(columns={'pgf__oid': '_oid'})
+    pgr = pgr.add_prefix('pgr_').rename(columns={'pgr__oid': '_oid'})
+
+    # ═══════════════════════════════════════════
+    # STEP 5 — LEFT JOIN everything onto Sales base (int64 keys)
+    # ═══════════════════════════════════════════
+    df = base.merge(pgf, on='_oid', how='left')
+    df = df.merge(pgr, on='_oid', how='left')
+
+    # Fill all numeric NaN → 0
+    num_cols = df.select_dtypes(include='number').columns
+    df[num_cols] = df[num_cols].fillna(0.0)
+    if exact:   # the left joins turned the paise columns into float — back to int64
+        pg_cols = [c for c in df.columns if c.startswith(('pgf_', 'pgr_'))]
+        df[pg_cols] = df[pg_cols].astype(np.int64)
+
+    # ═══════════════════════════════════════════
+    # STEP 6 — PG Forward formula
+    # ═══════════════════════════════════════════
+    pgf_comm     = safe_num(df.get('pgf_total_commission_plus_tcs_tds_deduction', 0)).abs()
+    pgf_logi     = safe_num(df.get('pgf_total_logistics_deduction', 0)).abs()
+    pgf_add_pre  = safe_num(df.get('pgf_forwardAdditionalCharges_prepaid', 0)).abs()
+    pgf_add_post = safe_num(df.get('pgf_forwardAdditionalCharges_postpaid', 0)).abs()
+
+    df['FWD Calculated (Rs)'] = r2(
+        df['seller_price'] - pgf_comm - pgf_logi - pgf_add_pre - pgf_add_post
+    )
+    df['FWD Received (Rs)']   = r2(safe_num(df.get('pgf_total_actual_settlement', 0)))
+    df['FWD Pending (Rs)']    = r2(safe_num(df.get('pgf_amount_pending_settlement', 0)))
+    df['FWD Difference (Rs)'] = r2(df['FWD Calculated (Rs)'] - df['FWD Received (Rs)'])
+
+    # ═══════════════════════════════════════════
+    # STEP 7 — PG Reverse formula
+    # ═══════════════════════════════════════════
+    pgr_comm     = safe_num(df.get('pgr_total_commission_plus_tcs_tds_deduction', 0)).abs()
+    pgr_logi     = safe_num(df.get('pgr_total_logistics_deduction', 0)).abs()
+    pgr_add_pre  = safe_num(df.get('pgr_reverseAdditionalCharges_prepaid', 0)).abs()
+    pgr_add_post = safe_num(df.get('pgr_reverseAdditionalCharges_postpaid', 0)).abs()
+
+    df['REV Deducted (Rs)']  = r2(pgr_comm - pgr_logi + pgr_add_pre + pgr_add_post)
+    df['REV Pending (Rs)']   = r2(safe_num(df.get('pgr_amount_pending_settlement', 0)))
+
+    # ═══════════════════════════════════════════
+    # STEP 8 — Net Amount
+    # ═══════════════════════════════════════════
+    df['Net Amount (Rs)'] = r2(df['FWD Received (Rs)'] - df['REV Deducted (Rs)'])
+
+    # ═══════════════════════════════════════════
+    # STEP 9 — Payment Status
+    # Received / Pending / Not Received
+    # ═══════════════════════════════════════════
+    df['Payment Status'] = payment_status(
+        df['FWD Received (Rs)'], df['FWD Pending (Rs)'],
+        df['REV Pending (Rs)'], df['FWD Difference (Rs)'],
+        PAYMENT_TOLERANCE * PAISE if exact else PAYMENT_TOLERANCE)
+    if exact:
+        pg_cols = [c for c in df.columns if c.startswith(('pgf_', 'pgr_'))]
+        for c in CHECKER_MONEY_COLS + pg_cols:
+            df[c] = from_paise(df[c])
+    return df
+
+def money_sum(values, exact=False):
+    """Total of a rupee column — summed as int64 paise when `exact`."""
+    return from_paise(to_paise(values).sum()).item() if exact else float(pd.Series(values).sum())
+
+def checker_summary(df, exact=False):
+    """Order Type × Payment Status totals of a build_checker frame."""
+    money = {'seller_price': 'Seller Price (Rs)', 'FWD Received (Rs)': 'FWD Received (Rs)',
+             'FWD Pending (Rs)': 'FWD Pending (Rs)', 'REV Deducted (Rs)': 'REV Deducted (Rs)',
+             'Net Amount (Rs)': 'Net Amount (Rs)', 'RTO Value (Rs)': 'RTO Value (Rs)',
+             'RT Value (Rs)': 'RT Value (Rs)'}
+    keys = ['Order Type', 'Payment Status']
+    src = df[keys + ['order_id'] + list(money)]
+    if exact:
+        src = src.assign(**{c: to_paise(src[c]) for c in money})
+    g = src.groupby(keys)
+    out = g[list(money)].sum()
+    out = out.apply(from_paise) if exact else out.round(2)
+    out.insert(0, 'Orders', g['order_id'].count())
+    return out.rename(columns=money).reset_index()
+
+# Checker output → saved `output_reconciliation` schema
+CHECKER_EXPORT_COLS = {
+    'order_id': 'order_id', 'Order Type': 'Order_Type', 'Payment Status': 'Payment_Status',
+    'seller_price': 'seller_price', 'RTO Value (Rs)': 'RTO_Value', 'RT Value (Rs)': 'RT_Value',
+    'FWD Calculated (Rs)': 'FWD_Calculated', 'FWD Received (Rs)': 'FWD_Received',
+    'FWD Difference (Rs)': 'FWD_Difference', 'FWD Pending (Rs)': 'FWD_Pending',
+    'REV Deducted (Rs)': 'REV_Deducted', 'REV Pending (Rs)': 'REV_Pending',
+    'Net Amount (Rs)': 'Net_Amount',
+    'order_status': 'order_status', 'payment_method': 'payment_method', 'article_type': 'article_type',
+}
+
+def checker_export(df):
+    """Checker frame in the column layout saved to output_reconciliation."""
+    out = df[[c for c in CHECKER_EXPORT_COLS if c in df.columns]].rename(columns=CHECKER_EXPORT_COLS)
+    out['Order_Type'] = out['Order_Type'].str.replace(' + ', '+', regex=False)
+    return out
+
+# ─────────────────────────────────────────────
+# Shared result handles — memoized per input hash
+# ─────────────────────────────────────────────
+RESULT_CACHE_SIZE = 8
+_RESULT_CACHE = OrderedDict()
+_RESULT_LOCK = threading.Lock()
+
+def content_key(*files):
+    """Hash of the uploaded files' bytes — identifies one input set.
+
+    Entries may be None, a file, or a list of files (multi-file uploaders).
+    """
+    h = hashlib.sha1()
+    for f in files:
+        if isinstance(f, (list, tuple)):
+            h.update(content_key(*f).encode() if f else b'\x00')
+        else:
+            h.update(b'\x00' if f is None else hashlib.sha1(f.getvalue()).digest())
+    return h.hexdigest()
+
+_IN_FLIGHT = {}
+
+def memo_result(name, key, build):
+    """Return the cached result `name` for input `key`, building it once.
+
+    Results are shared across reruns and between the tabs and background jobs
+    of the same upload, and must be treated as read-only by callers. A caller
+    that arrives while another thread is building the same result waits for
+    it instead of building it again.
+    """
+    k = (name, key)
+    with _RESULT_LOCK:
+        hit = _RESULT_CACHE.get(k)
+        if hit is not None:
+            _RESULT_CACHE.move_to_end(k)
+            return hit
+        pending = _IN_FLIGHT.get(k)
+        if pending is None:
+            pending = _IN_FLIGHT[k] = Future()
+            owner = True
+        else:
+            owner = False
+    if not owner:
+        return pending.result()
+    try:
+        res = build()
+    except BaseException as e:
+        with _RESULT_LOCK:
+            del _IN_FLIGHT[k]
+        pending.set_exception(e)
+        raise
+    with _RESULT_LOCK:
+        _RESULT_CACHE[k] = res
+        del _IN_FLIGHT[k]
+        while len(_RESULT_CACHE) > RESULT_CACHE_SIZE:
+            _RESULT_CACHE.popitem(last=False)
+    pending.set_result(res)
+    return res
+
+def memo_ready(name, key):
+    """True once memo_result(name, key, ...) would return without building."""
+    with _RESULT_LOCK:
+        return (name, key) in _RESULT_CACHE
+
+# ─────────────────────────────────────────────
+# Content hashes for idempotent saves
+# ─────────────────────────────────────────────
+HASH_EXCLUDE = ('id', 'saved_at', 'row_hash')
+
+def row_hashes(df, exclude=HASH_EXCLUDE):
+    """Deterministic 16-hex content hash per row (column order does not matter).
+
+    Identical rows get distinct hashes through their occurrence number, so a
+    genuine repeat is still stored twice — but re-saving stores nothing new.
+    """
+    cols = sorted(c for c in df.columns if c not in exclude)
+    h = pd.util.hash_pandas_object(df[cols].astype(str), index=False).to_numpy()
+    occ = pd.Series(h).groupby(h).cumcount().to_numpy()
+    h = pd.util.hash_pandas_object(pd.DataFrame({'h': h, 'occ': occ}), index=False).to_numpy()
+    return pd.Series(h, index=df.index).map('{:016x}'.format)
+
+def diff_hashes(df, stored):
+    """Split `df` against the stored (month_label, row_hash) pairs.
+
+    Returns (changed rows to upsert, number unchanged, stale stored pairs —
+    rows of those months that are no longer in `df`).
+    """
+    if stored is None or stored.empty:
+        return df, 0, pd.DataFrame(columns=['month_label', 'row_hash'])
+    new_key = pd.MultiIndex.from_arrays([df['month_label'].astype(str), df['row_hash']])
+    old_key = pd.MultiIndex.from_arrays([stored['month_label'].astype(str), stored['row_hash']])
+    unchanged = new_key.isin(old_key)
+    stale = stored[~old_key.isin(new_key)][['month_label', 'row_hash']]
+    return df[~unchanged], int(unchanged.sum()), stale
+
+# ─────────────────────────────────────────────
+# Database read cache — TTL, invalidated by writes
+# ─────────────────────────────────────────────
+class ReadCache:
+    """Query results keyed by (table, month filter, columns, variant).
+
+    Entries expire after `ttl` seconds; invalidate(table) drops every entry
+    of a table at once — call it after each write to that table. Thread-safe,
+    so background save jobs can invalidate while the UI reads.
+    """
+    def __init__(self, ttl=300, clock=time.monotonic):
+        self.ttl = ttl
+        self._clock = clock
+        self._data = {}
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    @staticmethod
+    def key(table, months=None, columns='*', variant=''):
+        months = tuple(sorted(months)) if months else None
+        return (table, months, columns, variant)
+
+    def get(self, key, load):
+        now = self._clock()
+        with self._lock:
+            hit = self._data.get(key)
+            if hit is not None and now - hit[0] < self.ttl:
+                self.hits += 1
+                return hit[1]
+            self.misses += 1
+        val = load()
+        with self._lock:
+            self._data[key] = (now, val)
+        return val
+
+    def invalidate(self, table=None):
+        with self._lock:
+            if table is None:
+                self._data.clear()
+            else:
+                for k in [k for k in self._data if k[0] == table]:
+                    del self._data[k]
+
+# ─────────────────────────────────────────────
+# Report schemas — header aliases + legacy column position
+# ─────────────────────────────────────────────
+# Each canonical field lists the header names Myntra has used for it, and the
+# 0-based column position the dashboard relied on before (used only as a
+# last-resort fallback, with a warning).
+REPORT_SCHEMAS = {
+    'rto': {
+        # Col E
+        'order_release_id': (['order_release_id', 'order_id', 'orderreleaseid', 'order_release_no'], 4),
+        # Col BM
+        'rto_value':        (['rto_value', 'rto_amount', 'rto_charges', 'rto_charge'], 64),
+    },
+    'rt': {
+        # Col F — shipment_id = order_id
+        'order_release_id': (['shipment_id', 'order_release_id', 'orderreleaseid', 'order_id'], 5),
+        # Col BC
+        'rt_value':         (['rt_value', 'rt_amount', 'return_value', 'return_amount'], 54),
+    },
+    'sales': {
+        # Col F
+        'order_id':         (['order_release_id', 'orderreleaseid', 'order_id'], 5),
+        # Col AU
+        'seller_price':     (['seller_price'], 46),
+    },
+}
+
+# Resolved layouts per header fingerprint. Written from parse worker threads,
+# so it is a bounded LRU under a lock, like the result cache.
+SCHEMA_CACHE_SIZE = 64
+_SCHEMA_CACHE = OrderedDict()
+_SCHEMA_LOCK = threading.Lock()
+
+
+def norm_header(name):
+    return str(name).strip().lower().replace(' ', '_').replace('-', '_')
+
+
+def header_fingerprint(kind, columns):
+    """Stable hash of a report's header row (names + order)."""
+    raw = kind + '\x1f' + '\x1f'.join(norm_header(c) for c in columns)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def resolve_columns(kind, columns):
+    """Map canonical fields of `kind` to actual header names.
+
+    Returns (mapping, notes). Alias matches win; a field with no alias match
+    falls back to its legacy position and adds a note. Fields that cannot be
+    resolved at all are left out of the mapping. Results are cached per
+    header fingerprint, so repeat uploads of the same layout skip detection.
+    """
+    columns = list(columns)
+    fp = header_fingerprint(kind, columns)
+    with _SCHEMA_LOCK:
+        hit = _SCHEMA_CACHE.get(fp)
+        if hit is not None:
+            _SCHEMA_CACHE.move_to_end(fp)
+            return dict(hit[0]), list(hit[1])
+
+    normed = {}
+    for c in columns:
+        normed.setdefault(norm_header(c), c)
+    mapping, notes = {}, []
+    for field, (aliases, pos) in REPORT_SCHEMAS[kind].items():
+        col = next((normed[a] for a in aliases if a in normed), None)
+        if col is None and pos < len(columns):
+            col = columns[pos]
+            notes.append(
+                f"{kind.upper()}: no '{field}' header found — using column #{pos + 1} "
+                f"('{col}') by position. Check the file layout.")
+        if col is not None:
+            mapping[field] = col
+
+    with _SCHEMA_LOCK:
+        _SCHEMA_CACHE[fp] = (dict(mapping), list(notes))
+        while len(_SCHEMA_CACHE) > SCHEMA_CACHE_SIZE:
+            _SCHEMA_CACHE.popitem(last=False)
+    return mapping, notes
+
+
+# Header names that identify each report when files arrive unlabelled (folder
+# ingestion). Checked in order — Reverse before Forward, RT before RTO; a
+# report matches when every group has at least one of its names.
+REPORT_SIGNATURES = [
+    ('pg_rev', [{'total_actual_settlement', 'total_expected_settlement'},
+                {'reverseadditionalcharges_prepaid', 'reverseadditionalcharges_postpaid', 'return_type'}]),
+    ('pg_fwd', [{'total_actual_settlement', 'total_expected_settlement'}]),
+    ('sales',  [set(REPORT_SCHEMAS['sales']['seller_price'][0]), {'order_status', 'invoiceamount', 'shipment_value'}]),
+    ('rt',     [{'shipment_id'} | set(REPORT_SCHEMAS['rt']['rt_value'][0])]),
+    ('rto',    [set(REPORT_SCHEMAS['rto']['rto_value'][0]) | set(REPORT_SCHEMAS['rto']['order_release_id'][0])]),
+]
+
+
+def classify_report(columns):
+    """Upload slot ('pg_fwd', 'sales', ...) a header row belongs to, or None."""
+    names = {norm_header(c) for c in columns}
+    return next((slot for slot, groups in REPORT_SIGNATURES if all(names & g for g in groups)), None)
+
+
+def usecols_for(columns, mapping):
+    """Positional usecols for the resolved fields (robust to duplicate headers)."""
+    columns = list(columns)
+    return sorted({columns.index(c) for c in mapping.values()})
+
+# ─────────────────────────────────────────────
+# Upload parsing — bytes in, frames out (safe to run in worker threads/processes)
+# ─────────────────────────────────────────────
+EXCEL_ENGINE_HELP = (
+    "❌ **Cannot read the Excel file** — neither `openpyxl` nor `xlrd` is installed "
+    "in this environment.\n\n"
+    "**Quick fix:** Open your Sales sheet in Excel, go to **File → Save As → CSV (.csv)**, "
+    "then re-upload the CSV version instead."
+)
+
+class ExcelEngineMissing(ImportError):
+    """No Excel reader installed — the message is EXCEL_ENGINE_HELP."""
+
+def read_table(name, data, money_cols=(), use_arrow=False, **kw):
+    """CSV/XLSX bytes → DataFrame. Try openpyxl first, then xlrd."""
+    if not name.lower().endswith(('.xlsx', '.xls')):
+        if use_arrow and ARROW_OK and 'nrows' not in kw:
+            return read_csv_arrow(io.BytesIO(data), money_cols, usecols=kw.get('usecols'))
+        return pd.read_csv(io.BytesIO(data), **kw)
+    if use_arrow:
+        kw['dtype_backend'] = 'pyarrow'
+    for engine in ('openpyxl', 'xlrd'):
+        try:
+            __import__(engine)
+        except ImportError:
+            continue
+        return pd.read_excel(io.BytesIO(data), engine=engine, **kw)
+    raise ExcelEngineMissing(EXCEL_ENGINE_HELP)
+
+def read_report(name, data, kind, keep_all=False, money_cols=(), use_arrow=False):
+    """Read a report with header-resolved columns (see REPORT_SCHEMAS).
+
+    For CSV only the header row is read first; unless `keep_all`, the full
+    parse then loads just the resolved columns. A workbook is opened and
+    parsed once (openpyxl always reads every cell, so a header pass would
+    decompress it twice) and the columns are resolved from its first row.
+    The kept columns are renamed to their canonical names.
+    Returns (df, mapping, notes).
+    """
+    if name.lower().endswith(('.xlsx', '.xls')):
+        df = read_table(name, data, money_cols, use_arrow)
+        header = df.columns.tolist()
+        mapping, notes = resolve_columns(kind, header)
+        if keep_all:
+            return df, mapping, notes
+        df = df.iloc[:, usecols_for(header, mapping)]
+        return df.rename(columns={v: k for k, v in mapping.items()}), mapping, notes
+    header = read_table(name, data, nrows=0).columns.tolist()
+    mapping, notes = resolve_columns(kind, header)
+    if keep_all:
+        return read_table(name, data, money_cols, use_arrow), mapping, notes
+    df = read_table(name, data, money_cols, use_arrow, usecols=usecols_for(header, mapping))
+    return df.rename(columns={v: k for k, v in mapping.items()}), mapping, notes
+
+READABLE_EXT = ('.csv', '.xlsx', '.xls')
+
+def upload_parts(files):
+    """Uploaded files (one, a list, or ZIP archives) → [(name, data, member)].
+
+    ZIP members are only listed here — `member` names the entry, and the
+    bytes are decompressed later by whichever worker parses it.
+    """
+    parts = []
+    for f in files if isinstance(files, (list, tuple)) else [files]:
+        if f is None:
+            continue
+        data = f.getvalue()
+        if f.name.lower().endswith('.zip'):
+            with zipfile.ZipFile(io.BytesIO(data)) as zf:
+                members = sorted(m for m in zf.namelist()
+                                 if m.lower().endswith(READABLE_EXT) and not m.startswith('__MACOSX/'))
+            if not members:
+                raise ValueError(f"{f.name}: no CSV/XLSX files inside the ZIP")
+            parts += [(f.name, data, m) for m in members]
+        else:
+            parts.append((f.name, data, None))
+    return parts
+
+def part_label(name, member):
+    return f"{name}/{member}" if member else name
+
+def part_bytes(data, member):
+    if member is None:
+        return data
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        return zf.read(member)
+
+# Columns that identify one settlement line — repeated across overlapping weekly files
+SETTLE_LINE_COLS = ['packet_id', 'order_release_id', 'total_expected_settlement',
+                    'total_actual_settlement', 'amount_pending_settlement',
+                    'prepaid_payment', 'postpaid_payment',
+                    'bank_utr_no_prepaid_payment', 'bank_utr_no_postpaid_payment']
+
+def dedup_settlement_lines(df, part_idx):
+    """Drop PG rows already seen in an earlier file (same settlement-line hash).
+
+    Repeats inside a single file are kept — only overlap between files is
+    removed. Returns a boolean keep-mask aligned with `df`.
+    """
+    cols = [c for c in SETTLE_LINE_COLS if c in df.columns]
+    cols += [c for c in df.columns if str(c).startswith('Settlement_on_')]
+    if not cols:
+        return np.ones(len(df), dtype=bool)
+    h = pd.util.hash_pandas_object(df[cols].astype(str), index=False).to_numpy()
+    first = pd.Series(part_idx).groupby(h).transform('min').to_numpy()
+    return part_idx == first
+
+def combine_parts(slot, parsed):
+    """Stack the parse_upload outputs of one report's files into one.
+
+    nan_rows positions are shifted to the stacked frame; PG reports are then
+    de-duplicated across files (see dedup_settlement_lines).
+    """
+    if len(parsed) == 1:
+        out = dict(parsed[0]); out['dropped'] = 0
+        return out
+    frames = [p['df'] for p in parsed]
+    df = pd.concat(frames, ignore_index=True)
+    part_idx = np.repeat(np.arange(len(frames)), [len(f) for f in frames])
+    offsets = np.cumsum([0] + [len(f) for f in frames[:-1]])
+    nan_mask = {}
+    for off, p in zip(offsets, parsed):
+        for col, pos in p['nan_rows'].items():
+            nan_mask.setdefault(col, np.zeros(len(df), dtype=bool))[pos + off] = True
+    keep = dedup_settlement_lines(df, part_idx) if slot in ('pg_fwd', 'pg_rev') else np.ones(len(df), dtype=bool)
+    if not keep.all():
+        df = df[keep].reset_index(drop=True)
+    nan_rows = {c: np.flatnonzero(m[keep]) for c, m in nan_mask.items() if m[keep].any()}
+    notes = list(dict.fromkeys(n for p in parsed for n in p['notes']))
+    return {'df': df, 'mapping': parsed[0]['mapping'], 'notes': notes, 'nan_rows': nan_rows,
+            'dropped': int((~keep).sum())}
+
+UPLOAD_SLOTS = {'pg_fwd': 'PG Forward', 'pg_rev': 'PG Reverse', 'sales': 'Sales',
+                'rto': 'RTO', 'rt': 'RT'}
+
+def parse_upload(slot, name, data, use_arrow=False):
+    """Parse + coerce one uploaded report. Returns {'df', 'mapping', 'notes', 'nan_rows'}."""
+    out = {'mapping': {}, 'notes': [], 'nan_rows': {}}
+    if slot in ('pg_fwd', 'pg_rev'):
+        out['df'] = coerce_df(read_table(name, data, MONEY_COLS_PG, use_arrow), MONEY_COLS_PG, out['nan_rows'])
+    elif slot == 'sales':
+        df, out['mapping'], out['notes'] = read_report(name, data, 'sales', keep_all=True,
+                                                       money_cols=MONEY_COLS_SALES, use_arrow=use_arrow)
+        out['df'] = coerce_df(df, MONEY_COLS_SALES, out['nan_rows'])
+    elif slot in ('rto', 'rt'):
+        # RTO: order id (legacy Col E), rto_value (legacy Col BM)
+        # RT:  order id via shipment_id (legacy Col F), rt_value (legacy Col BC)
+        df, out['mapping'], out['notes'] = read_report(name, data, slot, use_arrow=use_arrow)
+        if 'order_release_id' not in out['mapping']:
+            raise ValueError(f"{UPLOAD_SLOTS[slot]} report has no order id column")
+        value_col = f'{slot}_value'
+        if value_col in out['mapping']:
+            df[value_col] = safe_num(df[value_col])
+        df['order_release_id'] = df['order_release_id'].astype(str).str.strip()
+        out['df'] = df
+    else:
+        raise KeyError(slot)
+    return out
+
+EMPTY_REPORTS = {'rto': ['order_release_id', 'rto_value'], 'rt': ['order_release_id', 'rt_value']}
+
+def checker_frames(parsed):
+    """Combined parses {slot: combine_parts output} → (frames, sales_id, price_col).
+
+    Frames are shallow copies, so cached parses stay untouched; missing RTO/RT
+    reports become empty frames, and the join keys are attached.
+    """
+    frames = {slot: parsed[slot]['df'].copy(deep=False) if slot in parsed
+              else pd.DataFrame(columns=EMPTY_REPORTS[slot]) for slot in UPLOAD_SLOTS}
+    mapping = parsed['sales']['mapping']
+    sales_id = mapping.get('order_id', frames['sales'].columns[0])
+    attach_keys(frames['pg_fwd'], frames['pg_rev'], frames['sales'], frames['rto'], frames['rt'], sales_id)
+    return frames, sales_id, mapping.get('seller_price')
+
+# ─────────────────────────────────────────────
+# Server-side paging for large tables
+# ─────────────────────────────────────────────
+# Numeric columns that are identifiers or ratios, not amounts: never totalled
+_NON_TOTAL_TOKENS = {'id', 'ids', 'utr', 'no', 'number', 'pincode', 'pin', 'code',
+                     'pct', 'percent', 'percentage', 'rate', '%'}
+
+def total_columns(df):
+    """Numeric columns worth summing: amounts and counts, not ids, codes or rates."""
+    def is_total(c):
+        name = str(c)
+        tokens = ''.join(ch if ch.isalnum() or ch == '%' else ' ' for ch in name.lower()).split()
+        return not name.startswith('_') and not _NON_TOTAL_TOKENS.intersection(tokens)
+    return [c for c in df.select_dtypes(include='number').columns if is_total(c)]
+
+def filter_frame(df, column=None, text=''):
+    """Rows whose `column` (any column when None) contains `text`, case-insensitive."""
+    text = str(text).strip()
+    if not text or df.empty:
+        return df
+    cols = [column] if column in df.columns else [c for c in df.columns if not str(c).startswith('_')]
+    mask = np.zeros(len(df), dtype=bool)
+    for c in cols:
+        mask |= df[c].astype(str).str.contains(text, case=False, regex=False, na=False).to_numpy()
+    return df[mask]
+
+def page_frame(df, page=1, page_size=100, sort_by=None, ascending=True,
+               filter_col=None, filter_text='', total_cols=None):
+    """One page of `df`, filtered and sorted server-side. Returns (page_df, totals).
+
+    The filter (see filter_frame) applies before everything else. Only the row
+    order is computed over the filtered frame (a single column sort); the page
+    itself is a positional take, so the rest of the frame is never
+    materialized. `totals` holds the filtered row count and the sum of
+    `total_cols` (default: total_columns) over all filtered rows, not just
+    the page.
+    """
+    df = filter_frame(df, filter_col, filter_text)
+    n = len(df)
+    start = max(page - 1, 0) * page_size
+    if sort_by and sort_by in df.columns:
+        order = (df[sort_by].reset_index(drop=True)
+                 .sort_values(ascending=ascending, kind='stable', na_position='last')
+                 .index.to_numpy())
+        page_df = df.iloc[order[start:start + page_size]]
+    else:
+        page_df = df.iloc[start:start + page_size]
+    cols = total_columns(df) if total_cols is None else [c for c in total_cols if c in df.columns]
+    totals = {'rows': n, **df[cols].sum().round(2).to_dict()}
+    return page_df, totals
+
+# ─────────────────────────────────────────────
+# Cross-month settlement index
+# ─────────────────────────────────────────────
+# One row per (order, side, month) with the settlement columns summed, so a
+# sales order can be matched against every saved PG month in one lookup.
+SETTLE_INDEX_COLS = [
+    'total_commission_plus_tcs_tds_deduction', 'total_logistics_deduction',
+    'forwardAdditionalCharges_prepaid', 'forwardAdditionalCharges_postpaid',
+    'reverseAdditionalCharges_prepaid', 'reverseAdditionalCharges_postpaid',
+    'total_actual_settlement', 'total_expected_settlement', 'amount_pending_settlement',
+]
+
+def settlement_rows(pg, side, month_label):
+    """Per-order settlement aggregates of one PG frame ('F' forward / 'R' reverse)."""
+    cols = [c for c in SETTLE_INDEX_COLS if c in pg.columns]
+    if pg.empty or 'order_release_id' not in pg.columns:
+        return pd.DataFrame(columns=['order_id', 'side', 'month_label', 'pg_rows'] + cols)
+    d = pg[cols].apply(safe_num)
+    d['order_id'] = norm_ids(pg['order_release_id'])
+    g = d.groupby('order_id', sort=False)
+    out = g[cols].sum().join(g.size().rename('pg_rows')).reset_index()
+    out.insert(1, 'side', side)
+    out.insert(2, 'month_label', month_label)
+    return out
+
+class SettlementIndex:
+    """Sorted order-id index over every saved PG Forward/Reverse month.
+
+    lookup() is a pair of binary searches over the sorted ids, so matching
+    a month of sales orders never scans the history. add_month() replaces
+    one month's rows and keeps the index sorted.
+    """
+    def __init__(self, rows=None):
+        self._lock = threading.Lock()
+        self._set(rows if rows is not None else pd.DataFrame(columns=['order_id', 'side', 'month_label']))
+
+    def _set(self, rows):
+        rows = rows.assign(order_id=norm_ids(rows['order_id'])).dropna(subset=['order_id'])
+        rows = rows.sort_values('order_id', kind='stable').reset_index(drop=True)
+        # One tuple, swapped in a single assignment: readers never pair new
+        # keys with old rows while a save thread is replacing a month
+        self._state = (rows, rows['order_id'].to_numpy(dtype=str))
+
+    @property
+    def rows(self):
+        return self._state[0]
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def months(self):
+        return sorted(self.rows['month_label'].dropna().unique().tolist())
+
+    def add_month(self, month_label, rows):
+        with self._lock:
+            keep = self.rows[self.rows['month_label'] != month_label]
+            self._set(pd.concat([keep, rows], ignore_index=True))
+
+    def lookup(self, order_ids):
+        """All index rows for `order_ids` (any month, both sides)."""
+        q = np.unique(norm_ids(pd.Series(order_ids)).dropna().to_numpy(dtype=str))
+        rows, keys = self._state
+        lo = np.searchsorted(keys, q, side='left')
+        hi = np.searchsorted(keys, q, side='right')
+        n = hi - lo
+        if not n.sum():
+            return rows.iloc[0:0]
+        starts = np.repeat(lo, n)
+        offs = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+        return rows.iloc[starts + offs]
+
+    def aggregates(self, order_ids, side, prefix):
+        """Lookup + sum per order for one side, columns prefixed like the checker (pgf_/pgr_).
+
+        Adds `<prefix>months` listing the months the order was settled in.
+        """
+        hit = self.lookup(order_ids)
+        hit = hit[hit['side'] == side]
+        cols = [c for c in SETTLE_INDEX_COLS if c in hit.columns]
+        if hit.empty:
+            return pd.DataFrame(columns=['order_id'])
+        g = hit.groupby('order_id', sort=False)
+        out = g[cols].sum(min_count=1)
+        out['months'] = g['month_label'].agg(lambda m: ', '.join(sorted(set(m))))
+        return out.add_prefix(prefix).reset_index()
+
+# ─────────────────────────────────────────────
+# Top-K rankings — per-month rollups, partial sorts
+# ─────────────────────────────────────────────
+# Each saved month contributes one rollup row per (dimension, key). RankIndex
+# keeps running totals over every month, so saving a month only touches that
+# month's rows, and a ranking is a partial sort of the totals rather than a
+# groupby + full sort of the whole history.
+RANK_DIMS = {'sku_code': 'SKU', 'shipping_state': 'State'}
+RANK_SUMS = ['orders', 'revenue', 'settlement', 'returns', 'return_deduction']
+RANK_METRICS = {'Revenue': 'revenue', 'Orders': 'orders', 'Returns': 'returns', 'Return Rate %': 'return_rate'}
+RANK_LABELS = {'orders': 'Orders', 'revenue': 'Revenue', 'settlement': 'Settlement', 'returns': 'Returns',
+               'return_deduction': 'Return_Deduction', 'return_rate': 'Return_Rate_%', 'share_pct': 'Share_%'}
+
+def top_k(df, col, k=10, ascending=False):
+    """df.nlargest(k, col) (nsmallest with ascending=True) by partial sort.
+
+    np.partition finds the k-th value in O(n); only the k winners are sorted.
+    NaNs never rank and ties keep row order, as with keep='first'.
+    """
+    vals = pd.to_numeric(df[col], errors='coerce').to_numpy(dtype=float)
+    vals = vals if ascending else -vals
+    pos = np.flatnonzero(~np.isnan(vals))
+    if k <= 0 or not len(pos):
+        return df.iloc[0:0]
+    if len(pos) > k:
+        v = vals[pos]
+        kth = np.partition(v, k - 1)[k - 1]
+        win = pos[v < kth]
+        pos = np.concatenate([win, pos[v == kth][:k - len(win)]])
+    return df.iloc[pos[np.lexsort((pos, vals[pos]))]]
+
+def rank_rows(pg_fwd, pg_rev, month_label, dims=RANK_DIMS):
+    """One month's rollup: orders/returns and money sums per (dim, key)."""
+    frames = []
+    for dim in dims:
+        parts = []
+        for pg, cols in ((pg_fwd, {'orders': None, 'revenue': 'seller_product_amount',
+                                   'settlement': 'total_actual_settlement'}),
+                         (pg_rev, {'returns': None, 'return_deduction': 'total_actual_settlement'})):
+            if dim not in pg.columns or pg.empty:
+                continue
+            has_key = pg[dim].notna()
+            counted = pg['order_release_id'].notna() if 'order_release_id' in pg.columns else True
+            part = pd.DataFrame({out: (safe_get(pg, src) if src else counted * 1.0)
+                                 for out, src in cols.items()}, index=pg.index)
+            parts.append(part[has_key].assign(key=pg.loc[has_key, dim].astype(str)))
+        if not parts:
+            continue
+        g = pd.concat(parts, ignore_index=True).groupby('key', sort=False)
+        out = g.sum().reindex(columns=RANK_SUMS, fill_value=0.0).reset_index()
+        out.insert(0, 'dim', dim)
+        frames.append(out)
+    rows = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=['dim', 'key'] + RANK_SUMS)
+    rows.insert(2, 'month_label', month_label)
+    return rows
+
+class RankIndex:
+    """Running per-key totals of every saved month's rank rollup.
+
+    add_month() subtracts the month's previous rollup (if any) and adds the
+    new one, so the history is never re-grouped. top() and heavy_hitters()
+    partial-sort the totals; a subset of months is summed from the rollups.
+    """
+    def __init__(self, rows=None):
+        self._lock = threading.Lock()
+        self.rows = self._clean(rows if rows is not None else pd.DataFrame())
+        self._totals = {dim: g.groupby('key', sort=False)[RANK_SUMS].sum()
+                        for dim, g in self.rows.groupby('dim', sort=False)}
+
+    @staticmethod
+    def _clean(rows):
+        rows = rows.reindex(columns=['dim', 'key', 'month_label'] + RANK_SUMS)
+        return rows.assign(**{c: pd.to_numeric(rows[c], errors='coerce').fillna(0.0) for c in RANK_SUMS},
+                           key=rows['key'].astype(str))
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def months(self):
+        return sorted(self.rows['month_label'].dropna().unique().tolist())
+
+    def add_month(self, month_label, rows):
+        new = self._clean(rows).assign(month_label=month_label)
+        with self._lock:
+            old = self.rows[self.rows['month_label'] == month_label]
+            totals = dict(self._totals)
+            for dim in set(old['dim']) | set(new['dim']):
+                t = totals.get(dim, pd.DataFrame(columns=RANK_SUMS, dtype=float))
+                t = t.sub(old.loc[old['dim'] == dim].set_index('key')[RANK_SUMS], fill_value=0) \
+                     .add(new.loc[new['dim'] == dim].set_index('key')[RANK_SUMS], fill_value=0)
+                totals[dim] = t[(t['orders'] != 0) | (t['returns'] != 0)]
+            self.rows = pd.concat([self.rows[self.rows['month_label'] != month_label], new], ignore_index=True)
+            self._totals = totals
+
+    def totals(self, dim, months=None):
+        """Per-key sums + return rate over `months` (default: every month)."""
+        if months is None or set(months) >= set(self.months):
+            t = self._totals.get(dim)
+        else:
+            rows = self.rows
+            t = rows[(rows['dim'] == dim) & rows['month_label'].isin(list(months))] \
+                .groupby('key', sort=False)[RANK_SUMS].sum()
+        if t is None or t.empty:
+            return pd.DataFrame(columns=['key'] + RANK_SUMS + ['return_rate'])
+        t = t.round(2).rename_axis('key').reset_index()
+        t['return_rate'] = (t['returns'] / t['orders'].where(t['orders'] > 0) * 100).round(1)
+        return t
+
+    def top(self, dim, metric='revenue', k=10, months=None, min_orders=3):
+        """The k keys with the largest `metric`; return rate needs `min_orders`."""
+        t = self.totals(dim, months)
+        if metric == 'return_rate':
+            t = t[t['orders'] >= min_orders]
+        return top_k(t, metric, k)
+
+    def heavy_hitters(self, dim, metric='revenue', share=0.01, months=None):
+        """Keys holding at least `share` of the metric's total, largest first."""
+        t = self.totals(dim, months)
+        total = t[metric].sum() if len(t) else 0
+        if not total:
+            return t.iloc[0:0].assign(share_pct=[])
+        hit = t[t[metric] >= share * total]
+        hit = hit.assign(share_pct=(hit[metric] / total * 100).round(2))
+        return top_k(hit, metric, len(hit))
+
+# ─────────────────────────────────────────────
+# Guarded joins — duplicate keys + output size budget
+# ─────────────────────────────────────────────
+DUP_STRATEGIES = {
+    'keep':  'Keep all rows (many-to-many join)',
+    'sum':   'Sum amounts per key (first value for text and % / rate columns)',
+    'first': 'Keep first row per key',
+    'last':  'Keep last row per key',
+}
+_NON_ADDITIVE = ('pct', 'percent', 'rate')   # column-name parts never summed
+
+class JoinTooLarge(ValueError):
+    """Estimated join output is over the memory budget."""
+
+def estimate_outer_join(left_keys, right_keys):
+    """Exact row count of an outer join on int keys, without joining.
+
+    Negative keys (MISSING_KEY) match nothing, so each is one output row.
+    """
+    lk, rk = np.asarray(left_keys, dtype=np.int64), np.asarray(right_keys, dtype=np.int64)
+    missing = int((lk < 0).sum() + (rk < 0).sum())
+    lk, rk = lk[lk >= 0], rk[rk >= 0]
+    size = int(max(lk.max(initial=-1), rk.max(initial=-1))) + 1
+    lc = np.bincount(lk, minlength=size)
+    rc = np.bincount(rk, minlength=size)
+    both = (lc > 0) & (rc > 0)
+    return int((lc[both] * rc[both]).sum() + lc[~both].sum() + rc[~both].sum()) + missing
+
+def collapse_duplicates(df, key, strategy='keep'):
+    """One row per `key` using `strategy` (see DUP_STRATEGIES).
+
+    Returns (collapsed, dups) where `dups` holds every original row whose key
+    repeats. Only the duplicate subset is grouped; unique rows pass through.
+    """
+    dup_mask = df[key].duplicated(keep=False)
+    dups = df[dup_mask]
+    if strategy == 'keep' or dups.empty:
+        return df, dups
+    if strategy in ('first', 'last'):
+        return df.drop_duplicates(subset=[key], keep=strategy), dups
+    num = [c for c in dups.select_dtypes(include='number').columns
+           if c != key and not any(part in c.lower() for part in _NON_ADDITIVE)]
+    txt = [c for c in dups.columns if c not in num and c != key]
+    g = dups.groupby(key, sort=False)
+    agg = pd.concat([g[txt].first(), g[num].sum()], axis=1).reset_index()[list(df.columns)]
+    return pd.concat([df[~dup_mask], agg], ignore_index=True), dups
+
+def guarded_outer_merge(left, right, key, strategy='keep', budget_mb=512, labels=('left', 'right')):
+    """Outer merge on int `key` with duplicate handling and a size fast-fail.
+
+    Returns (merged, dup_report). Raises JoinTooLarge before joining when the
+    estimated output (rows × bytes per row of both sides) exceeds budget_mb.
+    Rows with a blank key (MISSING_KEY) are kept unmatched, as left_only /
+    right_only, and are not reported as duplicates.
+    """
+    lmiss, rmiss = left[key].to_numpy() < 0, right[key].to_numpy() < 0
+    left_blank, right_blank = left[lmiss], right[rmiss]
+    left, right = left[~lmiss], right[~rmiss]
+    left, ldup = collapse_duplicates(left, key, strategy)
+    right, rdup = collapse_duplicates(right, key, strategy)
+    dup_report = pd.concat([ldup.assign(_side=labels[0]), rdup.assign(_side=labels[1])], ignore_index=True)
+
+    est_rows = estimate_outer_join(left[key], right[key]) + len(left_blank) + len(right_blank)
+    row_bytes = (left.memory_usage(index=False).sum() / max(len(left), 1)
+                 + right.memory_usage(index=False).sum() / max(len(right), 1))
+    est_mb = est_rows * row_bytes / 1e6
+    if est_mb > budget_mb:
+        err = JoinTooLarge(
+            f"Join would produce ~{est_rows:,} rows (~{est_mb:,.0f} MB), over the {budget_mb:,} MB budget. "
+            f"{dup_report[key].nunique():,} keys are duplicated — pick a pre-aggregation strategy.")
+        err.dup_report = dup_report
+        raise err
+    merged = left.merge(right, on=key, how='outer', indicator=True)
+    if len(left_blank) or len(right_blank):
+        merge_cats = merged['_merge'].cat.categories
+        merged = pd.concat([merged, left_blank.assign(_merge='left_only'),
+                            right_blank.assign(_merge='right_only')], ignore_index=True)
+        merged['_merge'] = pd.Categorical(merged['_merge'], categories=merge_cats)
+    return merged, dup_report
+
+# ─────────────────────────────────────────────
+# Rate-card validation of commission + logistics
+# ─────────────────────────────────────────────
+# Rate card CSV: one row per (article_type, zone, price slab). `side` (F/R) is
+# optional — without it a slab applies to both PG Forward and PG Reverse.
+RATE_CARD_COLS = ['article_type', 'shipment_zone_classification', 'price_min', 'price_max',
+                  'commission_pct', 'logistics_fee']
+_PRICE_BITS = 40   # price in paise packed under the group code in one int64 key
+
+def load_rate_card(card):
+    """Validate + normalize a rate card frame. Raises ValueError on bad layout."""
+    card = card.rename(columns={c: norm_header(c) for c in card.columns})
+    missing = [c for c in RATE_CARD_COLS if c not in card.columns]
+    if missing:
+        raise ValueError(f"Rate card is missing columns: {', '.join(missing)}")
+    if 'side' not in card.columns:
+        card = pd.concat([card.assign(side='F'), card.assign(side='R')], ignore_index=True)
+    card = card[['side'] + RATE_CARD_COLS]
+    card['side'] = card['side'].astype(str).str.strip().str.upper().str[0]
+    for c in ['article_type', 'shipment_zone_classification']:
+        card[c] = card[c].astype(str).str.strip().str.lower()
+    for c in ['price_min', 'price_max', 'commission_pct', 'logistics_fee']:
+        card[c] = safe_num(card[c])
+    return card
+
+def _norm_codes(values, index):
+    """index.get_indexer over stripped/lowercased values, normalizing uniques only."""
+    codes, uniq = pd.factorize(pd.Series(values), use_na_sentinel=True)
+    lut = index.get_indexer(pd.Index(uniq).astype(str).str.strip().str.lower())
+    return np.where(codes < 0, -1, lut[np.maximum(codes, 0)] if len(lut) else -1)
+
+def _rate_groups(card, side, art, zone):
+    """Shared int group codes for (side, article_type, zone) of card rows and PG rows."""
+    arts  = pd.Index(card['article_type'].unique())
+    zones = pd.Index(card['shipment_zone_classification'].unique())
+    sides = pd.Index(['f', 'r'])
+
+    def codes(s, a, z):
+        si, ai, zi = _norm_codes(s, sides), _norm_codes(a, arts), _norm_codes(z, zones)
+        g = (si * len(arts) + ai) * len(zones) + zi
+        return np.where((si < 0) | (ai < 0) | (zi < 0), -1, g).astype(np.int64)
+
+    return (codes(card['side'], card['article_type'], card['shipment_zone_classification']),
+            codes(side, art, zone))
+
+def validate_charges(pg, card, side, tolerance=1.0):
+    """Expected vs charged commission/logistics for every row of one PG frame.
+
+    Slab lookup is a single searchsorted over (group, price_min) keys packed
+    into int64 — no per-row Python. Returns the per-row frame with
+    `slab_found`, expected/actual charges and `overcharge` (positive = charged
+    more than the card allows, beyond `tolerance`).
+    """
+    n = len(pg)
+    price = safe_get(pg, 'seller_product_amount').to_numpy(dtype=float)
+    art  = pg['article_type'] if 'article_type' in pg else pd.Series([''] * n)
+    zone = pg['shipment_zone_classification'] if 'shipment_zone_classification' in pg else pd.Series([''] * n)
+    card_g, row_g = _rate_groups(card, np.full(n, side), art.to_numpy(), zone.to_numpy())
+
+    # Prices are packed as non-negative paise below _PRICE_BITS. Reverse /
+    # adjustment rows carry negative amounts: their slab is that of |price|
+    price_max = (1 << _PRICE_BITS) - 1
+    card_min = np.clip(np.round(card['price_min'].to_numpy(dtype=float) * 100), 0, price_max).astype(np.int64)
+    card_key = (card_g << _PRICE_BITS) | card_min
+    order = np.argsort(card_key, kind='stable')
+    card_key, card_g = card_key[order], card_g[order]
+    pmax  = card['price_max'].to_numpy()[order]
+    pct   = card['commission_pct'].to_numpy()[order]
+    lfee  = card['logistics_fee'].to_numpy()[order]
+
+    abs_price = np.abs(price)
+    row_paise = np.round(abs_price * 100)
+    packable = np.isfinite(row_paise) & (row_paise <= price_max)
+    row_key = (np.maximum(row_g, 0) << _PRICE_BITS) | np.where(packable, row_paise, 0).astype(np.int64)
+    pos = np.searchsorted(card_key, row_key, side='right') - 1
+    safe_pos = np.clip(pos, 0, max(len(card_key) - 1, 0))
+    found = ((row_g >= 0) & packable & (pos >= 0) & (card_g[safe_pos] == row_g) & (abs_price <= pmax[safe_pos])
+             if len(card_key) else np.zeros(n, dtype=bool))
+
+    exp_comm = np.where(found, abs_price * pct[safe_pos] / 100, np.nan) if len(card_key) else np.full(n, np.nan)
+    exp_logi = np.where(found, lfee[safe_pos], np.nan) if len(card_key) else np.full(n, np.nan)
+    act_comm = safe_get(pg, 'total_commission').abs().to_numpy()
+    act_logi = safe_get(pg, 'total_logistics_deduction').abs().to_numpy()
+    comm_over = np.where(found, act_comm - exp_comm, 0.0)
+    logi_over = np.where(found, act_logi - exp_logi, 0.0)
+    over = np.where(comm_over > tolerance, comm_over, 0.0) + np.where(logi_over > tolerance, logi_over, 0.0)
+
+    out = pd.DataFrame({
+        'order_release_id': pg['order_release_id'].to_numpy() if 'order_release_id' in pg else np.arange(n),
+        'article_type': pg['article_type'].to_numpy() if 'article_type' in pg else '',
+        'zone': zone.to_numpy(),
+        'seller_product_amount': price,
+        'slab_found': found,
+        'expected_commission': np.round(exp_comm, 2),
+        'charged_commission': np.round(act_comm, 2),
+        'expected_logistics': np.round(exp_logi, 2),
+        'charged_logistics': np.round(act_logi, 2),
+        'commission_diff': np.round(comm_over, 2),
+        'logistics_diff': np.round(logi_over, 2),
+        'overcharge': np.round(over, 2),
+    })
+    out.insert(0, 'side', side)
+    return out
+
+def rate_card_summary(checked):
+    """Per article type: rows, rows without a slab, overcharged rows and amounts."""
+    return checked.groupby('article_type', dropna=False).agg(
+        Rows=('side', 'size'),
+        No_Slab=('slab_found', lambda s: int((~s).sum())),
+        Overcharged=('overcharge', lambda s: int((s > 0).sum())),
+        Expected_Commission=('expected_commission', 'sum'),
+        Charged_Commission=('charged_commission', 'sum'),
+        Expected_Logistics=('expected_logistics', 'sum'),
+        Charged_Logistics=('charged_logistics', 'sum'),
+        Overcharge=('overcharge', 'sum'),
+    ).reset_index().round(2).sort_values('Overcharge', ascending=False)
+
+# ─────────────────────────────────────────────
+# Statutory deductions — expected TCS / TDS
+# ─────────────────────────────────────────────
+TCS_PCT = 0.5   # GST TCS (sec 52), % of taxable value
+TDS_PCT = 0.1   # Income-tax TDS (sec 194-O), % of gross amount
+
+def statutory_check(pg, sales=None, sales_id_col='order_id', tcs_pct=TCS_PCT, tds_pct=TDS_PCT,
+                    tolerance=1.0):
+    """Recompute TCS/TDS per order and compare with PG and Sales.
+
+    Base is `taxable_amount` where present (>0), else `seller_product_amount`.
+    The Sales `tax_amount` (GST) is compared with the GST implied by PG,
+    seller_product_amount − taxable_amount, on orders that carry a taxable
+    amount.
+    Works on one month or on stacked saved months (grouped by `month_label`
+    when the column exists), in a single groupby pass either way.
+    """
+    keys = ['month_label', 'order_release_id'] if 'month_label' in pg.columns else ['order_release_id']
+    taxable = safe_get(pg, 'taxable_amount')
+    gross = safe_get(pg, 'seller_product_amount')
+    base = taxable.where(taxable > 0, gross)
+    rows = pd.DataFrame({
+        **{k: pg[k].astype(str) for k in keys},
+        'base': base,
+        'exp_tax': (gross - taxable).where(taxable > 0, 0),
+        '_has_taxable': (taxable > 0).astype(int),
+        'commission': safe_get(pg, 'total_commission').abs(),
+        'pg_tcs': safe_get(pg, 'tcs_amount').abs(),
+        'pg_tds': safe_get(pg, 'tds_amount').abs(),
+        'pg_deduction': safe_get(pg, 'total_commission_plus_tcs_tds_deduction').abs(),
+    })
+    out = rows.groupby(keys, sort=False).sum().reset_index()
+    out['exp_tcs'] = out['base'] * tcs_pct / 100
+    out['exp_tds'] = out['base'] * tds_pct / 100
+    out['exp_deduction'] = out['commission'] + out['exp_tcs'] + out['exp_tds']
+    out['tcs_var'] = out['pg_tcs'] - out['exp_tcs']
+    out['tds_var'] = out['pg_tds'] - out['exp_tds']
+    out['deduction_var'] = out['pg_deduction'] - out['exp_deduction']
+
+    if sales is not None and not sales.empty and sales_id_col in sales.columns:
+        s_keys = [k for k in keys if k != 'order_release_id' and k in sales.columns]
+        s = pd.DataFrame({
+            **{k: sales[k].astype(str) for k in s_keys},
+            'order_release_id': sales[sales_id_col].astype(str),
+            'sales_tax': safe_get(sales, 'tax_amount'),
+            'sales_tcs': safe_get(sales, 'tcs_amount').abs(),
+            'sales_tds': safe_get(sales, 'tds_amount').abs(),
+        }).groupby(s_keys + ['order_release_id'], sort=False).sum().reset_index()
+        # orders without a Sales row keep NaN here and are not flagged on the Sales side
+        out = out.merge(s, on=s_keys + ['order_release_id'], how='left')
+        out['sales_tcs_var'] = out['sales_tcs'] - out['exp_tcs']
+        out['sales_tds_var'] = out['sales_tds'] - out['exp_tds']
+        out['sales_tax_var'] = (out['sales_tax'] - out['exp_tax']).where(out['_has_taxable'] > 0)
+        var_cols = ['tcs_var', 'tds_var', 'deduction_var', 'sales_tcs_var', 'sales_tds_var', 'sales_tax_var']
+    else:
+        var_cols = ['tcs_var', 'tds_var', 'deduction_var']
+    out = out.drop(columns='_has_taxable')
+
+    num = out.columns.difference(keys)
+    out[num] = out[num].round(2)
+    out['Status'] = np.where((out[var_cols].abs() > tolerance).any(axis=1), 'Mismatch', 'OK')
+    return out
+
+def statutory_totals(checked):
+    """Monthly (or single-month) totals of a statutory_check result."""
+    by = 'month_label' if 'month_label' in checked.columns else None
+    num = [c for c in checked.columns if c not in ('month_label', 'order_release_id', 'Status')]
+    g = checked.assign(Mismatches=checked['Status'].eq('Mismatch').astype(int))
+    if by is None:
+        return g[num + ['Mismatches']].sum().to_frame().T.assign(Orders=len(g)).round(2)
+    return g.groupby(by).agg(Orders=('order_release_id', 'size'), Mismatches=('Mismatches', 'sum'),
+                             **{c: (c, 'sum') for c in num}).reset_index().round(2)
+
+# ─────────────────────────────────────────────
+# Exchange / re-shipment chains (union-find)
+# ─────────────────────────────────────────────
+# Explicit order→order links, used when the PG export carries them.
+EXCHANGE_LINK_COLS = ('exchange_order_release_id', 'original_order_release_id',
+                      'parent_order_release_id', 'new_order_release_id')
+
+def union_find(n, a, b):
+    """Component label (smallest node id) for nodes 0..n-1 joined by edges a[i]–b[i].
+
+    Array version: hook each edge's roots onto the smaller one with
+    np.minimum.at, then pointer-jump to the roots; repeat until stable.
+    Every round is O(n + edges) and the number of rounds is logarithmic in
+    practice.
+    """
+    label = np.arange(n, dtype=np.int64)
+    a = np.asarray(a, dtype=np.int64)
+    b = np.asarray(b, dtype=np.int64)
+    if not len(a):
+        return label
+    while True:
+        la, lb = label[a], label[b]
+        m = np.minimum(la, lb)
+        new = label.copy()
+        np.minimum.at(new, la, m)
+        np.minimum.at(new, lb, m)
+        while True:
+            jumped = new[new]
+            if np.array_equal(jumped, new):
+                break
+            new = jumped
+        if np.array_equal(new, label):
+            return label
+        label = new
+
+def chain_ids(keys, pg_fwd, pg_rev, sales, sales_group_col=None):
+    """Chain label per key code (see attach_keys) — orders linked by packet or
+    by EXCHANGE_LINK_COLS.
+
+    Order and packet ids share one KeyDict, so packets are separate nodes
+    offset by len(keys): an order id that happens to equal a packet id links
+    nothing. `sales_group_col` (opt-in) also links orders sharing a Sales
+    purchase id — every item of a multi-item cart, exchanged or not.
+    """
+    n = len(keys)
+    edges_a, edges_b = [], []
+    for df in (pg_fwd, pg_rev, sales):
+        if '_oid' in df.columns and '_pid' in df.columns:
+            o, p = df['_oid'].to_numpy(), df['_pid'].to_numpy()
+            ok = (o >= 0) & (p >= 0)
+            edges_a.append(o[ok]); edges_b.append(p[ok] + n)
+        for col in EXCHANGE_LINK_COLS:
+            if col in df.columns and '_oid' in df.columns:
+                o, l = df['_oid'].to_numpy(), keys.encode(df[col])
+                ok = (o >= 0) & (l >= 0)
+                edges_a.append(o[ok]); edges_b.append(l[ok])
+    total = 2 * n
+    if sales_group_col and sales_group_col in sales.columns and '_oid' in sales.columns:
+        grp, uniq = pd.factorize(norm_ids(sales[sales_group_col]))
+        o = sales['_oid'].to_numpy()
+        ok = (o >= 0) & (grp >= 0)
+        edges_a.append(o[ok]); edges_b.append(grp[ok].astype(np.int64) + total)
+        total += len(uniq)
+    if not edges_a:
+        return np.arange(n, dtype=np.int64)
+    return union_find(total, np.concatenate(edges_a), np.concatenate(edges_b))[:n]
+
+def chain_summary(chains, keys, pg_fwd, pg_rev, tolerance=PAYMENT_TOLERANCE, exchange_only=True):
+    """Reconcile every multi-order chain as one unit.
+
+    Orders_Pending counts members that look unsettled on their own;
+    Chain_Status judges the chain's combined pending/net instead.
+    """
+    def side(df, prefix):
+        return pd.DataFrame({
+            'chain': chains[df['_oid'].to_numpy()],
+            '_oid': df['_oid'].to_numpy(),
+            prefix + 'settlement': safe_get(df, 'total_actual_settlement'),
+            prefix + 'expected':   safe_get(df, 'total_expected_settlement'),
+            prefix + 'pending':    safe_get(df, 'amount_pending_settlement'),
+            'exchange': (df['return_type'] == 'exchange').to_numpy() if 'return_type' in df.columns else False,
+        })
+    rows = pd.concat([side(pg_fwd[pg_fwd['_oid'] >= 0], 'fwd_'), side(pg_rev[pg_rev['_oid'] >= 0], 'rev_')],
+                     ignore_index=True).fillna(0)
+    per_order = rows.groupby(['chain', '_oid'], sort=False).sum(numeric_only=True).reset_index()
+    per_order['pending'] = per_order['fwd_pending'] + per_order['rev_pending']
+    per_order['order_id'] = keys.decode(per_order['_oid'])
+
+    g = per_order.groupby('chain', sort=False)
+    out = g.agg(Orders=('_oid', 'size'), Exchanges=('exchange', 'sum'),
+                FWD_Expected=('fwd_expected', 'sum'), FWD_Settled=('fwd_settlement', 'sum'),
+                REV_Settled=('rev_settlement', 'sum'), Pending=('pending', 'sum'),
+                Orders_Pending=('pending', lambda s: int((s.abs() > tolerance).sum())))
+    out = out[(out['Orders'] > 1) & ((out['Exchanges'] > 0) | (not exchange_only))]
+    if out.empty:
+        return out.reset_index()
+    ids = per_order[per_order['chain'].isin(out.index)].groupby('chain')['order_id'].agg(
+        lambda s: ' → '.join(sorted(map(str, s))))
+    out.insert(0, 'Order_IDs', ids)
+    out['Net_Settled'] = out['FWD_Settled'] + out['REV_Settled']
+    out['Chain_Status'] = np.where(out['Pending'].abs() <= tolerance, 'Settled as chain', 'Pending')
+    return out.reset_index(drop=True).round(2)
+
+# ─────────────────────────────────────────────
+# Row-level diff of two checker outputs
+# ─────────────────────────────────────────────
+DIFF_IGNORE = ('id', 'month_label', 'saved_at', 'row_hash')
+
+def _value_hash(df, cols):
+    """uint64 per row over `cols`; numbers compared at paise precision."""
+    norm = pd.DataFrame({c: to_paise(df[c]) if pd.api.types.is_numeric_dtype(df[c])
+                         else df[c].astype(str).str.strip() for c in cols}, index=df.index)
+    return pd.util.hash_pandas_object(norm, index=False).to_numpy()
+
+def diff_outputs(before, after, key='order_id', ignore=DIFF_IGNORE):
+    """Added / removed / changed orders between two checker outputs.
+
+    Both sides are reduced to (key hash, value hash) uint64 pairs and
+    hash-joined on the key hash; only changed rows are expanded into
+    before/after columns. Numeric columns are compared at paise precision, so
+    float noise from a DB round trip is not reported as a change.
+    Returns (changes, counts) — changes has `Change` ('added'/'removed'/
+    'changed'), `Changed_Fields`, and `<col>_before`/`<col>_after` columns.
+    """
+    lower = {c.lower(): c for c in after.columns}   # unquoted Postgres names come back lower-case
+    before = before.rename(columns={c: lower[c.lower()] for c in before.columns if c.lower() in lower})
+    cols = [c for c in after.columns if c in before.columns and c != key and c not in ignore]
+    for c in cols:   # a DB round trip can turn numbers into strings
+        if pd.api.types.is_numeric_dtype(after[c]) and not pd.api.types.is_numeric_dtype(before[c]):
+            before = before.assign(**{c: pd.to_numeric(before[c], errors='coerce')})
+    b = before.drop_duplicates(key, keep='last').reset_index(drop=True)
+    a = after.drop_duplicates(key, keep='last').reset_index(drop=True)
+    hb = pd.DataFrame({'k': pd.util.hash_pandas_object(b[key].astype(str).str.strip(), index=False).to_numpy(),
+                       'v': _value_hash(b, cols), 'pos': np.arange(len(b))})
+    ha = pd.DataFrame({'k': pd.util.hash_pandas_object(a[key].astype(str).str.strip(), index=False).to_numpy(),
+                       'v': _value_hash(a, cols), 'pos': np.arange(len(a))})
+    j = hb.merge(ha, on='k', how='outer', suffixes=('_b', '_a'), indicator=True)
+    removed = j.loc[j['_merge'] == 'left_only', 'pos_b'].astype(np.int64).to_numpy()
+    added = j.loc[j['_merge'] == 'right_only', 'pos_a'].astype(np.int64).to_numpy()
+    both = j[j['_merge'] == 'both']
+    changed = both[both['v_b'] != both['v_a']]
+    cb, ca = changed['pos_b'].astype(np.int64).to_numpy(), changed['pos_a'].astype(np.int64).to_numpy()
+
+    ch = pd.DataFrame({key: a[key].to_numpy()[ca]})
+    fields = pd.Series('', index=ch.index)
+    for c in cols:
+        bv, av = b[c].to_numpy()[cb], a[c].to_numpy()[ca]
+        ch[f'{c}_before'], ch[f'{c}_after'] = bv, av
+        if pd.api.types.is_numeric_dtype(a[c]):
+            diff = to_paise(bv) != to_paise(av)
+        else:
+            diff = pd.Series(bv).astype(str).str.strip().to_numpy() != pd.Series(av).astype(str).str.strip().to_numpy()
+        fields = fields.where(~diff, fields + np.where(fields == '', '', ', ') + c)
+    ch.insert(1, 'Change', 'changed')
+    ch.insert(2, 'Changed_Fields', fields.to_numpy())
+
+    def side(df, pos, label, suffix):
+        out = pd.DataFrame({key: df[key].to_numpy()[pos], 'Change': label, 'Changed_Fields': ''})
+        for c in cols:
+            out[f'{c}{suffix}'] = df[c].to_numpy()[pos]
+        return out
+    changes = pd.concat([ch, side(a, added, 'added', '_after'), side(b, removed, 'removed', '_before')],
+                        ignore_index=True)
+    counts = {'added': len(added), 'removed': len(removed), 'changed': len(changed),
+              'unchanged': len(both) - len(changed),
+              'duplicate_keys': (len(before) - len(b)) + (len(after) - len(a))}
+    return changes, counts
+
+def status_transitions(changes, col='Payment_Status'):
+    """Before → after counts of `col` over a diff_outputs result."""
+    b, a = f'{col}_before', f'{col}_after'
+    if b not in changes.columns and a not in changes.columns:
+        return pd.DataFrame(columns=['Before', 'After', 'Orders'])
+    t = pd.DataFrame({'Before': changes.get(b, pd.Series(index=changes.index, dtype=object)).fillna('—'),
+                      'After': changes.get(a, pd.Series(index=changes.index, dtype=object)).fillna('—')})
+    t = t[t['Before'] != t['After']]
+    return t.value_counts().rename('Orders').reset_index()
+
+# ─────────────────────────────────────────────
+# Tab builders — Overview KPIs, reconciliation status, UTR lines
+# ─────────────────────────────────────────────
+def overview_kpis(pg_fwd, pg_rev):
+    """Headline counts and sums for the Overview tab — PG Forward/Reverse only,
+    so they can be shown before the Sales/RTO/RT reports finish parsing.
+    Exact for preview frames too (they carry the full-file totals)."""
+    orders, returns = frame_rows(pg_fwd), frame_rows(pg_rev)
+    fwd_settle = frame_sum(pg_fwd, 'total_actual_settlement')
+    rev_settle = frame_sum(pg_rev, 'total_actual_settlement')
+    return {
+        'orders': orders,
+        'returns': returns,
+        'return_rate': returns / orders * 100 if orders else 0.0,
+        'gmv': frame_sum(pg_fwd, 'mrp'),
+        'net_revenue': frame_sum(pg_fwd, 'seller_product_amount'),
+        'fwd_settle': fwd_settle,
+        'rev_settle': rev_settle,
+        'net_settle': fwd_settle + rev_settle,
+        'commission': frame_sum(pg_fwd, 'total_commission', absolute=True),
+        'logistics': frame_sum(pg_fwd, 'total_logistics_deduction', absolute=True),
+        'avg_order': frame_mean(pg_fwd, 'seller_product_amount'),
+        'avg_comm_pct': frame_mean(pg_fwd, 'commission_percentage'),
+    }
+
+def recon_status(merged):
+    """Recon_Status per row of the PG Forward ↔ Sales outer merge."""
+    side = merged['_merge'].astype(str) if '_merge' in merged.columns \
+        else pd.Series('left_only', index=merged.index)
+    if 'invoice_amount' in merged.columns:
+        close = (safe_num(merged['seller_amount']) - safe_num(merged['invoice_amount'])).abs() < 2
+    else:
+        close = pd.Series(False, index=merged.index)
+    pending = safe_get(merged, 'pending_settlement') > 0
+    return pd.Series(np.select(
+        [(side == 'both') & close, side == 'both',
+         (side == 'left_only') & pending, side == 'left_only'],
+        ['✅ Matched', '⚠️ Amount Mismatch',
+         '🕐 PG Only – Settlement Pending', '✅ PG Only – Settled'],
+        default='❓ Sales Only – Not in PG'), index=merged.index)
+
+# (Type, UTR column, settlement date column, amount column) per PG Forward line
+UTR_LINES = [
+    ('Prepaid – Commission', 'bank_utr_no_prepaid_comm_deduction',
+     'settlement_date_prepaid_comm_deduction', 'prepaid_commission_deduction'),
+    ('Prepaid – Logistics',  'bank_utr_no_prepaid_logistics_deduction',
+     'settlement_date_prepaid_logistics_deduction', 'prepaid_logistics_deduction'),
+    ('Prepaid – Payment',    'bank_utr_no_prepaid_payment',
+     'settlement_date_prepaid_payment', 'prepaid_payment'),
+    ('Postpaid – Commission','bank_utr_no_postpaid_comm_deduction',
+     'settlement_date_postpaid_comm_deduction', 'postpaid_commission_deduction'),
+    ('Postpaid – Logistics', 'bank_utr_no_postpaid_logistics_deduction',
+     'settlement_date_postpaid_logistics_deduction', 'postpaid_logistics_deduction'),
+    ('Postpaid – Payment',   'bank_utr_no_postpaid_payment',
+     'settlement_date_postpaid_payment', 'postpaid_payment'),
+]
+UTR_TRACKER_COLS = ['Order_ID', 'Packet_ID', 'SKU', 'Type', 'UTR', 'Settle_Date', 'Amount', 'Status']
+
+def utr_tracker(pg_fwd):
+    """One row per settled (order, line type) with its UTR, date and amount.
+
+    Lines are ordered as in the file, then by UTR_LINES; a line counts when
+    its UTR is present and non-blank.
+    """
+    parts = []
+    for t, (label, utr_col, date_col, amt_col) in enumerate(UTR_LINES):
+        if utr_col not in pg_fwd.columns:
+            continue
+        raw = pg_fwd[utr_col]
+        utr = raw.astype(str).str.strip()
+        pos = np.flatnonzero((raw.notna() & ~utr.isin(['', 'nan'])).to_numpy())
+        if not len(pos):
+            continue
+        rows, utr = pg_fwd.iloc[pos].reset_index(drop=True), utr.iloc[pos].reset_index(drop=True)
+        dt = rows[date_col] if date_col in rows.columns else pd.Series(np.nan, index=rows.index)
+        amt = safe_get(rows, amt_col)
+        parts.append(pd.DataFrame({
+            'Order_ID': rows['order_release_id'],
+            'Packet_ID': rows['packet_id'],
+            'SKU': rows['sku_code'] if 'sku_code' in rows.columns else '',
+            'Type': label,
+            'UTR': utr,
+            'Settle_Date': dt.astype(str).str[:10].where(dt.notna(), ''),
+            'Amount': amt.astype(float).round(2),
+            'Status': '✅ Settled',
+            '_pos': pos,
+            '_line': t,
+        }))
+    if not parts:
+        return pd.DataFrame(columns=UTR_TRACKER_COLS)
+    out = pd.concat(parts, ignore_index=True).sort_values(['_pos', '_line'], kind='stable')
+    return out[UTR_TRACKER_COLS].reset_index(drop=True)
+
+# ─────────────────────────────────────────────
+# Preview mode — one streaming pass: exact totals + a weighted sample
+# ─────────────────────────────────────────────
+# A preview frame is a sample of a PG report carrying `_w` (rows it stands
+# for) and `_stratum`; its .attrs['preview'] holds the exact row count, column
+# sums and strata sizes from the same pass. The frame_* helpers and
+# group_table work on full frames and preview frames alike, so the Overview,
+# SKU and Geography tabs render either one; grouped sums and counts then get
+# a "±" column (95% bound).
+PREVIEW_SAMPLE_ROWS = 50_000
+PREVIEW_CHUNK_ROWS = 250_000
+PREVIEW_COLS = ['order_release_id', 'packet_id', 'sku_code', 'article_type', 'shipping_state',
+                'shipment_zone_classification', 'mrp', 'seller_product_amount',
+                'total_actual_settlement', 'total_commission', 'total_logistics_deduction',
+                'commission_percentage', 'prepaid_amount', 'postpaid_amount']
+PREVIEW_STRATA_COL = 'shipping_state'
+CONFIDENCE_Z = 1.96
+
+def _bottom_k(df, cap):
+    """Rows with the `cap` smallest random tags `_u` per `_stratum`."""
+    df = df.sort_values(['_stratum', '_u'], kind='stable')
+    return df[df.groupby('_stratum', sort=False).cumcount().to_numpy() < cap]
+
+def preview_scan(parts, sample_rows=PREVIEW_SAMPLE_ROWS, stratify=None,
+                 chunk_rows=PREVIEW_CHUNK_ROWS, seed=None):
+    """Stream the files of one PG report once → preview frame.
+
+    parts: [(name, bytes, zip member)] as from upload_parts. Only PREVIEW_COLS
+    and the Settlement_on_* columns are parsed, chunk by chunk. Row counts and
+    money sums are exact. The sample is reservoir sampling in its random-tag
+    form: every row gets a uniform tag and the `sample_rows` smallest tags
+    are kept. With `stratify` (a column name) each value of that column keeps
+    its own bottom-k, split evenly over the strata seen. Cross-file
+    duplicate lines are only removed by the full parse.
+    """
+    rng = np.random.default_rng(seed)
+    keep, rows, sums, abs_sums, positive = None, 0, {}, {}, {}
+    sizes = pd.Series(dtype=np.int64)
+    for name, data, member in parts:
+        name, raw = member or name, part_bytes(data, member)
+        header = read_table(name, raw, nrows=0).columns
+        cols = [c for c in header if c in PREVIEW_COLS or str(c).startswith('Settlement_on_')]
+        money = [c for c in cols if c in MONEY_COLS_PG or str(c).startswith('Settlement_on_')]
+        chunks = ([read_table(name, raw, usecols=cols)] if name.lower().endswith(('.xlsx', '.xls'))
+                  else pd.read_csv(io.BytesIO(raw), usecols=cols, chunksize=chunk_rows))
+        for chunk in chunks:
+            chunk = coerce_df(chunk, money)
+            rows += len(chunk)
+            for c in money:
+                sums[c] = sums.get(c, 0.0) + float(chunk[c].sum())
+                abs_sums[c] = abs_sums.get(c, 0.0) + float(chunk[c].abs().sum())
+                positive[c] = positive.get(c, 0) + int((chunk[c] > 0).sum())
+            stratum = (chunk[stratify].astype(str).to_numpy() if stratify in chunk.columns
+                       else np.full(len(chunk), ''))
+            chunk = chunk.assign(_stratum=stratum, _u=rng.random(len(chunk)))
+            sizes = sizes.add(chunk['_stratum'].value_counts(), fill_value=0)
+            keep = chunk if keep is None else pd.concat([keep, chunk], ignore_index=True)
+            keep = _bottom_k(keep, max(sample_rows // max(len(sizes), 1), 1))
+    if keep is None:
+        raise ValueError("nothing to preview")
+    taken = keep['_stratum'].value_counts()
+    strata = {s: (int(sizes[s]), int(taken.get(s, 0))) for s in sizes.index}
+    sample = keep.drop(columns='_u').reset_index(drop=True)
+    sample['_w'] = sample['_stratum'].map({s: N / n for s, (N, n) in strata.items() if n})
+    sample.attrs['preview'] = {'rows': rows, 'sums': sums, 'abs_sums': abs_sums,
+                               'positive': positive, 'strata': strata}
+    return sample
+
+def is_preview(df):
+    return 'preview' in df.attrs
+
+def frame_rows(df):
+    """Rows in the report (the full count for a preview frame)."""
+    return df.attrs['preview']['rows'] if is_preview(df) else len(df)
+
+def frame_sum(df, col, absolute=False):
+    """Column total (of |values| with `absolute`); exact for preview frames
+    on the money columns, estimated from the sample otherwise."""
+    if is_preview(df):
+        sums = df.attrs['preview']['abs_sums' if absolute else 'sums']
+        if col in sums:
+            return sums[col]
+        vals = safe_get(df, col)
+        return float(((vals.abs() if absolute else vals) * df['_w']).sum())
+    if col not in df.columns:
+        return 0.0
+    return df[col].abs().sum() if absolute else df[col].sum()
+
+def frame_positive(df, col):
+    """Rows with col > 0."""
+    if is_preview(df):
+        pos = df.attrs['preview']['positive']
+        return pos[col] if col in pos else float(((safe_get(df, col) > 0) * df['_w']).sum())
+    return int((df[col] > 0).sum()) if col in df.columns else 0
+
+def frame_mean(df, col):
+    n = frame_rows(df)
+    return frame_sum(df, col) / n if n else 0.0
+
+def group_table(df, by, spec, z=CONFIDENCE_Z):
+    """groupby(by).agg(**spec).reset_index() for full or preview frames.
+
+    spec: {out column: (source column, 'count'|'sum'|'mean'|'first')}. On a
+    preview frame counts and sums are stratified expansion estimates, each
+    followed by an "<out> ±" column (z × standard error, finite-population
+    corrected); means are ratio estimates.
+    """
+    if not is_preview(df):
+        return df.groupby(by).agg(**spec).reset_index()
+    est_cols = {o: c for o, (c, how) in spec.items() if how in ('sum', 'mean')}
+    vals = pd.DataFrame({o: safe_get(df, c) for o, c in est_cols.items()}, index=df.index)
+    vals['_one'] = 1.0
+    keys = [df['_stratum'], df[by]]
+    s1 = vals.groupby(keys).sum()
+    s2 = (vals ** 2).groupby(keys).sum()
+    strata = df.attrs['preview']['strata']
+    level = s1.index.get_level_values(0)
+    N = np.array([strata[s][0] for s in level], dtype=float)
+    n = np.array([strata[s][1] for s in level], dtype=float)
+    est = s1.mul(N / n, axis=0).groupby(level=1).sum()
+    within = (s2 - s1.pow(2).div(n, axis=0)).div(np.maximum(n - 1, 1), axis=0).clip(lower=0)
+    var = within.mul(np.where(n > 1, N ** 2 * (1 - n / N) / n, 0.0), axis=0).groupby(level=1).sum()
+    out = pd.DataFrame(index=est.index)
+    for o, (c, how) in spec.items():
+        if how == 'count':
+            out[o], out[f'{o} ±'] = est['_one'].round(), (z * np.sqrt(var['_one'])).round()
+        elif how == 'sum':
+            out[o], out[f'{o} ±'] = est[o], (z * np.sqrt(var[o])).round(2)
+        elif how == 'mean':
+            out[o] = est[o] / est['_one']
+        else:
+            out[o] = df.groupby(by)[c].agg(how)
+    return out.rename_axis(by).reset_index()
@@ -0,0 +1,177 @@
+"""
+Background work for the dashboard: save jobs, upload parsing, prefetch.
+The save runs on a thread pool; worker threads only update a SaveJob, and the
+Streamlit script polls it to draw progress. No Streamlit calls in here.
+"""
+import multiprocessing
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+
+from recon_core import UPLOAD_SLOTS, combine_parts, parse_upload, part_bytes, part_label
+
+SAVE_WORKERS = 6
+PARSE_WORKERS = 5
+TERMINAL = ('done', 'failed', 'skipped')
+
+
+class SaveJob:
+    """Progress of one "save month" job, shared between workers and the UI."""
+
+    def __init__(self, month_label, names):
+        self.id = str(uuid.uuid4())[:8]
+        self.month_label = month_label
+        self.started_at = datetime.utcnow()
+        self.finished_at = None
+        self._lock = threading.Lock()
+        self.tables = {n: {'rows': 0, 'saved': 0, 'unchanged': 0, 'state': 'queued', 'error': None}
+                       for n in names}
+        self.futures = []
+
+    def update(self, name, **kw):
+        with self._lock:
+            self.tables[name].update(kw)
+
+    def add_saved(self, name, n):
+        with self._lock:
+            self.tables[name]['saved'] += n
+
+    def snapshot(self):
+        with self._lock:
+            return {n: dict(t) for n, t in self.tables.items()}
+
+    @property
+    def done(self):
+        return all(t['state'] in TERMINAL for t in self.snapshot().values())
+
+    def progress(self):
+        snap = self.snapshot()
+        finished = sum(t['state'] in TERMINAL for t in snap.values())
+        partial = sum(min(t['saved'] / t['rows'], 1.0) for t in snap.values()
+                      if t['state'] == 'saving' and t['rows'])
+        return (finished + partial) / max(len(snap), 1)
+
+    def results(self):
+        return {n: t['saved'] for n, t in self.snapshot().items()}
+
+
+def _run_task(job, name, produce, table, report_name, save_fn, log_fn):
+    try:
+        job.update(name, state='building')
+        df = produce()
+        if df is None or df.empty:
+            job.update(name, state='skipped')
+            return 0
+        job.update(name, state='saving', rows=len(df))
+        saved = save_fn(df, table,
+                        on_chunk=lambda n: job.add_saved(name, n),
+                        on_error=lambda msg: job.update(name, error=msg),
+                        on_unchanged=lambda n: job.update(name, unchanged=n))
+        if saved:
+            log_fn(report_name, table, saved, job.month_label)
+        job.update(name, state='failed' if job.snapshot()[name]['error'] else 'done')
+        return saved
+    except Exception as e:  # keep the other tables going
+        job.update(name, state='failed', error=str(e))
+        return 0
+    finally:
+        if job.done:
+            job.finished_at = datetime.utcnow()
+
+
+def start_save_job(executor, month_label, tasks, save_fn, log_fn):
+    """Submit every table of `tasks` concurrently and return the SaveJob.
+
+    tasks: {name: (produce, table, report_name)} where produce() returns the
+    frame to save (built on the worker, so heavy prep does not block the UI).
+    save_fn(df, table, on_chunk=, on_error=, on_unchanged=) -> rows saved; log_fn as sb_log_report.
+    """
+    job = SaveJob(month_label, list(tasks))
+    for name, (produce, table, report_name) in tasks.items():
+        job.futures.append(executor.submit(
+            _run_task, job, name, produce, table, report_name, save_fn, log_fn))
+    return job
+
+
+def make_executor():
+    return ThreadPoolExecutor(max_workers=SAVE_WORKERS, thread_name_prefix='sb-save')
+
+
+# ─────────────────────────────────────────────
+# Concurrent upload parsing
+# ─────────────────────────────────────────────
+def _timed_parse(slot, name, data, member, use_arrow):
+    t0 = time.perf_counter()
+    out = parse_upload(slot, member or name, part_bytes(data, member), use_arrow)
+    out['seconds'] = time.perf_counter() - t0
+    return out
+
+
+def submit_parses(executor, uploads, use_arrow=False):
+    """Queue every file of every report; returns {slot: [(label, future)]}.
+
+    uploads: {slot: [(name, bytes, zip member or None)]} as from upload_parts.
+    Each file (or ZIP member) is one task.
+    """
+    return {slot: [(part_label(name, member),
+                    executor.submit(_timed_parse, slot, name, data, member, use_arrow))
+                   for name, data, member in parts]
+            for slot, parts in uploads.items()}
+
+
+def collect_parses(futures, slots=None):
+    """Wait for the reports in `slots` (default: all) and stack their files.
+
+    Returns (results, errors): results {slot: combined output + 'seconds'
+    (slowest file) + 'files'}, errors {slot: "<Report> (<file>): <message>"}
+    — one failing file does not hide the others. Collecting a few slots first
+    lets the caller draw what they feed while the rest are still parsing.
+    """
+    results, errors = {}, {}
+    for slot, futs in futures.items():
+        if slots is not None and slot not in slots:
+            continue
+        parsed = []
+        for label, fut in futs:
+            try:
+                parsed.append(fut.result())
+            except Exception as e:
+                errors[slot] = f"{UPLOAD_SLOTS.get(slot, slot)} ({label}): {e}"
+                break
+        if slot in errors or not parsed:
+            continue
+        results[slot] = combine_parts(slot, parsed)
+        results[slot]['seconds'] = max(p['seconds'] for p in parsed)
+        results[slot]['files'] = len(parsed)
+    return results, errors
+
+
+def make_parse_executor(processes=False):
+    """Threads for CSV (the C/Arrow parsers release the GIL); processes for
+    XLSX, whose openpyxl parse is pure Python and holds it."""
+    if processes:
+        return ProcessPoolExecutor(max_workers=PARSE_WORKERS,
+                                   mp_context=multiprocessing.get_context('spawn'))
+    return ThreadPoolExecutor(max_workers=PARSE_WORKERS, thread_name_prefix='parse')
+
+
+# ─────────────────────────────────────────────
+# Background prefetch of heavy tab results
+# ─────────────────────────────────────────────
+PREFETCH_WORKERS = 3
+
+
+def prefetch(executor, tasks):
+    """Start each `tasks` builder ({name: fn}) on the executor; {name: future}.
+
+    The builders go through memo_result, so a tab that asks for the same
+    result while it is still building waits for it instead of building it
+    twice, and finished results are simply cache hits.
+    """
+    return {name: executor.submit(fn) for name, fn in tasks.items()}
+
+
+def make_prefetch_executor():
+    return ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix='prefetch')
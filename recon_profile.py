@@ -0,0 +1,126 @@
+"""
+Sampling profiler for one dashboard rerun.
+
+A daemon thread samples the script thread's stack every few milliseconds,
+from the script's module frame up, and stops by itself once that frame has
+left the stack — the rerun finished, raised, or hit st.stop(). Module-level
+frames keep their line number, so time spent in the script body shows up per
+line of myntra_app.py rather than as one `<module>` block.
+
+Output: a speedscope file (open at https://www.speedscope.app) and folded
+stacks (flamegraph.pl / speedscope import), tagged with whatever the script
+passed to tag() — upload hashes, row counts. Standard library only; nothing
+runs unless a RerunProfiler is started. No Streamlit calls in here.
+"""
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+
+SAMPLE_INTERVAL = 0.005
+SPEEDSCOPE_SCHEMA = "https://www.speedscope.app/file-format-schema.json"
+
+
+class RerunProfiler:
+    """Samples the calling thread until `run_frame` (the script's module frame) returns."""
+
+    def __init__(self, run_frame, interval=SAMPLE_INTERVAL, on_done=None):
+        self.thread_id = threading.get_ident()
+        self.interval = interval
+        self.on_done = on_done
+        self.tags = {}
+        self.frames, self._frame_ids = [], {}
+        self.samples, self.weights = [], []
+        self.started_at = datetime.now()
+        self.seconds = 0.0
+        self._run_frame = run_frame
+        self._stop = threading.Event()
+
+    def start(self):
+        self._t0 = time.perf_counter()
+        threading.Thread(target=self._run, daemon=True, name='rerun-profiler').start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def tag(self, **kw):
+        self.tags.update(kw)
+
+    def _frame_id(self, f):
+        code = f.f_code
+        line = f.f_lineno if code.co_name == '<module>' else code.co_firstlineno
+        key = (code.co_name, code.co_filename, line)
+        idx = self._frame_ids.get(key)
+        if idx is None:
+            idx = self._frame_ids[key] = len(self.frames)
+            name = f"{os.path.basename(code.co_filename)}:{line}" if code.co_name == '<module>' else code.co_name
+            self.frames.append({'name': name, 'file': code.co_filename, 'line': line})
+        return idx
+
+    def _sample(self):
+        """Stack (root first) from the module frame up, or None once it has returned."""
+        f = sys._current_frames().get(self.thread_id)
+        stack = []
+        while f is not None:
+            stack.append(f)
+            if f is self._run_frame:
+                return [self._frame_id(x) for x in reversed(stack)]
+            f = f.f_back
+        return None
+
+    def _run(self):
+        last = self._t0
+        while not self._stop.wait(self.interval):
+            stack = self._sample()
+            if stack is None:
+                break
+            now = time.perf_counter()
+            self.samples.append(stack)
+            self.weights.append(now - last)
+            last = now
+        self.seconds = time.perf_counter() - self._t0
+        self._run_frame = None            # do not keep the finished run's globals alive
+        if self.on_done is not None:
+            self.on_done(self)
+
+    # ── output ──
+    def _key(self):
+        """Short, filename-safe form of the tagged input key ('' if untagged)."""
+        return max(str(self.tags.get('input_key', '')).split(':'), key=len)[:12]
+
+    def title(self, label):
+        return f"{label} rerun {self.started_at:%Y-%m-%d %H:%M:%S}" + (f" [{self._key()}]" if self._key() else "")
+
+    def speedscope(self, label):
+        return {
+            '$schema': SPEEDSCOPE_SCHEMA, 'name': self.title(label), 'exporter': 'recon_profile',
+            'activeProfileIndex': 0, 'shared': {'frames': self.frames},
+            'profiles': [{'type': 'sampled', 'name': self.title(label), 'unit': 'seconds',
+                          'startValue': 0, 'endValue': sum(self.weights),
+                          'samples': self.samples, 'weights': self.weights}],
+            'metadata': dict(self.tags, seconds=round(self.seconds, 3), samples=len(self.samples),
+                             interval=self.interval),
+        }
+
+    def folded(self):
+        """Collapsed stacks, one "a;b;c <ms>" line per distinct stack."""
+        totals = {}
+        for stack, w in zip(self.samples, self.weights):
+            key = ';'.join(self.frames[i]['name'] for i in stack)
+            totals[key] = totals.get(key, 0.0) + w
+        return ''.join(f"{k} {round(v * 1000)}\n" for k, v in totals.items())
+
+    def save(self, directory, label):
+        """Write <stamp>_<input key>.speedscope.json + .folded; returns a summary dict."""
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, f"{label}_{self.started_at:%Y%m%d_%H%M%S}"
+                                       + (f"_{self._key()}" if self._key() else ""))
+        with open(base + '.speedscope.json', 'w') as f:
+            json.dump(self.speedscope(label), f)
+        with open(base + '.folded', 'w') as f:
+            f.write(self.folded())
+        return {'title': self.title(label), 'speedscope': base + '.speedscope.json', 'folded': base + '.folded',
+                'seconds': self.seconds, 'samples': len(self.samples), 'tags': dict(self.tags)}
@@ -0,0 +1,154 @@
+"""
+Data-quality rules for the uploaded reports.
+Each rule is declared once in RULES and evaluated as a boolean mask over its
+report; everything runs in one vectorized pass right after load. No Streamlit
+calls in here.
+"""
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+
+Rule = namedtuple('Rule', 'rule_id report severity message check')
+
+SEVERITY_ORDER = {'error': 0, 'warn': 1, 'info': 2}
+REPORT_LABELS = {'pg_fwd': 'PG Forward', 'pg_rev': 'PG Reverse', 'sales': 'Sales',
+                 'rto': 'RTO', 'rt': 'RT'}
+
+
+def _col(df, col):
+    return df[col] if col in df.columns else pd.Series(np.nan, index=df.index)
+
+def _has_text(s):
+    s = s.astype('string').str.strip()
+    return (s.notna() & (s != '') & (s.str.lower() != 'nan')).to_numpy(dtype=bool)
+
+def _blank(s):
+    return (s.isna() | s.astype(str).str.strip().eq('')).to_numpy(dtype=bool)
+
+def _id_col(report, ctx):
+    return ctx.get('sales_id_col', 'order_release_id') if report == 'sales' else 'order_release_id'
+
+def _zeroed(report):
+    """Rows whose money values were blank/non-numeric and zeroed by coerce_df."""
+    def check(frames, ctx):
+        mask = np.zeros(len(frames[report]), dtype=bool)
+        for pos in ctx.get('nan_rows', {}).get(report, {}).values():
+            mask[pos] = True
+        return mask
+    return check
+
+def _dup_ids(report):
+    def check(frames, ctx):
+        df = frames[report]
+        blank = _blank(_col(df, _id_col(report, ctx)))
+        return df['_oid'].duplicated(keep=False).to_numpy() & (df['_oid'] >= 0).to_numpy() & ~blank
+    return check
+
+def _missing_id(report):
+    def check(frames, ctx):
+        df = frames[report]
+        col = _id_col(report, ctx)
+        return _blank(df[col]) if col in df.columns else np.zeros(len(df), dtype=bool)
+    return check
+
+def _not_in_sales(report):
+    def check(frames, ctx):
+        # blank ids match nothing: -1 is dropped from Sales, and blank return ids
+        # are reported by their own blank-id rule
+        oid = frames[report]['_oid'].to_numpy() if '_oid' in frames[report] else np.array([], dtype=np.int64)
+        sales_oid = frames['sales']['_oid'].to_numpy()
+        return (oid >= 0) & ~np.isin(oid, sales_oid[sales_oid >= 0])
+    return check
+
+def _utr_zero(frames_key):
+    def check(frames, ctx):
+        df = frames[frames_key]
+        bad = np.zeros(len(df), dtype=bool)
+        for utr, amt in (('bank_utr_no_prepaid_payment', 'prepaid_payment'),
+                         ('bank_utr_no_postpaid_payment', 'postpaid_payment')):
+            if utr in df.columns and amt in df.columns:
+                bad |= _has_text(df[utr]) & (pd.to_numeric(df[amt], errors='coerce').fillna(0) == 0).to_numpy()
+        return bad
+    return check
+
+def _neg_seller_price(frames, ctx):
+    col = ctx.get('sales_price_col')
+    if not col:
+        return np.zeros(len(frames['sales']), dtype=bool)
+    return (pd.to_numeric(_col(frames['sales'], col), errors='coerce') < 0).to_numpy()
+
+def _neg_fwd_settlement(frames, ctx):
+    return (pd.to_numeric(_col(frames['pg_fwd'], 'total_actual_settlement'), errors='coerce') < 0).to_numpy()
+
+
+RULES = [
+    Rule('sales_dup_order_id',   'sales',  'error', "Order id appears more than once in Sales", _dup_ids('sales')),
+    Rule('sales_neg_price',      'sales',  'error', "Negative seller_price",                    _neg_seller_price),
+    Rule('sales_missing_id',     'sales',  'error', "Blank order id",                           _missing_id('sales')),
+    Rule('sales_zeroed',         'sales',  'warn',  "Blank/non-numeric amount read as 0",        _zeroed('sales')),
+    Rule('fwd_utr_zero',         'pg_fwd', 'error', "UTR present but payment amount is 0",       _utr_zero('pg_fwd')),
+    Rule('fwd_zeroed',           'pg_fwd', 'warn',  "Blank/non-numeric settlement value read as 0", _zeroed('pg_fwd')),
+    Rule('fwd_neg_settlement',   'pg_fwd', 'warn',  "Negative actual settlement on a forward row", _neg_fwd_settlement),
+    Rule('fwd_missing_id',       'pg_fwd', 'error', "Blank order_release_id",                   _missing_id('pg_fwd')),
+    Rule('rev_zeroed',           'pg_rev', 'warn',  "Blank/non-numeric settlement value read as 0", _zeroed('pg_rev')),
+    Rule('rev_utr_zero',         'pg_rev', 'error', "UTR present but payment amount is 0",       _utr_zero('pg_rev')),
+    Rule('rto_not_in_sales',     'rto',    'warn',  "RTO order id not found in Sales",           _not_in_sales('rto')),
+    Rule('rt_not_in_sales',      'rt',     'warn',  "RT order id not found in Sales",            _not_in_sales('rt')),
+    Rule('rto_missing_id',       'rto',    'warn',  "Blank order id",                           _missing_id('rto')),
+    Rule('rt_missing_id',        'rt',     'warn',  "Blank order id",                           _missing_id('rt')),
+]
+
+
+class QualityReport:
+    """Rule outcomes: a compact summary plus the offending row positions per rule.
+
+    Holds positions only (not the frames), so it can sit in the result cache
+    next to the parsed data without pinning a second copy of it.
+    """
+
+    def __init__(self, sizes, hits, rules):
+        self.sizes = sizes        # {report: row count}
+        self.hits = hits          # {rule_id: np.ndarray of row positions}
+        self.rules = {r.rule_id: r for r in rules}
+
+    def summary(self):
+        rows = []
+        for rid, pos in self.hits.items():
+            r = self.rules[rid]
+            rows.append({'Severity': r.severity, 'Report': REPORT_LABELS.get(r.report, r.report),
+                         'Rule': r.message, 'Rows': len(pos),
+                         'Pct': round(100 * len(pos) / max(self.sizes[r.report], 1), 2),
+                         'rule_id': rid})
+        out = pd.DataFrame(rows, columns=['Severity', 'Report', 'Rule', 'Rows', 'Pct', 'rule_id'])
+        return out.sort_values(['Severity', 'Rows'], key=lambda s: s.map(SEVERITY_ORDER) if s.name == 'Severity'
+                               else -s).reset_index(drop=True)
+
+    def count(self, severity=None):
+        return sum(len(p) > 0 for rid, p in self.hits.items()
+                   if severity is None or self.rules[rid].severity == severity)
+
+    def rows(self, frames, rule_id):
+        """Offending rows of one rule (columns starting with `_` dropped)."""
+        r = self.rules[rule_id]
+        df = frames[r.report].iloc[self.hits[rule_id]]
+        return df[[c for c in df.columns if not str(c).startswith('_')]]
+
+
+def run_rules(frames, ctx=None, rules=None):
+    """Evaluate every rule whose report is present; keep only rules that fired.
+
+    frames: {'pg_fwd','pg_rev','sales','rto','rt'} → DataFrame (with `_oid`
+    from attach_keys). ctx: {'sales_price_col': ..., 'sales_id_col': ...,
+    'nan_rows': {report: nan_log}}.
+    """
+    ctx = ctx or {}
+    rules = rules or RULES
+    hits = {}
+    for r in rules:
+        df = frames.get(r.report)
+        if df is None or df.empty:
+            continue
+        pos = np.flatnonzero(np.asarray(r.check(frames, ctx), dtype=bool))
+        if len(pos):
+            hits[r.rule_id] = pos
+    return QualityReport({k: len(v) for k, v in frames.items()}, hits, rules)
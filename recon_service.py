@@ -0,0 +1,331 @@
+"""
+Local HTTP service around the Order Settlement Checker.
+
+Submit the five reports, poll the job, stream the order-level Payment Status
+table back as CSV or Parquet. Standard library only (http.server); jobs run
+on a process pool and parsed inputs are cached per worker by content hash.
+
+    python recon_service.py --port 8765 --workers 4
+
+    curl -F pg_fwd=@PG_Forward.csv -F pg_rev=@PG_Reverse.csv -F sales=@Sales.xlsx \\
+         -F rto=@RTO.csv -F rt=@RT.csv http://127.0.0.1:8765/jobs
+    curl http://127.0.0.1:8765/jobs/<job_id>
+    curl -o out.csv "http://127.0.0.1:8765/jobs/<job_id>/result?format=csv"
+
+Files may be repeated per field (weekly PG exports) or sent as a ZIP.
+Query flags on POST /jobs: exact=1 (int64 paise), arrow=1 (Arrow CSV parser).
+
+Results are written to disk by the worker (Parquet with pyarrow, else CSV)
+and streamed from the file; the server keeps no result frames in memory.
+Finished results are dropped oldest first beyond MAX_JOBS or MAX_RESULT_MB.
+"""
+import argparse
+import email.parser
+import email.policy
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from recon_core import (
+    ARROW_OK, UPLOAD_SLOTS, build_checker, checker_export, checker_frames, combine_parts,
+    memo_result, parse_upload, part_bytes, upload_parts,
+)
+
+MAX_JOBS = 200           # finished jobs kept for download (oldest dropped first)
+MAX_RESULT_MB = 2048     # result files kept on disk, across all jobs
+STREAM_CHUNK_ROWS = 50_000
+FILE_CHUNK = 1 << 20
+REQUIRED_SLOTS = ('pg_fwd', 'pg_rev', 'sales')
+
+
+# ─────────────────────────────────────────────
+# Worker side (runs in the process pool)
+# ─────────────────────────────────────────────
+def _parse_part(slot, name, data, member, use_arrow):
+    """parse_upload, memoized per worker on the part's bytes."""
+    key = hashlib.sha1(data).hexdigest() + f":{member}:{use_arrow}"
+    return memo_result(f'parse:{slot}', key,
+                       lambda: parse_upload(slot, member or name, part_bytes(data, member), use_arrow))
+
+
+def run_checker_job(uploads, use_arrow=False, exact=False, out_path=None):
+    """{slot: [(name, bytes, member)]} → checker table in the saved output schema.
+
+    With `out_path` the table is written there instead (see write_result) and
+    only its row count is returned, so the frame never crosses back to the
+    server process.
+    """
+    parsed = {slot: combine_parts(slot, [_parse_part(slot, name, data, member, use_arrow)
+                                         for name, data, member in parts])
+              for slot, parts in uploads.items()}
+    frames, sales_id, price_col = checker_frames(parsed)   # shallow copies: cached parses stay untouched
+    if not price_col:
+        raise ValueError("Cannot find seller_price in the Sales sheet")
+    df = build_checker(frames['sales'], frames['pg_fwd'], frames['pg_rev'], frames['rto'], frames['rt'],
+                       sales_id, price_col, exact=exact)
+    out = checker_export(df)
+    if out_path is None:
+        return out
+    write_result(out, out_path)
+    return len(out)
+
+
+def write_result(df, path):
+    """Parquet when `path` ends in .parquet, else CSV; written to a temp name
+    and renamed, so a reader never sees a partial file."""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    if path.endswith('.parquet'):
+        df.to_parquet(tmp, index=False)
+    else:
+        df.to_csv(tmp, index=False)
+    os.replace(tmp, path)
+
+
+# ─────────────────────────────────────────────
+# Job queue (HTTP side)
+# ─────────────────────────────────────────────
+class JobQueue:
+    """Submitted reconciliation jobs; identical inputs reuse the earlier result."""
+
+    def __init__(self, workers=4, results_dir=None):
+        self.executor = ProcessPoolExecutor(max_workers=workers,
+                                            mp_context=multiprocessing.get_context('spawn'))
+        self._own_dir = results_dir is None
+        self.results_dir = results_dir or tempfile.mkdtemp(prefix='recon-results-')
+        os.makedirs(self.results_dir, exist_ok=True)
+        self.jobs = OrderedDict()
+        self._by_key = {}
+        self._lock = threading.Lock()
+
+    def submit(self, uploads, use_arrow=False, exact=False):
+        h = hashlib.sha1()
+        for slot in sorted(uploads):
+            for name, data, member in uploads[slot]:
+                h.update(f"{slot}:{member}:".encode() + hashlib.sha1(data).digest())
+        key = f"{h.hexdigest()}:{use_arrow}:{exact}"
+        job = {'id': uuid.uuid4().hex[:12], 'key': key, 'state': 'running', 'error': None,
+               'rows': None, 'submitted_at': datetime.utcnow().isoformat(), 'finished_at': None,
+               'files': {slot: len(parts) for slot, parts in uploads.items()}, 'bytes': 0,
+               'path': os.path.join(self.results_dir, hashlib.sha1(key.encode()).hexdigest()
+                                    + ('.parquet' if ARROW_OK else '.csv'))}
+        with self._lock:
+            prev = self.jobs.get(self._by_key.get(key))
+            if prev is not None and (prev['state'] == 'running'
+                                     or prev['state'] == 'done' and os.path.exists(prev['path'])):
+                job['future'] = prev['future']
+            else:
+                job['future'] = self.executor.submit(run_checker_job, uploads, use_arrow, exact, job['path'])
+                self._by_key[key] = job['id']
+            self.jobs[job['id']] = job
+            self._trim()
+        job['future'].add_done_callback(lambda fut, j=job: self._finish(j, fut))
+        return job
+
+    def _finish(self, job, fut):
+        with self._lock:
+            try:
+                job['rows'] = fut.result()
+                job['bytes'] = os.path.getsize(job['path'])
+                job['state'] = 'done'
+            except Exception as e:
+                job['state'], job['error'] = 'failed', f"{type(e).__name__}: {e}"
+            job['finished_at'] = datetime.utcnow().isoformat()
+            if job['id'] not in self.jobs:         # trimmed while it was running
+                self._drop_file(job)
+            self._trim()
+
+    def _drop_file(self, job):
+        if all(j['path'] != job['path'] for j in self.jobs.values()):
+            try:
+                os.remove(job['path'])
+            except FileNotFoundError:
+                pass
+
+    def _trim(self):
+        """Drop the oldest jobs beyond MAX_JOBS / MAX_RESULT_MB; a result file
+        goes once no remaining job shares it (identical inputs share one)."""
+        def disk():
+            return sum({j['path']: j['bytes'] for j in self.jobs.values()}.values())
+        while len(self.jobs) > MAX_JOBS or (len(self.jobs) > 1 and disk() > MAX_RESULT_MB * 1e6):
+            old_id, old = self.jobs.popitem(last=False)
+            if self._by_key.get(old['key']) == old_id:
+                del self._by_key[old['key']]
+            if old['state'] == 'done':
+                self._drop_file(old)
+
+    def get(self, job_id):
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def status(self, job):
+        return {k: job[k] for k in ('id', 'state', 'error', 'rows', 'submitted_at', 'finished_at', 'files')}
+
+    def shutdown(self):
+        self.executor.shutdown(cancel_futures=True)
+        if self._own_dir:
+            shutil.rmtree(self.results_dir, ignore_errors=True)
+
+
+# ─────────────────────────────────────────────
+# HTTP handler
+# ─────────────────────────────────────────────
+class _Upload(io.BytesIO):
+    """Multipart file part with the .name/.getvalue() of a Streamlit upload."""
+    def __init__(self, name, data):
+        super().__init__(data)
+        self.name = name
+
+
+def parse_multipart(content_type, body):
+    """multipart/form-data → {field: [_Upload]} (files only)."""
+    msg = email.parser.BytesParser(policy=email.policy.default).parsebytes(
+        b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + body)
+    fields = {}
+    for part in msg.iter_parts():
+        field, fname = part.get_param('name', header='content-disposition'), part.get_filename()
+        if field and fname:
+            fields.setdefault(field, []).append(_Upload(fname, part.get_payload(decode=True) or b''))
+    return fields
+
+
+class ReconHandler(BaseHTTPRequestHandler):
+    queue = None                      # set by serve()
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, fmt, *args):  # keep the console quiet
+        pass
+
+    def _json(self, code, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _route(self):
+        url = urlparse(self.path)
+        return [p for p in url.path.split('/') if p], {k: v[-1] for k, v in parse_qs(url.query).items()}
+
+    def do_GET(self):
+        parts, query = self._route()
+        if parts == ['health']:
+            return self._json(200, {'ok': True, 'parquet': ARROW_OK})
+        if parts == ['jobs']:
+            with self.queue._lock:
+                jobs = [self.queue.status(j) for j in self.queue.jobs.values()]
+            return self._json(200, {'jobs': jobs})
+        if len(parts) in (2, 3) and parts[0] == 'jobs':
+            job = self.queue.get(parts[1])
+            if job is None:
+                return self._json(404, {'error': 'unknown job'})
+            if len(parts) == 2:
+                return self._json(200, self.queue.status(job))
+            if parts[2] == 'result':
+                return self._result(job, query.get('format', 'csv'))
+        self._json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        parts, query = self._route()
+        if parts != ['jobs']:
+            return self._json(404, {'error': 'not found'})
+        ctype = self.headers.get('Content-Type', '')
+        if not ctype.startswith('multipart/form-data'):
+            return self._json(415, {'error': 'send the reports as multipart/form-data'})
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        fields = parse_multipart(ctype, body)
+        missing = [s for s in REQUIRED_SLOTS if s not in fields]
+        if missing:
+            return self._json(400, {'error': f"missing report(s): {', '.join(missing)}",
+                                    'fields': list(UPLOAD_SLOTS)})
+        try:
+            uploads = {slot: upload_parts(files) for slot, files in fields.items() if slot in UPLOAD_SLOTS}
+        except Exception as e:
+            return self._json(400, {'error': str(e)})
+        job = self.queue.submit(uploads, use_arrow=query.get('arrow') == '1',
+                                exact=query.get('exact') == '1')
+        self._json(202, self.queue.status(job))
+
+    def _result(self, job, fmt):
+        if job['state'] == 'failed':
+            return self._json(500, self.queue.status(job))
+        if job['state'] != 'done':
+            return self._json(409, self.queue.status(job))
+        path = job['path']
+        if not os.path.exists(path):
+            return self._json(410, dict(self.queue.status(job), error='result expired'))
+        stored = 'parquet' if path.endswith('.parquet') else 'csv'
+        if fmt not in ('csv', 'parquet'):
+            return self._json(400, {'error': "format must be csv or parquet"})
+        if fmt == 'parquet' and stored != 'parquet':
+            return self._json(501, {'error': 'Parquet output needs pyarrow'})
+        ctype = 'application/vnd.apache.parquet' if fmt == 'parquet' else 'text/csv'
+        if fmt == stored:
+            return self._stream(ctype, f"{job['id']}.{fmt}", _file_chunks(path))
+        return self._stream(ctype, f"{job['id']}.csv", _parquet_csv_chunks(path))
+
+    def _stream(self, ctype, filename, chunks):
+        """Chunked transfer — rows go out as they are serialized."""
+        self.send_response(200)
+        self.send_header('Content-Type', ctype)
+        self.send_header('Content-Disposition', f'attachment; filename="{filename}"')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for chunk in chunks:
+            if len(chunk):
+                self.wfile.write(f"{len(chunk):X}\r\n".encode() + bytes(chunk) + b"\r\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+
+def _file_chunks(path):
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(FILE_CHUNK)
+            if not chunk:
+                return
+            yield chunk
+
+
+def _parquet_csv_chunks(path):
+    """A Parquet result as CSV, STREAM_CHUNK_ROWS rows at a time."""
+    import pyarrow.parquet as pq
+    first = True
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=STREAM_CHUNK_ROWS):
+        yield batch.to_pandas().to_csv(index=False, header=first).encode()
+        first = False
+
+
+def serve(host='127.0.0.1', port=8765, workers=4, results_dir=None):
+    """Build the job queue + threaded HTTP server (call .serve_forever() on it)."""
+    ReconHandler.queue = JobQueue(workers, results_dir)
+    server = ThreadingHTTPServer((host, port), ReconHandler)
+    server.daemon_threads = True
+    return server
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    ap.add_argument('--host', default='127.0.0.1')
+    ap.add_argument('--port', type=int, default=8765)
+    ap.add_argument('--workers', type=int, default=4)
+    ap.add_argument('--results', help='folder for result files (default: a temp folder removed on exit)')
+    args = ap.parse_args()
+    srv = serve(args.host, args.port, args.workers, args.results)
+    print(f"Reconciliation service on http://{args.host}:{args.port} ({args.workers} workers)")
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ReconHandler.queue.shutdown()
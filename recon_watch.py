@@ -0,0 +1,294 @@
+"""
+Folder ingestion: watch a directory for Myntra report downloads and keep each
+month reconciled without uploading by hand.
+
+Files are recognised by their header row (recon_core.classify_report), not by
+name. The folder is polled; a burst of new files is debounced into one batch,
+only the new or changed files are parsed, and each month the batch touched is
+recomputed once. The month is the first sub-folder under the watched directory
+(reports/January 2026/PG_Forward.csv), else the default label.
+
+    python recon_watch.py /shared/myntra --month "January 2026"
+
+Run standalone, each recomputed month is written as CSV under
+<dir>/_reconciled/<month>/. Inside the dashboard the same watcher runs as a
+background thread (set RECON_WATCH_DIR) and saves each batch to the database.
+No Streamlit calls in here.
+"""
+import argparse
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+import zipfile
+from datetime import datetime
+
+import pandas as pd
+
+from recon_core import (
+    READABLE_EXT, UPLOAD_SLOTS, build_checker, checker_export, checker_frames, classify_report,
+    part_bytes, part_label, rank_rows, read_table, settlement_rows, upload_parts,
+)
+from recon_jobs import collect_parses, make_parse_executor, submit_parses
+
+WATCH_EXT = READABLE_EXT + ('.zip',)
+POLL_SECONDS = 2.0
+DEBOUNCE_SECONDS = 10.0   # quiet period after the last change before a batch runs
+BATCH_LOG = 20
+REQUIRED_SLOTS = ('pg_fwd', 'pg_rev', 'sales')
+
+
+class _DiskFile(io.BytesIO):
+    """File read from the watched folder, with the .name/.getvalue() of an upload."""
+    def __init__(self, name, data):
+        super().__init__(data)
+        self.name = name
+
+
+def scan_folder(root, depth=1):
+    """{path: (size, mtime_ns)} of report files in `root` and its month sub-folders.
+
+    Hidden and '_'-prefixed entries (e.g. the _reconciled output) are skipped.
+    """
+    found = {}
+    for entry in os.scandir(root):
+        if entry.name.startswith(('.', '_')):
+            continue
+        if entry.is_dir():
+            if depth:
+                found.update(scan_folder(entry.path, depth - 1))
+        elif entry.is_file() and entry.name.lower().endswith(WATCH_EXT):
+            st = entry.stat()
+            found[entry.path] = (st.st_size, st.st_mtime_ns)
+    return found
+
+
+def classify_file(name, data):
+    """[(slot or None, (name, data, member))] — one entry per file or ZIP member."""
+    out = []
+    for part in upload_parts(_DiskFile(name, data)):
+        _, _, member = part
+        try:
+            header = read_table(member or name, part_bytes(data, member), nrows=0).columns
+            out.append((classify_report(header), part))
+        except Exception:
+            out.append((None, part))
+    return out
+
+
+def reconcile_month(futures, exact=False):
+    """A month's parse futures → what a manual save stores.
+
+    Returns {'frames': the five frames, 'checker': build_checker output,
+    'sales_id', 'price_col'}. Raises ValueError while a required report is
+    missing or a file fails to parse.
+    """
+    parsed, errors = collect_parses(futures)
+    if errors:
+        raise ValueError('; '.join(errors.values()))
+    missing = [UPLOAD_SLOTS[s] for s in REQUIRED_SLOTS if s not in parsed]
+    if missing:
+        raise ValueError(f"waiting for {', '.join(missing)}")
+    frames, sales_id, price_col = checker_frames(parsed)
+    if not price_col:
+        raise ValueError("Cannot find seller_price in the Sales sheet")
+    checker = build_checker(frames['sales'], frames['pg_fwd'], frames['pg_rev'], frames['rto'], frames['rt'],
+                            sales_id, price_col, exact=exact)
+    return {'frames': frames, 'checker': checker, 'sales_id': sales_id, 'price_col': price_col}
+
+
+class FolderWatcher:
+    """Polls `root` and hands every month touched by a batch to
+    on_batch(month, futures, input_key).
+
+    futures is {slot: [(label, future)]} over every file of the month, as from
+    recon_jobs.submit_parses; files seen in an earlier batch keep their
+    finished parse, so only new files are parsed. A batch runs once no file
+    has changed for `debounce` seconds, so a burst of downloads triggers one
+    recompute. on_batch runs on the watcher thread.
+    """
+
+    def __init__(self, root, on_batch, executor=None, month_label=None, use_arrow=False,
+                 debounce=DEBOUNCE_SECONDS, poll=POLL_SECONDS):
+        self.root = os.path.normpath(root)
+        self.on_batch = on_batch
+        self.executor = executor or make_parse_executor()
+        self.default_month = month_label or datetime.now().strftime("%B %Y")
+        self.use_arrow, self.debounce, self.poll = use_arrow, debounce, poll
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._seen = {}          # path -> (size, mtime_ns) at the last poll
+        self._pending = set()    # changed paths waiting for the quiet period
+        self._last_change = 0.0
+        self._files = {}         # path -> {'month', 'digest', 'parts', 'futures'}
+        self.unrecognised = {}   # path -> why (part of) it was not ingested
+        self.batches = []        # recent batches, newest last
+
+    # ── polling ──
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True, name='recon-watch')
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.poll):
+            try:
+                self.tick()
+            except Exception as e:  # keep watching
+                self._log({'months': [], 'files': 0, 'errors': {'watcher': str(e)}})
+
+    def tick(self, now=None):
+        """One poll: note changed files; run the batch once the folder is quiet."""
+        now = time.monotonic() if now is None else now
+        current = scan_folder(self.root) if os.path.isdir(self.root) else {}
+        changed = {p for p, st in current.items() if self._seen.get(p) != st} | (set(self._seen) - set(current))
+        self._seen = current
+        if changed:
+            self._pending |= changed
+            self._last_change = now
+        elif self._pending and now - self._last_change >= self.debounce:
+            paths, self._pending = self._pending, set()
+            return self.ingest(paths)
+        return None
+
+    def month_of(self, path):
+        rel = os.path.relpath(path, self.root).split(os.sep)
+        return rel[0] if len(rel) > 1 else self.default_month
+
+    # ── ingestion ──
+    def ingest(self, paths):
+        """Parse the new/changed `paths` and recompute each month they touch once."""
+        months = set()
+        for path in sorted(paths):
+            with self._lock:
+                old = self._files.pop(path, None)
+                self.unrecognised.pop(path, None)
+            if old:
+                months.add(old['month'])
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read()
+            except FileNotFoundError:
+                continue                       # removed: its month recomputes without it
+            parts, unknown = {}, []
+            try:
+                for slot, part in classify_file(os.path.basename(path), data):
+                    if slot is None:
+                        unknown.append(part_label(os.path.basename(path), part[2]))
+                    else:
+                        parts.setdefault(slot, []).append(part)
+            except (ValueError, zipfile.BadZipFile) as e:
+                unknown.append(str(e))
+            if unknown:
+                with self._lock:
+                    self.unrecognised[path] = "header matches no report: " + ', '.join(unknown)
+            if not parts:
+                continue
+            month = self.month_of(path)
+            entry = {'month': month, 'digest': hashlib.sha1(data).hexdigest(), 'parts': parts,
+                     'futures': submit_parses(self.executor, parts, self.use_arrow)}
+            with self._lock:
+                self._files[path] = entry
+            months.add(month)
+
+        errors = {}
+        for month in sorted(months):
+            if not self.futures(month):
+                continue
+            try:
+                self.on_batch(month, self.futures(month), self.input_key(month))
+            except Exception as e:
+                errors[month] = str(e)
+        batch = {'months': sorted(months), 'files': len(paths), 'errors': errors}
+        self._log(batch)
+        return batch
+
+    def _log(self, batch):
+        with self._lock:
+            self.batches = (self.batches + [dict(batch, at=datetime.now())])[-BATCH_LOG:]
+
+    # ── views for the dashboard ──
+    def _month_files(self, month):
+        with self._lock:
+            return sorted((p, e) for p, e in self._files.items() if e['month'] == month)
+
+    @property
+    def months(self):
+        with self._lock:
+            return sorted({e['month'] for e in self._files.values()})
+
+    def futures(self, month):
+        """{slot: [(label, future)]} over every file of `month`."""
+        out = {}
+        for _, entry in self._month_files(month):
+            for slot, futs in entry['futures'].items():
+                out.setdefault(slot, []).extend(futs)
+        return out
+
+    def uploads(self, month):
+        """{slot: [(name, bytes, member)]}, as upload_parts would give for the month's files."""
+        out = {}
+        for _, entry in self._month_files(month):
+            for slot, parts in entry['parts'].items():
+                out.setdefault(slot, []).extend(parts)
+        return out
+
+    def input_key(self, month):
+        """Identifies the month's current file set — changes when any file does."""
+        h = hashlib.sha1(month.encode())
+        for path, entry in self._month_files(month):
+            h.update(f"{os.path.basename(path)}:{entry['digest']}".encode())
+        return 'watch:' + h.hexdigest() + (':arrow' if self.use_arrow else '')
+
+
+# ─────────────────────────────────────────────
+# Standalone: write each recomputed month as CSV
+# ─────────────────────────────────────────────
+def write_month(out_dir, month, futures, input_key):
+    """reconcile_month + the rollups a save stores, written under out_dir/<month>/."""
+    res = reconcile_month(futures)
+    pg_fwd, pg_rev = res['frames']['pg_fwd'], res['frames']['pg_rev']
+    tables = {
+        'output_reconciliation': checker_export(res['checker']),
+        'settlement_index': pd.concat([settlement_rows(pg_fwd, 'F', month),
+                                       settlement_rows(pg_rev, 'R', month)], ignore_index=True),
+        'rank_rollup': rank_rows(pg_fwd, pg_rev, month),
+    }
+    dest = os.path.join(out_dir, month)
+    os.makedirs(dest, exist_ok=True)
+    for name, df in tables.items():
+        df.to_csv(os.path.join(dest, f"{name}.csv"), index=False)
+    with open(os.path.join(dest, 'manifest.json'), 'w') as f:
+        json.dump({'month': month, 'input_key': input_key, 'computed_at': datetime.now().isoformat(),
+                   'files': {slot: [label for label, _ in futs] for slot, futs in futures.items()},
+                   'rows': {name: len(df) for name, df in tables.items()}}, f, indent=2)
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    ap.add_argument('directory')
+    ap.add_argument('--month', help='label for files directly in the directory (default: this month)')
+    ap.add_argument('--out', help='output folder (default: <directory>/_reconciled)')
+    ap.add_argument('--debounce', type=float, default=DEBOUNCE_SECONDS)
+    ap.add_argument('--poll', type=float, default=POLL_SECONDS)
+    ap.add_argument('--arrow', action='store_true', help='parse CSVs with the Arrow engine')
+    args = ap.parse_args()
+    out_dir = args.out or os.path.join(args.directory, '_reconciled')
+    watcher = FolderWatcher(args.directory, lambda m, futs, key: write_month(out_dir, m, futs, key),
+                            month_label=args.month, use_arrow=args.arrow,
+                            debounce=args.debounce, poll=args.poll)
+    print(f"Watching {args.directory} (batches after {args.debounce:g}s quiet) → {out_dir}")
+    try:
+        while True:
+            batch = watcher.tick()
+            if batch:
+                print(f"{datetime.now():%H:%M:%S} {batch['files']} file(s) → {', '.join(batch['months']) or '-'}"
+                      + ''.join(f"\n  {m}: {e}" for m, e in batch['errors'].items()))
+            time.sleep(args.poll)
+    except KeyboardInterrupt:
+        pass
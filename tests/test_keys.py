@@ -0,0 +1,23 @@
+import numpy as np
+import pandas as pd
+
+from recon_core import MISSING_KEY, KeyDict, estimate_outer_join, guarded_outer_merge
+
+
+def test_blank_ids_get_the_missing_key():
+    # NaN, '' and pandas 2's stringified NaN never get a real code
+    keys, (codes,) = KeyDict.from_columns(pd.Series(['A', '', ' ', None, np.nan, 'nan', ' A ']))
+    assert codes.tolist() == [0] + [MISSING_KEY] * 5 + [0]
+    assert keys.decode(codes).tolist() == ['A'] + [None] * 5 + ['A']
+
+
+def test_guarded_merge_keeps_blank_packet_ids_unmatched():
+    fwd = pd.DataFrame({'_pid': [0, 1, MISSING_KEY], 'amt': [10.0, 20.0, 30.0]})
+    sales = pd.DataFrame({'_pid': [1, MISSING_KEY, MISSING_KEY, 2], 'inv': [1.0, 2.0, 3.0, 4.0]})
+    assert estimate_outer_join(fwd['_pid'], sales['_pid']) == 6
+
+    merged, dups = guarded_outer_merge(fwd, sales, '_pid', labels=('PG Forward', 'Sales'))
+    assert len(merged) == 6 and dups.empty
+    blank = merged[merged['_pid'] == MISSING_KEY]
+    assert sorted(blank['_merge'].astype(str)) == ['left_only', 'right_only', 'right_only']
+    assert merged.loc[merged['_pid'] == 1, '_merge'].astype(str).tolist() == ['both']
@@ -0,0 +1,28 @@
+import pandas as pd
+
+from recon_core import load_rate_card, validate_charges
+
+
+def _card():
+    return load_rate_card(pd.DataFrame({
+        'article_type': ['Kurtas', 'Kurtas', 'Tops'],
+        'shipment_zone_classification': ['local'] * 3,
+        'price_min': [0, 500, 0], 'price_max': [499.99, 5000, 5000],
+        'commission_pct': [10, 20, 15], 'logistics_fee': [50, 70, 60],
+    }))
+
+
+def test_negative_reverse_amounts_use_the_slab_of_the_absolute_price():
+    pg_rev = pd.DataFrame({
+        'order_release_id': ['1', '2', '3', '4'],
+        'article_type': ['Kurtas', 'Kurtas', 'Tops', 'Kurtas'],
+        'shipment_zone_classification': ['local'] * 4,
+        'seller_product_amount': [-300.0, -800.0, -600.0, -1e12],
+        'total_commission': [-30.0, -160.0, -90.0, 0.0],
+        'total_logistics_deduction': [-50.0, -70.0, -60.0, 0.0],
+    })
+    out = validate_charges(pg_rev, _card(), 'R')
+    assert out['slab_found'].tolist() == [True, True, True, False]
+    assert out['expected_commission'].tolist()[:3] == [30.0, 160.0, 90.0]
+    assert out['expected_logistics'].tolist()[:3] == [50.0, 70.0, 60.0]
+    assert out['overcharge'].tolist() == [0.0] * 4